@@ -0,0 +1,36 @@
+#!/bin/bash
+# Same RDFs as PROC_RDFs_step01_generate_index.bash + PROC_RDFs_step02_compute_RDFs.sbatch, without GROMACS:
+# NMPHTH--NMPHTH and NMPHTH--TBA centre-of-geometry RDFs (part_res_cog) in one pass (see bin/compute_RDFs.py).
+
+
+polymer="PMAP"
+#polymer="PEPP"
+#polymer="PVBP"
+solvent="DME"; cation="TBA";anion="PF6"
+N="30" # degree of polymerization
+TEMP="300"
+replica="D"
+SAMPLE="1-relax-100ns-whole.gro"
+
+dt=250    # as in PROC_RDFs_step02_compute_RDFs.sbatch
+bin=0.02  # as in PROC_RDFs_step02_compute_RDFs.sbatch (nm)
+NWORKERS=1
+
+currentFOLDER=${PWD}
+REPOBASE="${currentFOLDER}/../.."
+
+#for percent in "05" "10" "20" ; do
+#  for charge in "000" "020" "060" ; do
+for percent in "05" ; do
+  for charge in "000" ; do
+
+    FOLDER="${REPOBASE}/configurations/${polymer}${charge}charge_${solvent}_${cation}${anion}_${percent}percent/relax-${N}mer-${TEMP}K-${replica}"
+
+    echo "${TEMP}K"
+    echo "${FOLDER}"
+
+    python ${REPOBASE}/bin/compute_RDFs.py -s ${FOLDER}/${SAMPLE} -r ${polymer} --map-file ${REPOBASE}/mappings_${polymer}.json \
+                                           --cation ${cation} --dt ${dt} --bin ${bin} -j ${NWORKERS} -o ${FOLDER}
+
+  done
+done
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Connectivity of the coupling network of the MONOMERs: for each frame, the graph of the pairs weighted by their electronic
+coupling (sparse CSR adjacency; see `src/coupling_graph.py`), its connected components and largest cluster, and, scanning a
+cutoff on the coupling, the percolation threshold (the weakest coupling needed for the largest cluster to span `--fraction`
+of the MONOMERs).
+
+Two files are written to `--output-dir`: `coupling_network_percolation.csv` (per cutoff: mean and standard deviation over
+the frames of the fraction of MONOMERs in the largest cluster, of the number of clusters, and of the mean cluster size) and
+`coupling_network_summary.json` (per frame and averaged: edges, components, largest cluster, percolation threshold).
+
+USAGE:
+  python analyze_coupling_network.py --couplings couplings.npy
+  python analyze_coupling_network.py --couplings couplings.csv --pairs-info pairs_info_cutoff09A.dat --n-monomers 10000
+"""
+
+import os
+import argparse
+import json
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Connected components and percolation threshold of the coupling network of the MONOMERs.')
+    parser.add_argument('--couplings'     , required=True, type=str  , help='couplings (eV): pair records of log10overlap_to_ECeV.py (.npy) or couplings.csv')
+    parser.add_argument('--pairs-info'    , default=None , type=str  , help='pairs_info_*.dat file of the run (needed with couplings.csv)')
+    parser.add_argument('--n-monomers'    , default=None , type=int  , help='number of MONOMERs; default = those found in the pairs')
+    parser.add_argument('--log-cutoff-min', default=-6.  , type=float, help='weakest cutoff on the coupling (log10 eV); default = -6')
+    parser.add_argument('--log-cutoff-max', default=-1.  , type=float, help='strongest cutoff on the coupling (log10 eV); default = -1')
+    parser.add_argument('--n-cutoffs'     , default=51   , type=int  , help='number of cutoffs scanned; default = 51')
+    parser.add_argument('--fraction'      , default=0.5  , type=float, help='fraction of the MONOMERs in the largest cluster at the percolation threshold; default = 0.5')
+    parser.add_argument('-o', '--output-dir', default='.', type=str  , help='folder of the output files; default = .')
+    parser.add_argument('--verbose'       , default=False, type=lambda s: s == 'True', help='True if you want the results of each frame printed')
+    args = parser.parse_args()
+    # Heavy modules are imported only now, i.e., after the arguments have been parsed (fast `--help`)
+    import numpy as np
+    import src.coupling_graph as srccouplinggraph
+
+    table = srccouplinggraph.load_pair_table(args.couplings, args.pairs_info)
+    log_cutoffs = np.linspace(args.log_cutoff_min, args.log_cutoff_max, args.n_cutoffs)
+    print(f"- INFO - {len(table['coupling'])} pairs read from {args.couplings}; {args.n_cutoffs} cutoffs from {args.log_cutoff_min} to {args.log_cutoff_max} (log10 eV).")
+    frames = srccouplinggraph.analyze_network(table, log_cutoffs, args.n_monomers, args.fraction, VERBOSE=args.verbose)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    percolation_file = os.path.join(args.output_dir, 'coupling_network_percolation.csv')
+    columns = ["largest_fraction", "n_components", "mean_cluster_size"]
+    curves = {column: np.array([frame["curve"][column] for frame in frames]) for column in columns}
+    with open(percolation_file, 'w') as f:
+        f.write("log10_cutoff_eV," + ",".join(f"{column}_mean,{column}_std" for column in columns) + "\n")
+        for k, log_cutoff in enumerate(log_cutoffs):
+            f.write(f"{log_cutoff:.4f}," + ",".join(f"{np.mean(curves[column][:, k]):.6g},{np.std(curves[column][:, k]):.6g}" for column in columns) + "\n")
+
+    thresholds = np.array([frame["percolation_threshold"] for frame in frames])
+    summary = {"couplings_file": args.couplings,
+               "n_frames"      : len(frames),
+               "fraction"      : args.fraction,
+               "percolation_threshold_mean": float(np.nanmean(thresholds)) if np.any(np.isfinite(thresholds)) else None,
+               "percolation_threshold_std" : float(np.nanstd(thresholds)) if np.any(np.isfinite(thresholds)) else None,
+               "frames"        : [{key: (None if key == "percolation_threshold" and not np.isfinite(value) else value)
+                                   for key, value in frame.items() if key != "curve"} for frame in frames]}
+    summary_file = os.path.join(args.output_dir, 'coupling_network_summary.json')
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"- INFO - largest cluster (all pairs): {np.mean([frame['largest_cluster'] for frame in frames]):.1f} of {frames[0]['n_nodes']} MONOMERs on average over {len(frames)} frames.")
+    print(f"**DONE** Percolation threshold: log10 V = {summary['percolation_threshold_mean']} eV; curves in {percolation_file}, summary in {summary_file}.")
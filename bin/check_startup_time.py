@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Check the start-up time of the entry points in `bin/` against the budgets in `lib/startup_budgets.json`.
+
+Each entry point is launched a few times in a fresh interpreter, in a temporary folder, and the best wall time is
+compared to its budget; the exit status is 1 if any budget is exceeded. An entry is either the `--help` of a script
+(imports and argument parsing only) or a real, fast path of it on a small input: `"script"` (default: the name of the
+entry), `"args"`, and `"setup"` commands run once, untimed, before (e.g., writing a synthetic morphology); "{python}",
+"{bin}", and "{repo}" are replaced in both. Modules listed in `"forbidden_imports"` (e.g., TensorFlow on the NumPy
+inference path) must not be imported (`python -X importtime`). With `--importtime`, the slowest imports are listed too.
+
+USAGE:
+  python check_startup_time.py [--repeats 5] [--importtime True]
+"""
+
+import os, sys
+import argparse
+import json
+import subprocess
+import tempfile
+import time
+
+
+BINDIR  = os.path.realpath(os.path.dirname(__file__))
+REPODIR = os.path.dirname(BINDIR)
+
+
+def expand(arguments):
+    """
+    Replaces "{python}", "{bin}", and "{repo}" in the `arguments` of an entry.
+    """
+    return [argument.replace("{python}", sys.executable).replace("{bin}", BINDIR).replace("{repo}", REPODIR) for argument in arguments]
+
+
+def time_entry_point(script, script_args, repeats, cwd):
+    """
+    Returns the best wall time (s) out of `repeats` launches of `script` (in `cwd`) and its exit status.
+    """
+    timings = []
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        result = subprocess.run([sys.executable, os.path.join(BINDIR, script)] + script_args,
+                                cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - begin)
+    return min(timings), result.returncode
+
+
+def import_times(script, script_args, cwd):
+    """
+    Returns the imports (name, cumulative time in s, top level or not) of `script`, from `python -X importtime`.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(BINDIR, script)] + script_args,
+                            cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        imports.append((name.strip(), int(cumulative) / 1e6, not name.startswith('  '))) # nested imports are indented
+    return imports
+
+
+def slowest_imports(imports, n_top=10):
+    """
+    Returns the `n_top` slowest top-level imports (cumulative time, s) out of those of `import_times`.
+    """
+    return sorted(((cumulative, name) for name, cumulative, top_level in imports if top_level), reverse=True)[:n_top]
+
+
+def forbidden_imports(imports, forbidden):
+    """
+    Returns the `forbidden` modules (and their submodules) found among the imports of `import_times`.
+    """
+    return sorted({name.split('.')[0] for name, _, _ in imports if name.split('.')[0] in forbidden})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the start-up time of the entry points in bin/ against their budgets.')
+    parser.add_argument('--budgets'   , default=os.path.join(BINDIR, 'lib', 'startup_budgets.json'), type=str, help='JSON file with the budgets')
+    parser.add_argument('--repeats'   , default=5    , type=int, help='number of launches per entry point (the best one counts); default = 5')
+    parser.add_argument('--importtime', default=False, type=lambda s: s == 'True', help='True if you want the slowest imports of each entry point')
+    args = parser.parse_args()
+
+    with open(args.budgets) as json_budgets:
+        budgets = json.load(json_budgets)
+
+    over_budget = []
+    print(f"{'entry point':50s} {'time (s)':>9s} {'budget (s)':>11s}")
+    for entry, budget in budgets.items():
+        script, script_args = budget.get("script", entry), expand(budget["args"])
+        with tempfile.TemporaryDirectory(prefix='startup_') as workdir:
+            for command in budget.get("setup", []):
+                if subprocess.run(expand(command), cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0:
+                    sys.exit(f"ERROR! The setup of {entry} failed ({' '.join(expand(command))}). Exiting...")
+            elapsed, returncode = time_entry_point(script, script_args, args.repeats, workdir)
+            imports = import_times(script, script_args, workdir) if (args.importtime or budget.get("forbidden_imports")) else []
+        forbidden = forbidden_imports(imports, budget.get("forbidden_imports", []))
+        status = ("OK" if elapsed <= budget["budget_s"] else "OVER BUDGET") if returncode == 0 else f"FAILED ({returncode})"
+        if forbidden and returncode == 0:
+            status = f"IMPORTS {', '.join(forbidden)}"
+        print(f"{entry:50s} {elapsed:9.3f} {budget['budget_s']:11.3f}  {status}")
+        if status != "OK":
+            over_budget.append(entry)
+        if args.importtime:
+            for cumulative, name in slowest_imports(imports):
+                print(f"    {cumulative:8.3f} s  {name}")
+
+    if over_budget:
+        sys.exit(f"ERROR! {len(over_budget)} entry point(s) over budget, failed, or with forbidden imports: {', '.join(over_budget)}")
+    print("**DONE** All the entry points are within their start-up budget.")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Residue-COG radial distribution functions (e.g., N-methyl-phthalimide--N-methyl-phthalimide and N-methyl-phthalimide--cation).
+
+Replaces the `gmx make_ndx` + `gmx grompp` + `gmx rdf -selrpos part_res_cog -seltype part_res_cog` steps of `analyze/RDFs/`:
+no GROMACS install or TPR is needed (the GRO is enough, the COGs being mass independent), the N-methyl-phthalimide atoms are
+those of `mappings_{polymer}.json`, and all the pairs of groups are computed in one pass over the trajectory (see `src/rdf.py`).
+One `.xvg` file per pair of groups is written, with the names used by the shell scripts (e.g., `rdf_NMPHTHs-TBAs_dt0250bin002.xvg`).
+
+USAGE:
+  python compute_RDFs.py -s 1-relax-100ns-whole.gro -r PMAP --map-file ../mappings_PMAP.json
+  python compute_RDFs.py -s 1-relax-100ns-whole.gro -x traj.xtc -r PMAP --map-file ../mappings_PMAP.json -j 4 \
+         --group PF6s "resname PF6" --pairs NMPHTHs:NMPHTHs NMPHTHs:TBAs TBAs:PF6s
+"""
+
+import os, sys
+import argparse
+import json
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Residue-COG radial distribution functions (gmx rdf -selrpos part_res_cog -seltype part_res_cog).')
+    parser.add_argument('-s', '--topology', required=True, type=str, help='topology with residue names (GRO, TPR, PSF, ...)')
+    parser.add_argument('-f', '--gro-file', default=None , type=str  , help='coordinates, if not in the topology file (e.g., GRO with a TPR)')
+    parser.add_argument('-x', '--traj-file', default=None, type=str  , help='name of XTC/TRR trajectory; if given, the frames are read from it')
+    parser.add_argument('-r', '--resname' , required=True, type=str  , help='name of the residue of the polymer (e.g., "PMAP")')
+    parser.add_argument('--map-file'      , required=True, type=str  , help='name of JSON file containing mappings (N-methyl-phthalimide atoms: "AA")')
+    parser.add_argument('--cation'        , default='TBA', type=str  , help='residue name of the cation (group "{cation}s"); default = TBA')
+    parser.add_argument('--group'         , default=[]   , type=str  , nargs=2, action='append', metavar=('NAME', 'SELECTION'),
+                        help='additional group (MDAnalysis selection), e.g., --group PF6s "resname PF6"; can be repeated')
+    parser.add_argument('--pairs'         , default=None , type=str  , nargs='+', help='pairs of groups "REF:SEL"; default = NMPHTHs:NMPHTHs NMPHTHs:{cation}s')
+    parser.add_argument('--dt'            , default=250. , type=float, help='only use frames every dt ps (as gmx rdf -dt); default = 250')
+    parser.add_argument('--bin'           , default=0.02 , type=float, help='bin width (nm); default = 0.02')
+    parser.add_argument('--rmax'          , default=0.   , type=float, help='largest distance (nm); default = 0 = half of the shortest box edge')
+    parser.add_argument('-j', '--n-workers', default=1   , type=int  , help='number of worker processes analyzing blocks of frames; default = 1 (serial)')
+    parser.add_argument('-o', '--output-dir', default='.', type=str  , help='folder of the .xvg files; default = .')
+    args = parser.parse_args()
+    # Heavy modules are imported only now, i.e., after the arguments have been parsed (fast `--help`)
+    import numpy as np
+    import MDAnalysis as mda
+    import src.rdf as srcrdf
+
+    with open(args.map_file) as json_mappings:
+        mappings = json.load(json_mappings)
+    groups = {"NMPHTHs": f'resname {args.resname} and ({mappings["AA"]})', f"{args.cation}s": f'resname {args.cation}'}
+    groups.update({name: selection for name, selection in args.group})
+    pairs = [tuple(pair.split(':')) for pair in (args.pairs or ["NMPHTHs:NMPHTHs", f"NMPHTHs:{args.cation}s"])]
+    for pair in pairs:
+        if len(pair) != 2 or not all(name in groups for name in pair):
+            sys.exit(f"ERROR! Pair {':'.join(pair)} is not of the form REF:SEL with groups among {', '.join(groups)}. Exiting...")
+
+    mda.stop_logging()
+    if args.traj_file or args.gro_file:
+        u = mda.Universe(args.topology, args.traj_file or args.gro_file)
+    else:
+        u = mda.Universe(args.topology)
+    for name in {name for pair in pairs for name in pair}:
+        n_residues = len(u.select_atoms(groups[name]).residues)
+        if n_residues == 0:
+            sys.exit(f"ERROR! Group {name} ({groups[name]}) is empty. Exiting...")
+        print(f"- INFO - group {name:10s}: {n_residues} residues ({groups[name]})")
+
+    # Bins (Å): up to half of the shortest box edge, as `gmx rdf` (beyond that, the minimum image misses pairs)
+    half_box = 0.5 * min(u.dimensions[:3])
+    r_max = 10. * args.rmax if args.rmax > 0 else half_box
+    if r_max > half_box + 1e-6:
+        sys.exit(f"ERROR! rmax ({r_max/10.} nm) is larger than half of the shortest box edge ({half_box/10.} nm). Exiting...")
+    bin_edges = np.arange(0., r_max + 1e-6, 10. * args.bin)
+
+    FRAMES = srcrdf.select_frames(u, args.dt)
+    n_blocks = max(1, min(len(FRAMES), 4 * args.n_workers))
+    frame_blocks = [block.tolist() for block in np.array_split(FRAMES, n_blocks)]
+    print(f"- INFO - {len(FRAMES)} frames (every {args.dt} ps) in {n_blocks} blocks by {args.n_workers} worker(s); {len(bin_edges)-1} bins up to {r_max/10.:.3f} nm.")
+
+    config = {"topology" : args.topology,
+              "coord_file": args.gro_file,
+              "traj_file": args.traj_file,
+              "groups"   : groups,
+              "pairs"    : pairs,
+              "bin_edges": bin_edges}
+    r, rdfs, n_frames = srcrdf.compute_rdfs(config, frame_blocks, args.n_workers, u)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    tag = f'dt{int(args.dt):04d}bin0{f"{args.bin:g}".split(".")[-1]}' # as the shell scripts: dt 250, bin 0.02 --> "dt0250bin002"
+    for (ref, sel), rdf in zip(pairs, rdfs):
+        filename = os.path.join(args.output_dir, f'rdf_{ref}_{tag}.xvg' if ref == sel else f'rdf_{ref}-{sel}_{tag}.xvg')
+        srcrdf.write_xvg(filename, r, rdf, sel,
+                         comments=[f"This file was created by {os.path.basename(__file__)} ({' '.join(sys.argv[1:])})",
+                                   f"RDF of the residue COGs of {sel} ({groups[sel]}) around those of {ref} ({groups[ref]}), {n_frames} frames"])
+        print(f"**DONE** g(r) of {ref}--{sel} written to {filename} (first peak at {r[np.argmax(rdf)]/10.:.3f} nm).")
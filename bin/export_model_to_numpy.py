@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Export a trained overlap NN (Keras SavedModel + fitted `X_scaler`/`Y_scaler`) to the compact `.npz` file read by
+the TensorFlow-free NumPy engine (`src/numpy_mlp.py`; `predict_overlaps--pairs.py --backend numpy`).
+
+USAGE:
+  python export_model_to_numpy.py --ML-model ../NN/overlaps-.../distlog100.../trained_model_AA --check True
+"""
+
+import os, sys
+import argparse
+import numpy as np
+import src.prediction as srcprediction
+import src.numpy_mlp as srcnumpymlp
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a trained NN and its scalers to a NumPy weights file.')
+    parser.add_argument('--ML-model'      , required=True, type=str  , help='folder of the trained model (e.g., ".../trained_model_AA")')
+    parser.add_argument('-o', '--output'  , default=None , type=str  , help=f'name of the output file; default = <ML-model>/{srcnumpymlp.NUMPY_WEIGHTS_FILE}')
+    parser.add_argument('--check'         , default=False, type=lambda s: s == 'True', help='True if you want to compare the NumPy engine against Keras')
+    parser.add_argument('--check-features', default=None , type=str  , help='.npy file with (n, n_features) feature vectors for the check; default = samples drawn from the X_scaler statistics')
+    parser.add_argument('--n-samples'     , default=10000, type=int  , help='number of sampled feature vectors for the check; default = 10000')
+    parser.add_argument('--tolerance'     , default=1e-4 , type=float, help='maximum absolute difference (in log overlap) allowed by the check; default = 1e-4')
+    parser.add_argument('--verbose'       , default=True , type=lambda s: s == 'True', help='True if you want verbose output (default behavior)')
+
+    args = parser.parse_args()
+    MODEL_PATH  = args.ML_model
+    OUTPUT_FILE = args.output or os.path.join(MODEL_PATH, srcnumpymlp.NUMPY_WEIGHTS_FILE)
+    VERBOSE     = args.verbose
+
+    model, X_scaler, Y_scaler = srcprediction.load_trained_model(MODEL_PATH)
+    srcnumpymlp.export_model(model, X_scaler, Y_scaler, OUTPUT_FILE, VERBOSE)
+
+    if args.check:
+        if args.check_features:
+            features = np.load(args.check_features).astype(np.float32)
+        else:
+            # Feature vectors drawn from the (Gaussian) statistics of the training set stored in the X_scaler
+            rng = np.random.default_rng(0)
+            n_features = model.layers[0].get_weights()[0].shape[0]
+            features = X_scaler.inverse_transform(rng.standard_normal((args.n_samples, n_features))).astype(np.float32)
+
+        y_keras, y_numpy = srcnumpymlp.compare_with_keras(srcnumpymlp.load_numpy_model(OUTPUT_FILE), model, X_scaler, Y_scaler, features)
+        max_deviation = np.max(np.abs(y_keras - y_numpy))
+        print(f"Max |NumPy - Keras| = {max_deviation:.2e} over {len(features)} feature vectors (tolerance = {args.tolerance:.1e}).")
+
+        # Put the deviation in perspective w/ the error of the model on the shipped TEST set (NN_results_overlaps_AA_*.npy)
+        results_prefix = os.path.join(os.path.dirname(os.path.normpath(MODEL_PATH)), 'NN_results_overlaps_AA')
+        if os.path.exists(f'{results_prefix}_NN.npy') and os.path.exists(f'{results_prefix}_DFT.npy'):
+            y_test_NN  = np.load(f'{results_prefix}_NN.npy')
+            y_test_DFT = np.load(f'{results_prefix}_DFT.npy')
+            rmse = np.sqrt(np.mean((y_test_NN - y_test_DFT)**2))
+            print(f"TEST RMSE (NN vs DFT, shipped results) = {rmse:.3f}; range of the shipped NN predictions = [{np.min(y_test_NN):.2f}, {np.max(y_test_NN):.2f}].")
+            in_range = np.mean((y_numpy >= np.min(y_test_NN) - 1) & (y_numpy <= np.max(y_test_NN) + 1))
+            print(f"{100*in_range:.1f}% of the NumPy predictions fall within the range of the shipped NN predictions (+/- 1).")
+
+        if max_deviation > args.tolerance:
+            sys.exit(f"ERROR! The NumPy engine deviates from Keras by {max_deviation:.2e} > {args.tolerance:.1e}. Exiting...")
+        print("**DONE** The NumPy engine matches Keras within tolerance.")
@@ -9,18 +9,15 @@ USAGE:
 
 import numpy as np
 import matplotlib.pylab as plt
-from sklearn.metrics import mean_squared_error, r2_score
-import time
 import matplotlib as mpl
 import argparse
 import sys
-import seaborn as sns
 from cycler import cycler
 from scipy.stats import skewnorm
-from scipy.signal import find_peaks
+import src.pair_records as srcpairrecords
+import src.distributions as srcdistributions
 
 mpl.rcParams.update({'font.size': 18})  # You can adjust the value as needed
-sns.set_palette("colorblind") # Set the colorblind-friendly palette
 mpl.use('Agg') # set a non-interactive matplotlib backend
 plt.rcParams['font.family'] = 'sans'
 plt.rcParams['font.size'] = 15 # 16
@@ -37,7 +34,7 @@ plt.rcParams["axes.prop_cycle"] = cycler(color=Tol_bright)
 # Parse the arguments
 parser = argparse.ArgumentParser(description='Just plot the data')
 parser.add_argument('--what'      , required=True      , type=str  , help='what it is that we are plotting?')
-parser.add_argument('--verbose'   , default=False      , type=bool , help='more printing...')
+parser.add_argument('--verbose'   , default=False      , type=lambda s: s == 'True', help='more printing...')
 parser.add_argument('--csvfile01' , required=True      , type=str  , help='name of CSV file if not default')
 parser.add_argument('--csvfile02' , default='unknown'  , type=str  , help='name of CSV file if not default')
 parser.add_argument('--csvfile03' , default='unknown'  , type=str  , help='name of CSV file if not default')
@@ -48,6 +45,9 @@ parser.add_argument('--units'     , default='au'       , type=str  , help='units
 parser.add_argument('--label'     , default=''         , type=str  , help='*optional* label to be printed at the top of the graph')
 parser.add_argument('--polymer'   , default=''         , type=str  , help='*optional* label to be printed at the top of the graph')
 parser.add_argument('--percent'   , default=''         , type=str  , help='*optional* percent of solvent')
+parser.add_argument('--fit-method', default='binned'   , type=str  , help='skewed-Gaussian fit on the *binned* counts (fast; default) or on every sample (*exact*; slow, for validation)')
+parser.add_argument('--bootstrap' , default=0          , type=int  , help='number of bootstrap replicas for the 95%% CI of the peak positions; default = 0 (no CI)')
+parser.add_argument('--n-workers' , default=1          , type=int  , help='number of processes running the bootstrap replicas; default = 1')
 
 args = parser.parse_args()
 
@@ -63,6 +63,11 @@ UNITS            = args.units
 LABEL            = args.label
 POLYMER          = args.polymer
 PERCENT          = args.percent
+FIT_METHOD       = args.fit_method
+N_BOOTSTRAP      = args.bootstrap
+N_WORKERS        = args.n_workers
+if FIT_METHOD not in srcdistributions.FIT_METHODS:
+    sys.exit(f"ERROR! Unknown --fit-method {FIT_METHOD}; either {' or '.join(srcdistributions.FIT_METHODS)}. Exiting...")
 if REF:
     if not REFCSVFILE:
         sys.exit(f"Error: requested to plot against reference data (REF = {REF}) but no CSV file which the reference data was provided. Exiting.'")
@@ -76,10 +81,17 @@ if not LABEL:
 
 def load_couplings(CSVFILE):
     """
+    Loads the (log) couplings from a CSV file (e.g., "log_couplings.csv") or from the binary records written by
+    `log10overlap_to_ECeV.py` ("couplings.npy"; memory-mapped, the log10 couplings are used).
     """
-    data = np.genfromtxt(CSVFILE, delimiter=',')
-    IDs       = np.transpose(data)[0].astype(int) # IDs are integers
-    couplings = np.transpose(data)[1]
+    if CSVFILE.endswith('.npy'):
+        records   = srcpairrecords.load_pair_records(CSVFILE)
+        IDs       = np.asarray(records['pair_index'])
+        couplings = np.asarray(records['log_coupling'], dtype=float)
+    else:
+        data = np.genfromtxt(CSVFILE, delimiter=',')
+        IDs       = np.transpose(data)[0].astype(int) # IDs are integers
+        couplings = np.transpose(data)[1]
     print(f'Sizes of the IDs ({len(IDs)}) and couplings ({len(couplings)}) vectors ("as recevied").')
     
     indices_of_zero_coupling = np.argwhere(couplings == 0.0) # get indices of zeros in the overlap
@@ -92,43 +104,15 @@ def load_couplings(CSVFILE):
     return IDs, dataY
 
 
-def remove_zeros(IDs, dataY):
-    """
-    """
-    indices_of_zero_dataY = np.argwhere(dataY == 0.0) # get indices of zeros in the dataY
-    IDs  = np.delete(IDs,  indices_of_zero_dataY)
-    dataY = np.delete(dataY, indices_of_zero_dataY)
-    print(f'Sizes of the IDs ({len(IDs)}) and dataY ({len(dataY)}) vectors (after removing zeros).')
-    return IDs, dataY
-
-
 def load_couplings_and_remove_zeros(CSVFILE):
     """
     """
     IDs, dataY = load_couplings(CSVFILE)
-    IDs, dataY = remove_zeros(IDs, dataY)
+    IDs, dataY = srcdistributions.remove_zeros(IDs, dataY)
     print(f'np.min(dataY) = {np.min(dataY)} log10[eV]; np.max(dataY) = {np.max(dataY)} log10[eV]')
     return IDs, dataY
 
 
-def fit_skewnorm_to_the_data(dataY, initial_guess):
-    """
-    """
-    params = skewnorm.fit(dataY, initial_guess[0], loc=initial_guess[1], scale=initial_guess[2]) # a, log, scale = skewness, mean, st_dev
-    return params
-
-
-def extract_mean_as_peak_position(x, params, dataY, bin_edges):
-    """
-    """
-    pdf_values = skewnorm.pdf(x, *params)*len(dataY) * (bin_edges[1] - bin_edges[0])
-    # Find peaks in the PDF using scipy.signal.find_peaks
-    peaks, _ = find_peaks(pdf_values)
-    # Select the peak with the highest PDF value
-    peak_position = x[peaks[np.argmax(pdf_values[peaks])]]
-    return peak_position
-
-
 # Before starting, CHECK
 if WHAT != "coupling":
     sys.exit("WHAT did you pass to the script? I only understand *coupling*.")
@@ -136,15 +120,15 @@ if WHAT != "coupling":
 
 IDs_1, dataY_1 = load_couplings_and_remove_zeros(CSVFILE_1)
 initial_guess_1 = [10, np.mean(dataY_1)+0.5, np.std(dataY_1)]
-params_1 = fit_skewnorm_to_the_data(dataY_1, initial_guess_1)
+params_1 = srcdistributions.fit_skewnorm_to_the_data(dataY_1, initial_guess_1, method=FIT_METHOD)
 if CSVFILE_2 != "unknown":
     IDs_2, dataY_2 = load_couplings_and_remove_zeros(CSVFILE_2)
     initial_guess_2 = [10, np.mean(dataY_2)+0.5, np.std(dataY_2)]
-    params_2 = fit_skewnorm_to_the_data(dataY_2, initial_guess_2)
+    params_2 = srcdistributions.fit_skewnorm_to_the_data(dataY_2, initial_guess_2, method=FIT_METHOD)
 if CSVFILE_3 != "unknown":
     IDs_3, dataY_3 = load_couplings_and_remove_zeros(CSVFILE_3)
     initial_guess_3 = [10, np.mean(dataY_3)+0.8, np.std(dataY_3)]
-    params_3 = fit_skewnorm_to_the_data(dataY_3, initial_guess_3)
+    params_3 = srcdistributions.fit_skewnorm_to_the_data(dataY_3, initial_guess_3, method=FIT_METHOD)
 
 
 # Actual plot
@@ -164,31 +148,41 @@ if CSVFILE_2 != "unknown" and CSVFILE_3 != "unknown":
     print(f' NP.STD    sigma_1 = {sigma_1}; sigma_2 = {sigma_2}; sigma_3 = {sigma_3}')
     print(f' PARAMS[2] sigma_1 = {params_1[2]}; sigma_2 = {params_2[2]}; sigma_3 = {params_3[2]}')
 
-bin_edges       = np.linspace(-6,1,280) # better (sharper) and more sensitivity for the fit
+bin_edges       = srcdistributions.COUPLING_BIN_EDGES # np.linspace(-6,1,280): better (sharper) and more sensitivity for the fit
 
 # The following 3 lines are just for obtaining bins_1, bins_2, and bins_3, but they'll plot nothing (because of alpha=0.0)
 hist_1      , bins_1      , _ = plt.hist(dataY_1, bins=bin_edges      , density=False,alpha=0.0, color='black')
 x_1 = (bins_1[:-1] + bins_1[1:]) / 2  # Use the bin centers
-peak_position_1 = extract_mean_as_peak_position(x_1, params_1, dataY_1, bin_edges)
+peak_position_1 = srcdistributions.extract_mean_as_peak_position(x_1, params_1, dataY_1, bin_edges)
 average_Vij_from_peak_1  = 10**peak_position_1 # eV
 print(f"The range_Vij_incl_std_1 is from {10**(peak_position_1+params_1[2])} to {10**(peak_position_1-params_1[2])}")
 print(f"The peak is at {peak_position_1}, which means {10**(peak_position_1)} eV")
 if CSVFILE_2 != "unknown":
     hist_2, bins_2, _ = plt.hist(dataY_2, bins=bin_edges, density=False,alpha=0.0, color='black')
     x_2 = (bins_2[:-1] + bins_2[1:]) / 2  # Use the bin centers
-    peak_position_2 = extract_mean_as_peak_position(x_2, params_1, dataY_2, bin_edges)
+    peak_position_2 = srcdistributions.extract_mean_as_peak_position(x_2, params_1, dataY_2, bin_edges)
     average_Vij_from_peak_2  = 10**peak_position_2 # eV
     print(f"The range_Vij_incl_std_2 is from {10**(peak_position_2+params_2[2])} to {10**(peak_position_2-params_2[2])}")
     print(f"The peak is at {peak_position_2}, which means {10**(peak_position_2)} eV")
 if CSVFILE_3 != "unknown":
     hist_3, bins_3, _ = plt.hist(dataY_3, bins=bin_edges, density=False,alpha=0.0, color='#F4B942')
     x_3 = (bins_3[:-1] + bins_3[1:]) / 2  # Use the bin centers
-    peak_position_3 = extract_mean_as_peak_position(x_3, params_3, dataY_3, bin_edges)
+    peak_position_3 = srcdistributions.extract_mean_as_peak_position(x_3, params_3, dataY_3, bin_edges)
     average_Vij_from_peak_3  = 10**peak_position_3 # eV
     print(f"The range_Vij_incl_std_3 is from {10**(peak_position_3+params_3[2])} to {10**(peak_position_3-params_3[2])}")
     print(f"The peak is at {peak_position_3}, which means {10**(peak_position_3)} eV")
 
 
+if N_BOOTSTRAP > 0:
+    def print_bootstrap_CI(dataY, params, label):
+        low, high, _ = srcdistributions.bootstrap_peak_position(dataY, bin_edges, params, method=FIT_METHOD, n_bootstrap=N_BOOTSTRAP, n_workers=N_WORKERS)
+        print(f"95% CI of the peak position {label} ({N_BOOTSTRAP} bootstrap replicas): [{low}, {high}], i.e., <V_ij> in [{10**low}, {10**high}] eV")
+    print_bootstrap_CI(dataY_1, params_1, '(1)')
+    if CSVFILE_2 != "unknown":
+        print_bootstrap_CI(dataY_2, params_2, '(2)')
+    if CSVFILE_3 != "unknown":
+        print_bootstrap_CI(dataY_3, params_3, '(3)')
+
 if CSVFILE_2 != "unknown" and CSVFILE_3 != "unknown":
     print("Position of the peak:", peak_position_1        , peak_position_2        , peak_position_3    )
     print("Means (in eV)       :", average_Vij_from_peak_1, average_Vij_from_peak_2, average_Vij_from_peak_3)
@@ -10,14 +10,13 @@
 # =============================================== #
 import numpy as np
 import matplotlib.pylab as plt
-from sklearn.metrics import mean_squared_error, r2_score
-import time
 import matplotlib as mpl
 import argparse
 import sys
 from cycler import cycler
 from scipy.stats import skewnorm
-from scipy.signal import find_peaks
+import src.pair_records as srcpairrecords
+import src.distributions as srcdistributions
 
 
 mpl.use('Agg') # set a non-interactive matplotlib backend
@@ -41,11 +40,14 @@ plt.rcParams["axes.prop_cycle"] = cycler(color=Tol_bright)
 parser = argparse.ArgumentParser(description='Just plot the data')
 parser.add_argument('--what'      , required=True      , type=str  , help='what it is that we are plotting?')
 parser.add_argument('--v-type'    , default='raw'      , type=str  , help='type of coupling data provided: *raw* or *log')
-parser.add_argument('--verbose'   , default=False      , type=bool , help='more printing...')
-parser.add_argument('--csvfile'   , default='default'  , type=str  , help='name of CSV file if not default')
+parser.add_argument('--verbose'   , default=False      , type=lambda s: s == 'True', help='more printing...')
+parser.add_argument('--csvfile'   , default='default'  , type=str  , help='name of CSV file if not default; a binary file of pair records (.npy) is also accepted')
 parser.add_argument('--units'     , default='au'       , type=str  , help='units; only relevant to MO energies; either "au" or "eV" accepted')
 parser.add_argument('--label'     , default=''         , type=str  , help='*optional* label to be printed at the top of the graph')
 parser.add_argument('--ylim'      , default=None       , type=float, help='y-axis upper limit')
+parser.add_argument('--fit-method', default='binned'   , type=str  , help='skewed-Gaussian fit on the *binned* counts (fast; default) or on every sample (*exact*; slow, for validation)')
+parser.add_argument('--bootstrap' , default=0          , type=int  , help='number of bootstrap replicas for the 95%% CI of the peak position; default = 0 (no CI)')
+parser.add_argument('--n-workers' , default=1          , type=int  , help='number of processes running the bootstrap replicas; default = 1')
 
 args = parser.parse_args()
 
@@ -56,6 +58,11 @@ CSVFILE          = args.csvfile
 UNITS            = args.units
 LABEL            = args.label
 YLIM             = args.ylim
+FIT_METHOD       = args.fit_method
+N_BOOTSTRAP      = args.bootstrap
+N_WORKERS        = args.n_workers
+if FIT_METHOD not in srcdistributions.FIT_METHODS:
+    sys.exit(f"ERROR! Unknown --fit-method {FIT_METHOD}; either {' or '.join(srcdistributions.FIT_METHODS)}. Exiting...")
 if CSVFILE == 'default':
     CSVFILE = f'{WHAT}s.csv'
 print(f"\nParameters (taking into account user input): what={WHAT}, verbose={VERBOSE}; csvfile={CSVFILE}.")
@@ -72,7 +79,16 @@ if not LABEL:
 
 def load_overlaps(CSVFILE, OVERLAP_TYPE):
     """
+    Loads the overlaps from a CSV file or from the binary pair records written by `predict_overlaps--pairs.py`
+    (".npy"; memory-mapped, the predicted overlaps are already in *log* form).
     """
+    if CSVFILE.endswith('.npy'):
+        records = srcpairrecords.load_pair_records(CSVFILE)
+        IDs     = np.asarray(records['pair_index'])
+        dataY   = np.asarray(records['log_overlap'], dtype=float)
+        print(f'Sizes of the IDs ({len(IDs)}) and log10(overlap) ({len(dataY)}) vectors ("as recevied"; binary records).')
+        return IDs, dataY
+
     data = np.genfromtxt(CSVFILE, delimiter=',')
     IDs      = np.transpose(data)[0].astype(int) # IDs are integers
     if "predicted" in CSVFILE:
@@ -105,34 +121,6 @@ def load_overlaps(CSVFILE, OVERLAP_TYPE):
     return IDs, dataY
 
 
-def remove_zeros(IDs, dataY):
-    """
-    """
-    indices_of_zero_dataY = np.argwhere(dataY == 0.0) # get indices of zeros in the dataY
-    IDs  = np.delete(IDs,  indices_of_zero_dataY)
-    dataY = np.delete(dataY, indices_of_zero_dataY)
-    print(f'Sizes of the IDs ({len(IDs)}) and dataY ({len(dataY)}) vectors (after removing zeros).')
-    return IDs, dataY
-
-
-def fit_skewnorm_to_the_data(dataY, initial_guess):
-    """
-    """
-    params = skewnorm.fit(dataY, initial_guess[0], loc=initial_guess[1], scale=initial_guess[2]) # a, log, scale = skewness, mean, st_dev
-    return params
-
-
-def extract_mean_as_peak_position(x, params, dataY, bin_edges):
-    """
-    """
-    pdf_values = skewnorm.pdf(x, *params)*len(dataY) * (bin_edges[1] - bin_edges[0])
-    # Find peaks in the PDF using scipy.signal.find_peaks
-    peaks, _ = find_peaks(pdf_values)
-    # Select the peak with the highest PDF value
-    peak_position = x[peaks[np.argmax(pdf_values[peaks])]]
-    return peak_position
-
-
 if WHAT=="overlap":
 
     IDs , dataY = load_overlaps(CSVFILE, OVERLAP_TYPE)
@@ -142,7 +130,7 @@ else:
     sys.exit("WHAT did you pass to the script? I only understand *overlap*.")
 
 
-IDs, dataY = remove_zeros(IDs, dataY)
+IDs, dataY = srcdistributions.remove_zeros(IDs, dataY)
 
 
 if WHAT=="overlap":
@@ -153,14 +141,18 @@ if WHAT=="overlap":
         plt.title(f"{LABEL}")
         #plt.title(r"Distribution of $\log_{10}\langle\phi_{SOMO}|\phi_{LUMO}\rangle$")
 
-    bin_edges = np.linspace(-8,-1,100)
+    bin_edges = srcdistributions.OVERLAP_BIN_EDGES
     hist, binss, _ = plt.hist(dataY, bins=bin_edges,density=False,alpha=0.0,color='black')
 
     # Fit a skewed gaussian
     initial_guess = [100, np.mean(dataY), np.std(dataY)]
-    params = fit_skewnorm_to_the_data(dataY, initial_guess)
+    params = srcdistributions.fit_skewnorm_to_the_data(dataY, initial_guess, method=FIT_METHOD)
     x = (binss[:-1] + binss[1:]) / 2  # Use the bin centers
-    peak_position = extract_mean_as_peak_position(x, params, dataY, bin_edges)
+    peak_position = srcdistributions.extract_mean_as_peak_position(x, params, dataY, bin_edges)
+    print(f"The peak ({FIT_METHOD} fit) is at {peak_position}")
+    if N_BOOTSTRAP > 0:
+        low, high, _ = srcdistributions.bootstrap_peak_position(dataY, bin_edges, params, method=FIT_METHOD, n_bootstrap=N_BOOTSTRAP, n_workers=N_WORKERS)
+        print(f"95% CI of the peak position ({N_BOOTSTRAP} bootstrap replicas): [{low}, {high}]")
 
     # Actual plot
     hist, binss, _ = plt.hist(dataY, bins=bin_edges, label=r'$\mu=$'+f'{round(peak_position,3)} (pred.)',density=False,alpha=0.7)
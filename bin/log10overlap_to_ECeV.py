@@ -1,13 +1,24 @@
 #!/usr/bin/env python
 # coding: utf-8
 """
-USAGE: 
+USAGE:
   python log10overlap_to_ALMOeV.py --overlaps_file overlaps.csv
+  python log10overlap_to_ALMOeV.py --overlaps_file pairs_predicted_cutoff09A.npy  # binary pair records (also writes couplings.npy)
+
+The overlaps are read, converted, and written in chunks of `--chunk-size` pairs (memory bounded by the chunk size).
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 import argparse
+import itertools
+import src.pair_records as srcpairrecords
+
+
+# Binary output for text (CSV) inputs, which only carry the IDs and the overlaps
+COUPLING_VALUES_DTYPE = np.dtype([('pair_index'  , '<i4'),
+                                  ('log_overlap' , '<f4'),
+                                  ('log_coupling', '<f4'),
+                                  ('coupling'    , '<f4')])
 
 
 def from_log_overlap_to_ec_in_eV(slope, intercept, log10_of_overlap):
@@ -20,58 +31,94 @@ def from_log_overlap_to_log_ec(slope, intercept, log10_of_overlap):
     """
     return (log10_of_overlap - intercept)/slope
 
+
+def read_overlaps_in_chunks(overlaps_file, chunk_size):
+    """
+    Yields (IDs, log10 overlaps, pair records or None) in chunks of `chunk_size` pairs, from either a CSV file
+    (ID, overlap[, ...]) or a binary file of pair records (memory-mapped).
+    """
+    if overlaps_file.endswith('.npy'):
+        records = srcpairrecords.load_pair_records(overlaps_file)
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start+chunk_size]
+            yield srcpairrecords.format_IDs(chunk['pair_index']), chunk['log_overlap'].astype(float), chunk
+    else:
+        with open(overlaps_file) as f:
+            while True:
+                lines = list(itertools.islice(f, chunk_size))
+                if not lines:
+                    break
+                IDs      = np.loadtxt(lines, delimiter=',', dtype=str, usecols=(0,), ndmin=1) # IDs kept as strings (zero-padded)
+                overlaps = np.loadtxt(lines, delimiter=',', dtype=float, usecols=(1,), ndmin=1)
+                yield IDs, overlaps, None
+
+
+def write_values(output, IDs, values):
+    """
+    Writes "ID,value" lines (value w/ 7 decimals) in one go.
+    """
+    output.write("".join(f"{ID},{value:.7f}\n" for ID, value in zip(IDs, values.tolist())))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert the log10 overlaps to ALMO electronic couplings (eV).")
     parser.add_argument("--overlaps_file", type=str  , required=True, help="Path to a file containing coupling values")
     parser.add_argument('--verbose'      ,             default=True , help='True if you want verbose output (default behavior)')
     parser.add_argument('--slope'        , type=float, required=True, help='slope     of linear relationship between log(overlaps) and log(couplings)')
     parser.add_argument('--intercept'    , type=float, required=True, help='intercept of linear relationship between log(overlaps) and log(couplings)')
+    parser.add_argument('--chunk-size'   , type=int  , default=1000000, help='number of pairs read, converted, and written at once; default = 1000000')
+    parser.add_argument('--output-format', type=str  , default=None , help='*text* (couplings.csv + log_couplings.csv), *npy* (couplings.npy), or *both*; default = *both* for binary inputs, *text* otherwise')
 
     args = parser.parse_args()
     VERBOSE = args.verbose
     SLOPE     = args.slope     #  0.8091639975519355 for NMPHTH [https://doi.org/10.1021/jacsau.4c00276]
     INTERCEPT = args.intercept # -1.5699211355668465 for NMPHTH [https://doi.org/10.1021/jacsau.4c00276]
-
-    # Read in the overlaps
-    if args.overlaps_file:
-        data = np.loadtxt(args.overlaps_file, delimiter=',', dtype=str)
-        IDs, overlaps = data[:, 0], data[:, 1].astype(float)
+    CHUNK_SIZE = args.chunk_size
+    BINARY_INPUT = args.overlaps_file.endswith('.npy')
+    OUTPUT_FORMAT = args.output_format or ('both' if BINARY_INPUT else 'text')
+    if OUTPUT_FORMAT not in ['text', 'npy', 'both']:
+        parser.error(f"unknown output format '{OUTPUT_FORMAT}'; either 'text', 'npy', or 'both'")
+    WRITE_TEXT = OUTPUT_FORMAT in ['text', 'both']
+    WRITE_NPY  = OUTPUT_FORMAT in ['npy', 'both']
 
     if VERBOSE == True:
         print(f'Linear fit: y_fit = {SLOPE}*x_fit + {INTERCEPT}')
 
-    couplings = []
-    for overlap in overlaps:
-        coupling_in_eV = from_log_overlap_to_ec_in_eV(SLOPE, INTERCEPT, overlap) 
-        coupling = coupling_in_eV
-        if VERBOSE == True:
-            print(f"Coupling : {coupling:.2e} eV (for overlap {overlap:.2e})")
-        couplings.append(coupling)
+    # Read in the overlaps, convert them, and save IDs and couplings to the output file(s), one chunk at a time
+    if WRITE_TEXT:
+        couplings_output     = open('couplings.csv', 'w')
+        log_couplings_output = open('log_couplings.csv', 'w')
+    if WRITE_NPY:
+        records_writer = srcpairrecords.PairRecordWriter('couplings.npy', srcpairrecords.COUPLING_DTYPE if BINARY_INPUT else COUPLING_VALUES_DTYPE)
 
-    couplings = np.array(couplings)
-    IDs = np.array(IDs)
-    if VERBOSE == True:
-        print(f' len of couplings is {len(couplings)}; len of IDs is {len(IDs)}')
+    n_pairs = 0
+    for IDs, overlaps, records in read_overlaps_in_chunks(args.overlaps_file, CHUNK_SIZE):
+        couplings     = from_log_overlap_to_ec_in_eV(SLOPE, INTERCEPT, overlaps)
+        log_couplings = from_log_overlap_to_log_ec(SLOPE, INTERCEPT, overlaps)
 
-    # Save IDs and couplings to output file
-    with open('couplings.csv', 'w') as output:
-        for ID, coupling in zip(IDs, couplings):
-            output.write(f"{ID},{coupling:.7f}\n")
+        if WRITE_TEXT:
+            write_values(couplings_output, IDs, couplings)
+            write_values(log_couplings_output, IDs, log_couplings)
+        if WRITE_NPY:
+            # Save the pair records (or IDs and overlaps) together with their couplings to a binary (memory-mappable) file
+            coupling_records = np.empty(len(overlaps), dtype=records_writer.dtype)
+            if BINARY_INPUT:
+                for field in srcpairrecords.PAIR_DTYPE.names:
+                    coupling_records[field] = records[field]
+            else:
+                coupling_records['pair_index']  = IDs.astype(int)
+                coupling_records['log_overlap'] = overlaps
+            coupling_records['coupling']     = couplings
+            coupling_records['log_coupling'] = log_couplings
+            records_writer.append(coupling_records)
 
-    log_couplings = []
-    for overlap in overlaps:
-        log_coupling_in_eV = from_log_overlap_to_log_ec(SLOPE, INTERCEPT, overlap) 
+        n_pairs += len(overlaps)
         if VERBOSE == True:
-            print(f"np.log10(coupling) : {coupling:.2e} meV (for overlap {overlap:.2e})")
-        log_couplings.append(log_coupling_in_eV)
-
-    log_couplings = np.array(log_couplings)
-    IDs = np.array(IDs)
-    if VERBOSE == True:
-        print(f' len of log_couplings is {len(log_couplings)}; len of IDs is {len(IDs)}')
-
-    # Save IDs and couplings to output file
-    with open('log_couplings.csv', 'w') as output:
-        for ID, log_coupling in zip(IDs, log_couplings):
-            output.write(f"{ID},{log_coupling:.7f}\n")
+            print(f' {n_pairs} pairs converted; couplings of the last chunk in [{np.min(couplings):.2e}, {np.max(couplings):.2e}] eV '
+                  f'(log10: [{np.min(log_couplings):.2f}, {np.max(log_couplings):.2f}])')
 
+    if WRITE_TEXT:
+        couplings_output.close()
+        log_couplings_output.close()
+    if WRITE_NPY:
+        records_writer.close()
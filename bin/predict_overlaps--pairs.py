@@ -4,265 +4,448 @@
 Prediction of orbital overlaps based on feature vectors of *pairs* of monomers.
 """
 
-import MDAnalysis as mda
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
 import os, sys
-import datetime
-from MDAnalysis.analysis import distances as mda_dist
 import time
 from pathlib import Path
 import argparse
 import json
-import src.functions as srcfunctions 
-from tensorflow import keras
-from sklearn import preprocessing
-import csv
+import multiprocessing
 import logging
 from contextlib import redirect_stdout
-import joblib
 
 # Check that I'm using python3
 if sys.version_info[0] < 3:
     raise Exception("Must be using Python 3")
 
 
-# Just plot formatting
-plt.style.use('seaborn-talk')
-plt.rcParams['font.family'] = 'sans'
-plt.rcParams['font.size'] = 18
-plt.rcParams['axes.labelsize'] = 20
-plt.rcParams['axes.labelweight'] = 'normal'
-plt.rcParams['xtick.labelsize'] = 18
-plt.rcParams['ytick.labelsize'] = 18
-plt.rcParams['legend.fontsize'] = 18   # For CONCISE legends (paper)
-plt.rcParams['legend.fontsize'] = 14   # For VERBOSE legends
-plt.rcParams['figure.titlesize'] = 18 
-
-
-
-# ================================================
-# =               INPUT DATA                     =
-# ================================================
-# Parse the arguments
-parser = argparse.ArgumentParser(description='Generation of feature vectors and Gaussian inputs from an atomistic morphology for *pairs* of monomers.')
-parser.add_argument('-f', '--gro-file', required=True, type=str  , help='name of GRO file of the morphology')
-parser.add_argument('-s', '--tpr-file', required=True, type=str  , help='name of TPR file of the morphology')
-parser.add_argument('-t', '--temp'    , required=True, type=int  , help='temperature at which the sample was taken (e.g., "300")') 
-parser.add_argument('-l', '--label'   , required=True, type=str  , help='label identifying the run (e.g., "A"')
-parser.add_argument('-n', '--snap'    , required=True, type=str  , help='time at which the snapshot was taken (e.g., "49ns")')
-parser.add_argument('-c', '--cutoff'  , required=True, type=int  , help='cutoff for pair selection')
-parser.add_argument('-r', '--resname' , required=True, type=str  , help='name of the residue to be analyzed')
-parser.add_argument('--map-file'      , required=True, type=str  , help='name of JSON file containing mappings') # OLDER default='all_mappings_PTMA_39atoms.json'
-parser.add_argument('--pdb-to-align-n', required=True, type=str  , help='name of PDB file to be aligned')
-parser.add_argument('--pdb-to-align-r', required=True, type=str  , help='name of PDB file to be aligned')
-parser.add_argument('--verbose'       , default=False,             help='True if you want verbose output')
-parser.add_argument('--also-cm'       , default=False,             help='True if you want *also* Coulomb Matrices') 
-parser.add_argument('--also-1d'       , default=False,             help='True if you want *also* 1D flattened matrices containing the ecli/stag identities')
-parser.add_argument('--test'          , default=False,             help='True if you want to run a test')
-parser.add_argument('--trajstep'      , default=1    , type=int  , help='Step size for trajectory; default = 1 = read all frames')
-parser.add_argument('--v-type'        , default='log', type=str  , help='type of transformation to apply to couplings; *abs*, *log*, or *signed*')
-parser.add_argument('--feature'       , default='distmat', type=str, help='type of input featurization: distmat OR coulmat')
-parser.add_argument('--make-plot'     , default=False , type=bool , help='toggles on/off plotting')
-parser.add_argument('--mapping'       , default=False, type=str  , help='tested for "M3COG" and "GBNO2"')
-parser.add_argument('--ML-model'      , default=False, type=str  , help='e.g., "ML/NN/overlaps-NEWB-.../distlog090.../trained_model_M3COG"')
-
-args = parser.parse_args()
-
-GRO_FILE        = args.gro_file       # e.g., '../2A_sample_conformations/sampling-at-{TEMP}K_{LABEL}_oplswB97XD/run.tpr'
-TPR_FILE        = args.tpr_file       # e.g., '../2A_sample_conformations/sampling-at-{TEMP}K_{LABEL}_oplswB97XD/run-snap{SNAP}-whole.gro'
-TEMP            = args.temp           # e.g., '300'
-LABEL           = args.label          # e.g., 'G'
-SNAP            = args.snap           # e.g., '49ns'
-CUTOFF          = args.cutoff         # in AA systems, it was 10 (hence the default)
-RESNAME         = args.resname        # e.g., "PEOPH", "NMPH"
-MAPjsonFILE     = args.map_file       # default = 'all_mappings_PTMA_39atoms.json' 
-PDBtoALIGNn     = args.pdb_to_align_n # PDB file of the structure to be aligned
-PDBtoALIGNr     = args.pdb_to_align_r # PDB file of the structure to be aligned
-ALSO_CM         = args.also_cm        # 'True' if you want *also* Coulomb Matrices 
-ALSO_1D         = args.also_1d        # 'True' if you want *also* 1D flattened matrices containing the ecli/stag identities 
-VERBOSE         = args.verbose
-TEST            = args.test
-EVERY_NTH_FRAME = args.trajstep
-OVERLAP_TYPE    = args.v_type
-FEATURE         = args.feature
-MAKE_PLOT       = args.make_plot
-MAPPING         = args.mapping
-TRAINED_ML_MODEL_PATH = args.ML_model
-print(f"\nReading data from {GRO_FILE} and {TPR_FILE} ({TEMP}K, {LABEL}, {SNAP}ns); VERBOSE is set to {VERBOSE}.")
-
-# Set up some paths and folders
-REPOBASE   = os.path.realpath(os.path.join(os.path.dirname(__file__), '.')) # script now resides in the "REPOBASE"
-WORKDIR    = os.getcwd()
-print(f"REPOBASE is {REPOBASE}")
-print(f"WORKDIR  is {WORKDIR}" )
-OUTPUTDIR  = f"pair-predictions-{TEMP}K-{LABEL}-{SNAP}"
-OUTPUTDATs = "pair_DATs"
-PDBtoALIGNn = mda.Universe( os.path.join( WORKDIR, PDBtoALIGNn ) )
-PDBtoALIGNr = mda.Universe( os.path.join( WORKDIR, PDBtoALIGNr ) )
-Path(f"{OUTPUTDATs}").mkdir(parents=True, exist_ok=True)
-Path(f"{OUTPUTDIR}").mkdir(parents=True, exist_ok=True)
-
-# Set up logging to file
-logfilepath = os.path.join(OUTPUTDIR,'predict_overlaps_cutoff{0:02d}A.log'.format(int(CUTOFF)))
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
-                    datefmt='%m-%d %H:%M',
-                    filename=logfilepath,
-                    filemode='w')
-console = logging.StreamHandler()                                          # define a Handler which writes INFO messages or higher to the sys.stderr
-console.setLevel(logging.INFO)                                             
-formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')  # set a format which is simpler for console use
-console.setFormatter(formatter)                                            # tell the handler to use this format
-logging.getLogger().addHandler(console)                                    # add the handler to the root logger
-mda.stop_logging()                                                         # stop MDAnalysis from filling the logging file
-logging.info('Predicting electronic couplings (orbital overlaps) w/ ECG.') # we can log to the root logger, or any other logger. First the root.
-logger1 = logging.getLogger('myapp.area1')                                 # define another logger (different loggers might represent areas in the code)
-
-
-# Load the morphology
-u = mda.Universe(TPR_FILE, GRO_FILE) 
-logger1.info(f"System (resname={RESNAME}) with {len(u.atoms.fragments)} chains, {len(u.atoms)} atoms, and {len(u.trajectory)} frames.")
-logger1.info(f'- NOTE! - resname = {RESNAME} --> will reduce the distance matrix from 16x16 to 12x12 (i.e., discard the Hs)')
-
-
-
-#=================================================#
-# 1) Load the trained NN                          #
-#=================================================#
-
-# Loading of the trained NN and of the *fitted* `X_scaler` and `Y_scaler`
-model = keras.models.load_model( os.path.join( WORKDIR, TRAINED_ML_MODEL_PATH ) ) 
-X_scaler = joblib.load( os.path.join(WORKDIR, TRAINED_ML_MODEL_PATH, 'X_scaler.joblib') )
-Y_scaler = joblib.load( os.path.join(WORKDIR, TRAINED_ML_MODEL_PATH, 'Y_scaler.joblib') )
-
-logger1.info(f"\nINFO - printing a summary of the model (might be at the bottom of the log file): {model.summary()}")
-with open( logfilepath, 'a') as log: # needed to print `model.summary()` to file
-    with redirect_stdout(log):
-        model.summary()
-
-
-
-#=================================================#
-# 2) Go through the pairs and predict couplings   #
-#=================================================#
-
-# We use a MONOMER-MONOMER COM distance of {CUTOFF} ang as cutoff. 
-# 
-# Pseudo-code to obtain list of residue pairs between which to compute :
-# 1. compute distance matrix betweem COMs of all MONOMERS
-#     1. compute and store in an array all MONOMER COMs 
-#     2. compute the distance matrix of those MONOMER COMs
-# 2. for each MONOMER-MONOMER pair:
-#     1. If COM-COM distance is equal or less than the {CUTOFF}:
-#         1. write DAT file with info
-#             - INFO: `pair_index`; `COM-COM distance`; `resid1`; `resid2`;
-#         2. infer orbital overlap by using the loaded ML surrogate model
-
-
-# 2A. Compute distance matrix between COMs
-
-# Make sure chains are whole (take 5 secs for 100 chains with N=30)
-for fragment in u.atoms.fragments:
-    mda.lib.mdamath.make_whole(fragment)
-
-MONOMERs = u.select_atoms(f"resname {RESNAME}")
-logger1.info(f"- INFO - There are {len(MONOMERs.residues)} MONOMER radical sites.")
-
-# read-in sites of N-methyl-phthalimide
-if os.path.exists( os.path.join(WORKDIR, MAPjsonFILE) ):
-    with open( os.path.join(WORKDIR, MAPjsonFILE) ) as json_mappings:
-        mappings = json.load(json_mappings)
-
-GROUP_selection = mappings["AA"]
-logger1.info(f'- INFO - GROUP_selection = {GROUP_selection}')
-
-
-# 2B. Iterate over all pairs and predict couplings (and save them to file) for the pairs within the cutoff 
-
-pair_index =    0  # initialize pair_index
-predicted_overlaps = []
-pair_indices       = []
-
-logger1.info(f"\nINFO - prediction - Starting with the prediction.")
-if TEST:
-    N_max =  2
-else:
-    N_max = -1
-
-begin = time.time()
-
-with open( os.path.join(OUTPUTDATs,'pairs_info_cutoff{0:02d}A_{1}K_{2}_{3}.dat'.format(int(CUTOFF),TEMP,LABEL,SNAP)), 'w') as pairs_info:
-
-    for frame in u.trajectory[::EVERY_NTH_FRAME]: # Iterate over the frames
-        if VERBOSE:
-            print(f'frame = {frame}; time = {u.trajectory.time}')
-
-        # Get the coordinates for the reference atoms and store them into an array with dimensions (COM_MONOMERs, 3)
-        COM_MONOMER = []
-        for residue in MONOMERs.residues:
-            COM_MONOMER.append(residue.atoms.select_atoms(f'{GROUP_selection}').center_of_mass()) # all the atoms of N-methyl-phthalimide
-        COM_MONOMER = np.row_stack(COM_MONOMER).astype('float32')
-        # Distances matrix between N09s of the MONOMER
-        COM_COM = mda_dist.distance_array(COM_MONOMER, COM_MONOMER, box=u.dimensions)
-        logger1.info(f"- INFO - COM-COM distance matrix with dimensions {COM_COM.shape} computed.")
-
-        # Iterate over the upper triangle of the N09-N09 distance matrix (diagonal excluded!)
-        for i_MONOMER, MONOMERi_residue in enumerate(MONOMERs.residues[:N_max], start=0):
-            for j_MONOMER, MONOMERj_residue in enumerate(MONOMERs.residues[i_MONOMER+1:], start=i_MONOMER+1):
-
-                if COM_COM[i_MONOMER, j_MONOMER] <= CUTOFF:
-                    
-                    pair_index+=1 # pair_index starts from 1, effectively!
-
-                    pairs_info.write("{0:10d} {1:12.8f} {2:10d} {3:10d} {4:15.3f} ".format(
-                                     pair_index, COM_COM[i_MONOMER, j_MONOMER], MONOMERi_residue.resid, MONOMERj_residue.resid, u.trajectory.time)
-                                     + " # pair_index  COM-COM_dist  MONOMERi_resID  MONOMERj_resID  timestamp_in_ps\n"
-                                    )
-
-                    MONOMERi_residue_aligned, MONOMERi_ref_residue = srcfunctions.align_MONOMER(u, MONOMERi_residue, RESNAME, "neutral"      , GROUP_selection, PDBtoALIGNn, VERBOSE)
-                                                                                                                                                               
-                    MONOMERj_residue_aligned, MONOMERj_ref_residue = srcfunctions.align_MONOMER(u, MONOMERj_residue, RESNAME, "radical_anion", GROUP_selection, PDBtoALIGNr, VERBOSE)
-
-                    # Retrieve the distance matrix of this pair
-                    reciprocal_distmatrix = srcfunctions.fast_compute_and_store_reciprocal_distmat(
-                                                         "pair",
-                                                         pair_index, 
-                                                         MONOMERi_residue_aligned, 
-                                                         MONOMERj_residue_aligned, 
-                                                         MAPjsonFILE,
-                                                         0, 0,  # --> only needed for distinguishing multiple conformations in the 1D-matrix case (see function docs) 
-                                                         False, # --> do NOT save matrices to file
-                                                         OUTPUTDIR, 
-                                                         ALSO_CM, ALSO_1D, 
-                                                         u, VERBOSE)
-
-                    # AD-HOC FIX for PMAP/PEPP/PVBP
-                    if RESNAME in ["PMAP","PEPP","PVBP"] and reciprocal_distmatrix.shape[0] == 16:
-                        # Reduce matrix from 16x16 to 12x12 (i.e., I want to disregard the hydrogens, if present)
-                        reciprocal_distmatrix = reciprocal_distmatrix[:12,:12]
-
-                    # Pre-process the distance matrix
-                    reciprocal_distmatrix = reciprocal_distmatrix.flatten()     # --> (36,0)
-                    reciprocal_distmatrix = reciprocal_distmatrix.reshape(-1,1) # --> (36,1)
-                    reciprocal_distmatrix = np.transpose(reciprocal_distmatrix) # --> (1,36)
-
-                    # Use loaded model to make prediction using the reciprocal_distmatrix
-                    y_predicted = model.predict( X_scaler.transform( reciprocal_distmatrix) ) 
-                    y_predicted = Y_scaler.inverse_transform( y_predicted )
-                    predicted_overlaps.append(y_predicted[0,0]) 
-                    pair_indices.append(f'{pair_index:06}')
-
-end = time.time()
-logger1.info(f"\nINFO - prediction - Prediction completed in {round(end-begin,3)} seconds.")
-
-logger1.info(f"\n**DONE** {pair_index} COM-COM distances are within the CUTOFF.")
-
-with open(os.path.join(OUTPUTDIR, "overlaps_predicted_cutoff{0:02d}A.csv".format(int(CUTOFF))), 'w') as f:
-    writer = csv.writer(f)
-    writer.writerows(zip(pair_indices, predicted_overlaps))
-
-logger1.info("**DONE** predicted overlaps written to 'overlaps_predicted_cutoff{0:02d}A.csv'.\n".format(int(CUTOFF)))
-
-
+SLOPE     =  0.8091639975519355 # for NMPHTH [https://doi.org/10.1021/jacsau.4c00276]
+INTERCEPT = -1.5699211355668465 # for NMPHTH [https://doi.org/10.1021/jacsau.4c00276]
+
+
+def set_plot_style():
+    """
+    Just plot formatting (matplotlib is imported only when plotting is requested).
+    """
+    import matplotlib.pyplot as plt
+    plt.style.use('seaborn-v0_8-talk' if 'seaborn-v0_8-talk' in plt.style.available else 'seaborn-talk')
+    plt.rcParams['font.family'] = 'sans'
+    plt.rcParams['font.size'] = 18
+    plt.rcParams['axes.labelsize'] = 20
+    plt.rcParams['axes.labelweight'] = 'normal'
+    plt.rcParams['xtick.labelsize'] = 18
+    plt.rcParams['ytick.labelsize'] = 18
+    plt.rcParams['legend.fontsize'] = 18   # For CONCISE legends (paper)
+    plt.rcParams['legend.fontsize'] = 14   # For VERBOSE legends
+    plt.rcParams['figure.titlesize'] = 18 
+
+
+
+if __name__ == "__main__":
+
+    # ================================================
+    # =               INPUT DATA                     =
+    # ================================================
+    # Parse the arguments
+    parser = argparse.ArgumentParser(description='Generation of feature vectors and Gaussian inputs from an atomistic morphology for *pairs* of monomers.')
+    parser.add_argument('-f', '--gro-file', default=None , type=str  , help='name of GRO file of the morphology (not needed if a trajectory is given)')
+    parser.add_argument('-s', '--tpr-file', required=True, type=str  , help='name of TPR file of the morphology')
+    parser.add_argument('-x', '--traj-file', default=None, type=str  , help='name of XTC/TRR trajectory of the morphology; if given, the frames are read from it')
+    parser.add_argument('-t', '--temp'    , required=True, type=int  , help='temperature at which the sample was taken (e.g., "300")') 
+    parser.add_argument('-l', '--label'   , required=True, type=str  , help='label identifying the run (e.g., "A"')
+    parser.add_argument('-n', '--snap'    , required=True, type=str  , help='time at which the snapshot was taken (e.g., "49ns")')
+    parser.add_argument('-c', '--cutoff'  , required=True, type=int  , help='cutoff for pair selection')
+    parser.add_argument('-r', '--resname' , required=True, type=str  , help='name of the residue to be analyzed')
+    parser.add_argument('--map-file'      , required=True, type=str  , help='name of JSON file containing mappings') # OLDER default='all_mappings_PTMA_39atoms.json'
+    parser.add_argument('--pdb-to-align-n', required=True, type=str  , help='name of PDB file to be aligned')
+    parser.add_argument('--pdb-to-align-r', required=True, type=str  , help='name of PDB file to be aligned')
+    parser.add_argument('--verbose'       , default=False,             help='True if you want verbose output')
+    parser.add_argument('--also-cm'       , default=False,             help='True if you want *also* Coulomb Matrices') 
+    parser.add_argument('--also-1d'       , default=False,             help='True if you want *also* 1D flattened matrices containing the ecli/stag identities')
+    parser.add_argument('--test'          , default=False,             help='True if you want to run a test')
+    parser.add_argument('--trajstep'      , default=1    , type=int  , help='Step size for trajectory; default = 1 = read all frames')
+    parser.add_argument('--v-type'        , default='log', type=str  , help='type of transformation to apply to couplings; *abs*, *log*, or *signed*')
+    parser.add_argument('--feature'       , default='distmat', type=str, help='type of input featurization: distmat OR coulmat')
+    parser.add_argument('--make-plot'     , default=False , type=lambda s: s == 'True', help='toggles on/off plotting')
+    parser.add_argument('--mapping'       , default=False, type=str  , help='tested for "M3COG" and "GBNO2"')
+    parser.add_argument('--ML-model'      , required=True, type=str  , nargs='+', help='e.g., "ML/NN/overlaps-NEWB-.../distlog090.../trained_model_M3COG"; several models --> ensemble mean and std')
+    parser.add_argument('--per-model-columns', default=False, type=lambda s: s == 'True', help='True if you want *also* the predictions of each model of the ensemble in the outputs')
+    parser.add_argument('--backend'       , default='keras', type=str, help='inference backend: *keras* or *numpy* (TensorFlow-free; see export_model_to_numpy.py)')
+    parser.add_argument('--batch-size'    , default=4096 , type=int  , help='number of pairs pushed through the NN at once; default = 4096')
+    parser.add_argument('-j', '--n-workers', default=1   , type=int  , help='number of worker processes analyzing blocks of frames; default = 1 (serial)')
+    parser.add_argument('--frames-per-block', default=10 , type=int  , help='number of frames per block handed to a worker; default = 10')
+    parser.add_argument('--resume'        , default=False, type=lambda s: s == 'True', help='True if you want to resume an interrupted run from its checkpoints (blocks already analyzed are not recomputed)')
+    parser.add_argument('--keep-checkpoints', default=False, type=lambda s: s == 'True', help='True if you want to keep the per-block checkpoints after the outputs have been written')
+    parser.add_argument('--feature-cache' , default=None , type=str  , help='folder of the feature cache (e.g., "~/.cache/redox-active-polymers/features"); features of a morphology already analyzed are not recomputed')
+    parser.add_argument('--feature-cache-size', default=20., type=float, help='maximum size of the feature cache in GB (least recently used entries are evicted); default = 20')
+    parser.add_argument('--output-format' , default='text', type=str , help='*text* (DAT + CSV files), *npy* (one binary, memory-mappable file of pair records), *both*, or *none* (no per-pair outputs; with --running-stats); default = text')
+    parser.add_argument('--running-stats' , default=False, type=lambda s: s == 'True', help='True if you want running histograms (bins of the plotting scripts) and moments of the log overlaps and couplings, and their convergence over the frames')
+    parser.add_argument('--slope'         , default=SLOPE, type=float, help=f'slope     of linear relationship between log(overlaps) and log(couplings) (for --running-stats); default = {SLOPE}')
+    parser.add_argument('--intercept'     , default=INTERCEPT, type=float, help=f'intercept of linear relationship between log(overlaps) and log(couplings) (for --running-stats); default = {INTERCEPT}')
+    parser.add_argument('--profile'       , default=False, type=lambda s: s == 'True', help='True if you want *also* a cProfile dump of the main process (predict_overlaps_cutoffXXA.prof; the worker processes of -j > 1 are not profiled)')
+
+    args = parser.parse_args()
+    start_time = time.perf_counter()
+    if not args.gro_file and not args.traj_file:
+        parser.error('either a GRO file (-f) or a trajectory (-x) is needed')
+
+    GRO_FILE        = args.gro_file       # e.g., '../2A_sample_conformations/sampling-at-{TEMP}K_{LABEL}_oplswB97XD/run.tpr'
+    TPR_FILE        = args.tpr_file       # e.g., '../2A_sample_conformations/sampling-at-{TEMP}K_{LABEL}_oplswB97XD/run-snap{SNAP}-whole.gro'
+    TRAJ_FILE       = args.traj_file      # e.g., '../2A_sample_conformations/sampling-at-{TEMP}K_{LABEL}_oplswB97XD/run.xtc'
+    TEMP            = args.temp           # e.g., '300'
+    LABEL           = args.label          # e.g., 'G'
+    SNAP            = args.snap           # e.g., '49ns'
+    CUTOFF          = args.cutoff         # in AA systems, it was 10 (hence the default)
+    RESNAME         = args.resname        # e.g., "PEOPH", "NMPH"
+    MAPjsonFILE     = args.map_file       # default = 'all_mappings_PTMA_39atoms.json' 
+    PDBtoALIGNn     = args.pdb_to_align_n # PDB file of the structure to be aligned
+    PDBtoALIGNr     = args.pdb_to_align_r # PDB file of the structure to be aligned
+    ALSO_CM         = args.also_cm        # 'True' if you want *also* Coulomb Matrices 
+    ALSO_1D         = args.also_1d        # 'True' if you want *also* 1D flattened matrices containing the ecli/stag identities 
+    VERBOSE         = args.verbose
+    TEST            = args.test
+    EVERY_NTH_FRAME = args.trajstep
+    OVERLAP_TYPE    = args.v_type
+    FEATURE         = args.feature
+    MAKE_PLOT       = args.make_plot
+    MAPPING         = args.mapping
+    TRAINED_ML_MODEL_PATHS = args.ML_model
+    N_MODELS        = len(TRAINED_ML_MODEL_PATHS)
+    PER_MODEL_COLUMNS = args.per_model_columns and N_MODELS > 1
+    BATCH_SIZE      = args.batch_size
+    BACKEND         = args.backend
+    N_WORKERS       = args.n_workers
+    FRAMES_PER_BLOCK = args.frames_per_block
+    RESUME          = args.resume
+    KEEP_CHECKPOINTS = args.keep_checkpoints
+    FEATURE_CACHE_DIR  = args.feature_cache
+    FEATURE_CACHE_SIZE = args.feature_cache_size
+    OUTPUT_FORMAT   = args.output_format
+    RUNNING_STATS   = args.running_stats
+    SLOPE           = args.slope
+    INTERCEPT       = args.intercept
+    PROFILE         = args.profile
+    if OUTPUT_FORMAT not in ['text', 'npy', 'both', 'none']:
+        parser.error(f"unknown output format '{OUTPUT_FORMAT}'; either 'text', 'npy', 'both', or 'none'")
+    if FEATURE not in ['distmat', 'coulmat']:
+        parser.error(f"unknown feature '{FEATURE}'; either 'distmat' or 'coulmat'")
+    if OUTPUT_FORMAT == 'none' and not RUNNING_STATS:
+        parser.error("nothing to write: --output-format none is meant to be used with --running-stats True")
+    WRITE_TEXT      = OUTPUT_FORMAT in ['text', 'both']
+    WRITE_NPY       = OUTPUT_FORMAT in ['npy', 'both']
+    # Heavy modules are imported only now, i.e., after the arguments have been parsed (fast `--help`)
+    import MDAnalysis as mda
+    import src.prediction as srcprediction
+    import src.pair_records as srcpairrecords
+    import src.feature_cache as srcfeaturecache
+    import src.distributions as srcdistributions
+    import src.timing as srctiming
+    if MAKE_PLOT:
+        set_plot_style()
+
+    print(f"\nReading data from {TRAJ_FILE or GRO_FILE} and {TPR_FILE} ({TEMP}K, {LABEL}, {SNAP}ns); VERBOSE is set to {VERBOSE}.")
+
+    # Set up some paths and folders
+    REPOBASE   = os.path.realpath(os.path.join(os.path.dirname(__file__), '.')) # script now resides in the "REPOBASE"
+    WORKDIR    = os.getcwd()
+    print(f"REPOBASE is {REPOBASE}")
+    print(f"WORKDIR  is {WORKDIR}" )
+    OUTPUTDIR  = f"pair-predictions-{TEMP}K-{LABEL}-{SNAP}"
+    OUTPUTDATs = "pair_DATs"
+    CHECKPOINTDIR = os.path.join(OUTPUTDIR, "checkpoints")
+    Path(f"{OUTPUTDATs}").mkdir(parents=True, exist_ok=True)
+    Path(f"{OUTPUTDIR}").mkdir(parents=True, exist_ok=True)
+    Path(f"{CHECKPOINTDIR}").mkdir(parents=True, exist_ok=True)
+
+    # Set up logging to file
+    logfilepath = os.path.join(OUTPUTDIR,'predict_overlaps_cutoff{0:02d}A.log'.format(int(CUTOFF)))
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                        datefmt='%m-%d %H:%M',
+                        filename=logfilepath,
+                        filemode='a' if RESUME else 'w')
+    console = logging.StreamHandler()                                          # define a Handler which writes INFO messages or higher to the sys.stderr
+    console.setLevel(logging.INFO)                                             
+    formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')  # set a format which is simpler for console use
+    console.setFormatter(formatter)                                            # tell the handler to use this format
+    logging.getLogger().addHandler(console)                                    # add the handler to the root logger
+    mda.stop_logging()                                                         # stop MDAnalysis from filling the logging file
+    logging.info('Predicting electronic couplings (orbital overlaps) w/ ECG.') # we can log to the root logger, or any other logger. First the root.
+    logger1 = logging.getLogger('myapp.area1')                                 # define another logger (different loggers might represent areas in the code)
+
+
+    # Per-stage timings of the run (the stages of the workers are added frame by frame) --> JSON report
+    report_timer = srctiming.StageTimer()
+    if PROFILE:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Load the morphology
+    with report_timer.stage("universe_load"):
+        u = srcprediction.load_universe(TPR_FILE, GRO_FILE, TRAJ_FILE)
+    logger1.info(f"System (resname={RESNAME}) with {len(u.atoms.fragments)} chains, {len(u.atoms)} atoms, and {len(u.trajectory)} frames.")
+    logger1.info(f'- NOTE! - resname = {RESNAME} --> will reduce the distance matrix from 16x16 to 12x12 (i.e., discard the Hs)')
+
+
+
+    # read-in sites of N-methyl-phthalimide
+    if os.path.exists( os.path.join(WORKDIR, MAPjsonFILE) ):
+        with open( os.path.join(WORKDIR, MAPjsonFILE) ) as json_mappings:
+            mappings = json.load(json_mappings)
+
+    GROUP_selection = mappings["AA"]
+    logger1.info(f'- INFO - GROUP_selection = {GROUP_selection}')
+    logger1.info(f"- INFO - There are {len(u.select_atoms(f'resname {RESNAME}').residues)} MONOMER radical sites.")
+
+    # Everything a worker needs to analyze a block of frames on its own
+    config = {"tpr_file"       : TPR_FILE,
+              "coord_file"     : GRO_FILE,
+              "traj_file"      : TRAJ_FILE,
+              "resname"        : RESNAME,
+              "group_selection": GROUP_selection,
+              "pdb_to_align_n" : os.path.join(WORKDIR, PDBtoALIGNn),
+              "pdb_to_align_r" : os.path.join(WORKDIR, PDBtoALIGNr),
+              "feature"        : FEATURE,
+              "model_paths"    : [os.path.join(WORKDIR, model_path) for model_path in TRAINED_ML_MODEL_PATHS],
+              "backend"        : BACKEND,
+              "cutoff"         : CUTOFF,
+              "batch_size"     : BATCH_SIZE,
+              "n_max"          : 2 if TEST else None, # only the pairs of the first 2 MONOMERs in test runs
+              "make_whole"     : True,
+              "return_features": False,
+              "feature_cache_entry": None,
+              "verbose"        : VERBOSE}
+
+    # Feature cache: the features do not depend on the trained NN --> keyed by the contents of the inputs and the featurization parameters
+    FEATURE_CACHE, CACHE_HIT = None, False
+    if FEATURE_CACHE_DIR:
+        FEATURE_CACHE = srcfeaturecache.FeatureCache(os.path.expanduser(FEATURE_CACHE_DIR), FEATURE_CACHE_SIZE)
+        CACHE_KEY = srcfeaturecache.make_cache_key({"tpr": TPR_FILE, "gro": None if TRAJ_FILE else GRO_FILE, "traj": TRAJ_FILE,
+                                                    "mappings": os.path.join(WORKDIR, MAPjsonFILE),
+                                                    "pdb_n": config["pdb_to_align_n"], "pdb_r": config["pdb_to_align_r"]},
+                                                   {"cutoff": CUTOFF, "trajstep": EVERY_NTH_FRAME, "resname": RESNAME, "feature": FEATURE,
+                                                    "group_selection": GROUP_selection, "n_max": config["n_max"], "make_whole": config["make_whole"]})
+        CACHE_HIT = FEATURE_CACHE.lookup(CACHE_KEY)
+        if CACHE_HIT:
+            config["feature_cache_entry"] = FEATURE_CACHE.entry_dir(CACHE_KEY)
+        else:
+            config["return_features"] = True
+        logger1.info(f"- INFO - feature cache {'HIT' if CACHE_HIT else 'MISS'} (key {CACHE_KEY[:12]}... in {FEATURE_CACHE_DIR}).")
+
+    FRAME_BLOCKS = srcprediction.make_frame_blocks(len(u.trajectory), EVERY_NTH_FRAME, FRAMES_PER_BLOCK)
+    logger1.info(f"- INFO - {sum(len(block) for block in FRAME_BLOCKS)} frames to be analyzed in {len(FRAME_BLOCKS)} blocks by {N_WORKERS} worker(s).")
+
+    # Checkpoints: one file per block of frames (written atomically), plus a manifest of the run they belong to
+    manifest = {key: value for key, value in config.items() if key != "verbose"}
+    manifest["frame_blocks"] = FRAME_BLOCKS
+    manifest_file = os.path.join(CHECKPOINTDIR, "manifest.json")
+    block_checkpoint = lambda block_index: os.path.join(CHECKPOINTDIR, f"block{block_index:05d}.npz")
+    if RESUME:
+        if not os.path.exists(manifest_file):
+            sys.exit(f"ERROR! Cannot resume: {manifest_file} not found. Exiting...")
+        with open(manifest_file) as f:
+            if json.load(f) != json.loads(json.dumps(manifest)):
+                sys.exit(f"ERROR! Cannot resume: the run in {CHECKPOINTDIR} was started with different inputs/parameters. Exiting...")
+    else:
+        for checkpoint in Path(CHECKPOINTDIR).glob("block*.npz"):
+            checkpoint.unlink()
+        with open(f"{manifest_file}.tmp", 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(f"{manifest_file}.tmp", manifest_file)
+    DONE_BLOCKS    = [os.path.exists(block_checkpoint(block_index)) for block_index in range(len(FRAME_BLOCKS))]
+    PENDING_BLOCKS = [block for block, done in zip(FRAME_BLOCKS, DONE_BLOCKS) if not done]
+    if RESUME:
+        logger1.info(f"- INFO - resuming: {sum(DONE_BLOCKS)} blocks found in {CHECKPOINTDIR}; {len(PENDING_BLOCKS)} blocks left.")
+
+
+
+    #=================================================#
+    # 1) Load the trained NN                          #
+    #=================================================#
+
+    # Loading of the trained NN and of the *fitted* `X_scaler` and `Y_scaler` (once per worker)
+    if N_MODELS > 1:
+        logger1.info(f"\nINFO - ensemble of {N_MODELS} trained NNs: the mean and std of their predictions are written" + (" (+ the predictions of each model)." if PER_MODEL_COLUMNS else "."))
+    if N_WORKERS == 1 and PENDING_BLOCKS:
+        srcprediction.init_worker(config, u)
+        for model, _, _ in srcprediction._WORKER["models"]:
+            logger1.info(f"\nINFO - printing a summary of the model (might be at the bottom of the log file): {model.summary()}")
+            with open( logfilepath, 'a') as log: # needed to print `model.summary()` to file
+                with redirect_stdout(log):
+                    model.summary()
+    else:
+        logger1.info(f"\nINFO - the trained NN(s) will be loaded by each of the {N_WORKERS} worker processes.")
+
+
+
+    #=================================================#
+    # 2) Go through the pairs and predict couplings   #
+    #=================================================#
+
+    # We use a MONOMER-MONOMER COM distance of {CUTOFF} ang as cutoff. 
+    # 
+    # Pseudo-code to obtain list of residue pairs between which to compute (for each frame, see `src/prediction.py`):
+    # 1. compute and store in an array all MONOMER COMs 
+    # 2. find the MONOMER-MONOMER pairs whose COM-COM distance is equal or less than the {CUTOFF} (neighbour search)
+    # 3. align the QC-optimized conformations onto all the MONOMERs
+    # 4. compute the feature vectors of the pairs and infer their orbital overlaps (in batches) by using the loaded ML surrogate model
+    # 5. write DAT file with info
+    #     - INFO: `pair_index`; `COM-COM distance`; `resid1`; `resid2`;
+    #    and/or append the records of the frame (info + predicted overlap) to the binary NPY file in one go
+    # The frames are analyzed in blocks (in parallel if N_WORKERS > 1); `pair_index` is assigned here, following the frame order.
+    # Each block is checkpointed as soon as it is done; blocks found in the checkpoints (`--resume`) are read back instead.
+
+    pair_index =    0  # initialize pair_index
+
+    logger1.info("\nINFO - prediction - Starting with the prediction.")
+
+    begin = time.time()
+
+    pool = None
+    if N_WORKERS > 1 and PENDING_BLOCKS:
+        # "spawn" --> each worker opens its own Universe and loads the model once (no forking of TensorFlow/MDAnalysis state)
+        pool = multiprocessing.get_context("spawn").Pool(N_WORKERS, initializer=srcprediction.init_worker, initargs=(config,))
+        pending_results = pool.imap(srcprediction.predict_frame_block, PENDING_BLOCKS) # results come back in frame order
+    else:
+        pending_results = map(srcprediction.predict_frame_block, PENDING_BLOCKS)
+
+    def checkpointed_block_results():
+        """
+        Yields the results of all the blocks, in frame order, either from the checkpoints or as they are predicted (and checkpointed).
+        """
+        for block_index, done in enumerate(DONE_BLOCKS):
+            if done:
+                with report_timer.stage("checkpoint_io"):
+                    frame_results = srcprediction.load_block_checkpoint(block_checkpoint(block_index))
+            else:
+                frame_results = next(pending_results)
+                with report_timer.stage("checkpoint_io"):
+                    srcprediction.save_block_checkpoint(block_checkpoint(block_index), frame_results)
+            yield frame_results
+
+    block_results = checkpointed_block_results()
+
+    cache_writer   = FEATURE_CACHE.writer(CACHE_KEY) if (FEATURE_CACHE and not CACHE_HIT) else None
+    pairs_info     = open( os.path.join(OUTPUTDATs,'pairs_info_cutoff{0:02d}A_{1}K_{2}_{3}.dat'.format(int(CUTOFF),TEMP,LABEL,SNAP)), 'w') if WRITE_TEXT else None
+    records_dtype  = srcpairrecords.make_pair_dtype(N_MODELS, PER_MODEL_COLUMNS)
+    records_writer = srcpairrecords.PairRecordWriter( os.path.join(OUTPUTDIR, "pairs_predicted_cutoff{0:02d}A.npy".format(int(CUTOFF))), records_dtype ) if WRITE_NPY else None
+    records_buffer = srcpairrecords.PairBuffer(records_dtype) if WRITE_TEXT else None # records of all the frames, for the CSV file
+
+    # Running histograms/moments of the log overlaps and couplings (updated per frame) and their convergence over the frames
+    if RUNNING_STATS:
+        running_overlaps  = srcdistributions.RunningHistogram(srcdistributions.OVERLAP_BIN_EDGES)
+        running_couplings = srcdistributions.RunningHistogram(srcdistributions.COUPLING_BIN_EDGES)
+        convergence = open(os.path.join(OUTPUTDIR, "convergence_cutoff{0:02d}A.csv".format(int(CUTOFF))), 'w')
+        convergence.write("frame,time_ps,n_frames,n_pairs,overlap_mean,overlap_std,overlap_peak,coupling_mean,coupling_std,coupling_peak\n")
+        n_frames = 0
+
+    frame_reports = [] # per frame: pairs within the cutoff, wall time and peak RSS of the (worker) process
+    for frame_results in block_results:
+        for frame_result in frame_results:
+            report_timer.merge(frame_result.get("timings", {})) # no timings for the frames read from the checkpoints
+
+            # Write the info of the pairs within the cutoff (sorted as the upper triangle of the COM-COM distance matrix)
+            n_pairs = len(frame_result["distances"])
+            frame_reports.append({"frame": frame_result["frame"], "time_ps": frame_result["time"], "n_pairs": n_pairs,
+                                  "wall_time_s": frame_result.get("wall_time_s"), "peak_rss_MB": frame_result.get("peak_rss_MB")})
+            frame_pair_indices = np.arange(pair_index+1, pair_index+1+n_pairs) # pair_index starts from 1, effectively!
+            with report_timer.stage("output_io"):
+                frame_records = srcpairrecords.make_pair_records(frame_pair_indices, frame_result["distances"],
+                                                                 frame_result["resids_i"], frame_result["resids_j"],
+                                                                 frame_result["time"], frame_result["predictions"],
+                                                                 frame_result["predictions_std"], frame_result["predictions_models"], records_dtype)
+                if WRITE_TEXT:
+                    pairs_info.write("".join("{0:10d} {1:12.8f} {2:10d} {3:10d} {4:15.3f} ".format(
+                                             index, dist, resid_i, resid_j, frame_result["time"])
+                                             + " # pair_index  COM-COM_dist  MONOMERi_resID  MONOMERj_resID  timestamp_in_ps\n"
+                                             for index, dist, resid_i, resid_j in zip(frame_pair_indices, frame_result["distances"],
+                                                                                      frame_result["resids_i"], frame_result["resids_j"])))
+                    records_buffer.append(frame_records)
+                if WRITE_NPY:
+                    records_writer.append(frame_records)
+                if cache_writer:
+                    cache_writer.append(frame_result)
+            pair_index += n_pairs
+            if RUNNING_STATS:
+                with report_timer.stage("running_stats"):
+                    running_overlaps.update(frame_result["predictions"])
+                    running_couplings.update((np.asarray(frame_result["predictions"], dtype=float) - INTERCEPT)/SLOPE) # as `from_log_overlap_to_log_ec`
+                    n_frames += 1
+                    row = [frame_result["frame"], frame_result["time"], n_frames, running_overlaps.n]
+                    for running in [running_overlaps, running_couplings]:
+                        row += [running.mean, running.std, running.fit_or_nan()[1] if running.M2 > 0 else np.nan]
+                    convergence.write(",".join(str(value) for value in row) + "\n")
+
+            logger1.info(f"- INFO - frame {frame_result['frame']} (time = {frame_result['time']} ps): {n_pairs} pairs within the cutoff predicted.")
+
+    if WRITE_TEXT:
+        pairs_info.close()
+    if WRITE_NPY:
+        records_writer.close()
+    if cache_writer:
+        cache_writer.commit()
+        logger1.info(f"- INFO - features stored in the feature cache ({FEATURE_CACHE.entry_dir(CACHE_KEY)}).")
+    if RUNNING_STATS:
+        convergence.close()
+        running_statistics = {"slope": SLOPE, "intercept": INTERCEPT, "n_frames": n_frames}
+        for prefix, running in [("overlap", running_overlaps), ("coupling", running_couplings)]:
+            running_statistics.update(running.as_dict(prefix))
+            if running.M2 > 0:
+                params, peak_position = running.fit_or_nan()
+                running_statistics.update({f"{prefix}_params": params, f"{prefix}_peak": peak_position})
+                logger1.info(f"- INFO - running statistics: peak of the log10 {prefix}s at {peak_position} (mean {running.mean}, std {running.std}; {running.n} pairs, {n_frames} frames).")
+        np.savez(os.path.join(OUTPUTDIR, "running_statistics_cutoff{0:02d}A.npz".format(int(CUTOFF))), **running_statistics)
+        logger1.info("**DONE** running histograms and moments written to 'running_statistics_cutoff{0:02d}A.npz', their convergence to 'convergence_cutoff{0:02d}A.csv'.".format(int(CUTOFF)))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    end = time.time()
+    logger1.info(f"\nINFO - prediction - Prediction completed in {round(end-begin,3)} seconds.")
+
+    logger1.info(f"\n**DONE** {pair_index} COM-COM distances are within the CUTOFF.")
+
+    if WRITE_TEXT:
+        with report_timer.stage("output_io"):
+            # zero-padded IDs generated only now, chunk by chunk, from the records buffer
+            srcpairrecords.write_predictions_csv(os.path.join(OUTPUTDIR, "overlaps_predicted_cutoff{0:02d}A.csv".format(int(CUTOFF))), records_buffer.records)
+
+        logger1.info("**DONE** predicted overlaps written to 'overlaps_predicted_cutoff{0:02d}A.csv'.\n".format(int(CUTOFF)))
+        if N_MODELS > 1:
+            logger1.info("         columns: pair_index, mean, std" + "".join(f", model_{k+1}" for k in range(N_MODELS) if PER_MODEL_COLUMNS) + " (log overlaps over the ensemble).")
+    if WRITE_NPY:
+        logger1.info("**DONE** pair records (info + predicted overlaps) written to 'pairs_predicted_cutoff{0:02d}A.npy'.\n".format(int(CUTOFF)))
+
+    # The outputs are complete --> the checkpoints are no longer needed
+    if not KEEP_CHECKPOINTS:
+        for block_index in range(len(FRAME_BLOCKS)):
+            os.remove(block_checkpoint(block_index))
+        os.remove(manifest_file)
+        if not os.listdir(CHECKPOINTDIR):
+            os.rmdir(CHECKPOINTDIR)
+
+    # Report: per-stage wall times and number of calls (main process + workers), pairs per frame, and peak memory
+    if PROFILE:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(OUTPUTDIR, "predict_overlaps_cutoff{0:02d}A.prof".format(int(CUTOFF))))
+    wall_time = time.perf_counter() - start_time
+    worker_rss = [frame_report["peak_rss_MB"] for frame_report in frame_reports if frame_report["peak_rss_MB"] is not None]
+    report = {"wall_time_s" : wall_time,
+              "n_workers"   : N_WORKERS,
+              "n_frames"    : len(frame_reports),
+              "n_pairs"     : pair_index,
+              "pairs_per_s" : pair_index/wall_time,
+              "stages"      : dict(sorted(report_timer.as_dict().items(), key=lambda item: -item[1]["time_s"])),
+              "peak_rss_MB" : {"main"   : srctiming.peak_rss_MB(),
+                               "workers": max(worker_rss) if (N_WORKERS > 1 and worker_rss) else None,
+                               "children": srctiming.peak_rss_MB(children=True)},
+              "frames"      : frame_reports}
+    with open(os.path.join(OUTPUTDIR, "predict_overlaps_cutoff{0:02d}A_report.json".format(int(CUTOFF))), 'w') as f:
+        json.dump(report, f, indent=1)
+    logger1.info(f"- INFO - timings ({wall_time:.3f} s in total; stage times of the workers are summed over the workers):")
+    for name, timing in report["stages"].items():
+        logger1.info(f"         {name:20s} {timing['time_s']:10.3f} s {timing['calls']:8d} calls")
+    logger1.info("**DONE** timing report written to 'predict_overlaps_cutoff{0:02d}A_report.json'".format(int(CUTOFF))
+                 + (", profile to 'predict_overlaps_cutoff{0:02d}A.prof'.".format(int(CUTOFF)) if PROFILE else "."))
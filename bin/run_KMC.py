@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Kinetic Monte Carlo of a charge hopping on the network of (predicted) couplings: diffusion coefficients and mobilities.
+
+The sites are the MONOMERs (COMs of their N-methyl-phthalimide groups, from the morphology), the hops the pairs of
+`couplings.npy` (or `couplings.csv` + `pairs_info_*.dat`), with Marcus rates (reorganization energy `--lambda`, Gaussian
+site-energy disorder `--sigma`, field `--field` along x). Each frame of the pairs is one static realization of the network,
+on which `--n-walkers` independent walkers are moved (in blocks, by `-j` worker processes; see `src/kmc.py`) for about
+`--n-hops` hops each. Two files are written to `--output-dir`: `kmc_msd.csv` (mean square displacement and drift vs. time,
+per frame) and `kmc_summary.json` (per frame and averaged: D, Einstein mobility, drift mobility if a field is applied, hops/s).
+
+USAGE:
+  python run_KMC.py --couplings couplings.npy -s topol.tpr -x traj.xtc -r PMAP --map-file mappings_PMAP.json --lambda 0.3
+  python run_KMC.py --couplings couplings.csv --pairs-info pairs_info_cutoff09A.dat -s topol.tpr -f confout.gro -r PMAP \
+         --map-file mappings_PMAP.json --lambda 0.3 --sigma 0.05 --field 1e5 --n-walkers 10000 --n-hops 1000 -j 8
+"""
+
+import os
+import argparse
+import json
+import time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Kinetic Monte Carlo of charge hopping with Marcus rates from the (predicted) couplings.')
+    parser.add_argument('--couplings'     , required=True, type=str  , help='couplings (eV): pair records of log10overlap_to_ECeV.py (.npy) or couplings.csv')
+    parser.add_argument('--pairs-info'    , default=None , type=str  , help='pairs_info_*.dat file of the run (needed with couplings.csv)')
+    parser.add_argument('-s', '--tpr-file', required=True, type=str  , help='name of TPR file of the morphology')
+    parser.add_argument('-f', '--gro-file', default=None , type=str  , help='name of GRO file of the morphology (not needed if a trajectory is given)')
+    parser.add_argument('-x', '--traj-file', default=None, type=str  , help='name of XTC/TRR trajectory the pairs were predicted from')
+    parser.add_argument('-r', '--resname' , required=True, type=str  , help='name of the residue of the MONOMERs (e.g., "PMAP")')
+    parser.add_argument('--map-file'      , required=True, type=str  , help='name of JSON file containing mappings (N-methyl-phthalimide atoms: "AA")')
+    parser.add_argument('--lambda'        , required=True, type=float, dest='reorganization_energy', help='reorganization energy (eV)')
+    parser.add_argument('-t', '--temp'    , default=300. , type=float, help='temperature (K); default = 300')
+    parser.add_argument('--sigma'         , default=0.   , type=float, help='width of the Gaussian disorder of the site energies (eV); default = 0')
+    parser.add_argument('--field'         , default=0.   , type=float, help='electric field along x (V/cm); default = 0')
+    parser.add_argument('--charge'        , default=-1   , type=int  , help='charge of the carrier: -1 (electron, radical anions) or +1 (hole); default = -1')
+    parser.add_argument('--n-walkers'     , default=1000 , type=int  , help='number of walkers per frame; default = 1000')
+    parser.add_argument('--walkers-per-task', default=1000, type=int , help='number of walkers moved together by a worker; default = 1000')
+    parser.add_argument('--n-hops'        , default=1000 , type=int  , help='approximate number of hops per walker (sets the simulated time); default = 1000')
+    parser.add_argument('--n-samples'     , default=50   , type=int  , help='number of times the displacements are sampled at; default = 50')
+    parser.add_argument('--seed'          , default=0    , type=int  , help='seed of the random numbers; default = 0')
+    parser.add_argument('-j', '--n-workers', default=1   , type=int  , help='number of worker processes; default = 1 (serial)')
+    parser.add_argument('-o', '--output-dir', default='.', type=str  , help='folder of the output files; default = .')
+    args = parser.parse_args()
+    # Heavy modules are imported only now, i.e., after the arguments have been parsed (fast `--help`)
+    import numpy as np
+    import MDAnalysis as mda
+    import src.coupling_graph as srccouplinggraph
+    import src.kmc as srckmc
+    import src.prediction as srcprediction
+
+    with open(args.map_file) as json_mappings:
+        mappings = json.load(json_mappings)
+    table = srccouplinggraph.load_pair_table(args.couplings, args.pairs_info)
+    frame_slices = srccouplinggraph.frame_slices(table["time"])
+    times = [float(table["time"][frame.start]) for frame in frame_slices]
+    print(f"- INFO - {len(table['coupling'])} pairs in {len(frame_slices)} frames read from {args.couplings}.")
+
+    mda.stop_logging()
+    universe = srcprediction.load_universe(args.tpr_file, args.gro_file, args.traj_file)
+    resids, sites = srckmc.site_positions(universe, args.resname, mappings["AA"], times)
+    order = np.argsort(resids)
+
+    # Hopping networks (rate tables) of the frames; simulated time from the mean out-going rate and the number of hops
+    field = args.field * 1e-8 # V/cm --> V/Å
+    rng = np.random.default_rng(args.seed)
+    networks, sample_times = [], []
+    for frame, (COMs, box) in zip(frame_slices, sites):
+        sites_i = order[np.searchsorted(resids, table["resid_i"][frame], sorter=order)]
+        sites_j = order[np.searchsorted(resids, table["resid_j"][frame], sorter=order)]
+        site_energies = rng.normal(0., args.sigma, len(resids)) if args.sigma > 0 else None
+        network = srckmc.build_hopping_network(sites_i, sites_j, np.asarray(table["coupling"][frame], dtype=np.float64), COMs, box,
+                                               args.reorganization_energy, args.temp, field, args.charge, site_energies)
+        networks.append(network)
+        sample_times.append(np.linspace(0., args.n_hops / np.mean(network["total"][network["total"] > 0]), args.n_samples + 1)[1:])
+    print(f"- INFO - Marcus rates (lambda = {args.reorganization_energy} eV, T = {args.temp} K, sigma = {args.sigma} eV, field = {args.field} V/cm); "
+          f"mean out-going rate: {np.mean([np.mean(network['total']) for network in networks]):.3e} s^-1.")
+
+    n_tasks_per_frame = -(-args.n_walkers // args.walkers_per_task)
+    seeds = np.random.SeedSequence(args.seed).spawn(len(networks) * n_tasks_per_frame)
+    tasks = [(frame, len(block), seeds[frame * n_tasks_per_frame + k])
+             for frame in range(len(networks)) for k, block in enumerate(np.array_split(np.arange(args.n_walkers), n_tasks_per_frame))]
+    print(f"- INFO - {args.n_walkers} walkers per frame in {len(tasks)} tasks by {args.n_workers} worker(s).")
+    start = time.perf_counter()
+    results = srckmc.run_kmc({"networks": networks, "sample_times": sample_times}, tasks, args.n_workers)
+    wall_time = time.perf_counter() - start
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    msd_file = os.path.join(args.output_dir, 'kmc_msd.csv')
+    frames = []
+    with open(msd_file, 'w') as f:
+        f.write("frame_time_ps,time_s,msd_A2,drift_x_A\n")
+        for frame in range(len(networks)):
+            result = results[frame]
+            msd = result["variance"].sum(axis=-1)
+            D = srckmc.diffusion_coefficient(sample_times[frame], msd)
+            frames.append({"time"     : times[frame],
+                           "n_walkers": result["n_walkers"],
+                           "n_hops"   : int(result["n_hops"]),
+                           "D_cm2_s"  : D * srckmc.A2_TO_CM2,
+                           "mobility_einstein_cm2_Vs": srckmc.einstein_mobility(D, args.temp)})
+            if args.field != 0:
+                velocity = np.sum(result["mean"][:, 0] * sample_times[frame]) / np.sum(sample_times[frame]**2) # Å/s
+                frames[-1]["mobility_drift_cm2_Vs"] = args.charge * velocity * 1e-8 / args.field
+            f.write("".join(f"{times[frame]},{t:.6e},{m:.6e},{x:.6e}\n" for t, m, x in zip(sample_times[frame], msd, result["mean"][:, 0])))
+
+    n_hops = sum(frame["n_hops"] for frame in frames)
+    summary = {"couplings_file"       : args.couplings,
+               "reorganization_energy": args.reorganization_energy,
+               "temperature"          : args.temp,
+               "sigma"                : args.sigma,
+               "field_V_cm"           : args.field,
+               "charge"               : args.charge,
+               "n_frames"             : len(frames),
+               "n_hops"               : n_hops,
+               "wall_time_s"          : wall_time,
+               "hops_per_s"           : n_hops / wall_time}
+    for key in [key for key in frames[0] if key.endswith(("cm2_s", "cm2_Vs"))]:
+        summary[f"{key}_mean"] = float(np.mean([frame[key] for frame in frames]))
+        summary[f"{key}_std"]  = float(np.std([frame[key] for frame in frames]))
+    summary["frames"] = frames
+    summary_file = os.path.join(args.output_dir, 'kmc_summary.json')
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"- INFO - {n_hops} hops in {wall_time:.1f} s ({n_hops / wall_time:.3e} hops/s).")
+    print(f"**DONE** D = {summary['D_cm2_s_mean']:.3e} cm^2/s, mobility (Einstein) = {summary['mobility_einstein_cm2_Vs_mean']:.3e} cm^2/(V s); "
+          f"MSD in {msd_file}, summary in {summary_file}.")
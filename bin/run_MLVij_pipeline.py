@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+In-process ML-Vij pipeline: morphology --> (log) orbital overlaps --> electronic couplings --> fitted distributions.
+
+Does in a single process (and in memory) what `PROC_MLVij_step01_predictions.bash`, `..._step02_plot_the_inferred_overlaps.bash`,
+and `..._step03_convert_to_EC_and_plot.bash` do via three scripts and CSV files; the statistics of the distributions
+(skewed-Gaussian fits and their peaks, <V_ij>) are written to a JSON file and to `0_data_couplings_cutoff{CUTOFF}A.txt`.
+The intermediate files (pair records, overlaps and couplings CSV files) are optional (`--write-intermediate True`).
+
+USAGE:
+  python run_MLVij_pipeline.py -s local_topol.tpr -f 1-relax-100ns-whole.gro -t 300 -l D -n 100ns -r PMAP \
+         --map-file ../mappings_PMAP.json --ML-model ../NN/.../trained_model_AA --cutoff 9
+"""
+
+import os, sys
+import argparse
+import json
+import time
+import csv
+import multiprocessing
+
+
+SLOPE     =  0.8091639975519355 # from [https://doi.org/10.1021/jacsau.4c00276]
+INTERCEPT = -1.5699211355668465 # from [https://doi.org/10.1021/jacsau.4c00276]
+
+REPOBASE = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+LIBDIR   = os.path.join(REPOBASE, 'bin', 'lib')
+
+
+def predict_all_frames(config, frame_blocks, n_workers, universe=None):
+    """
+    Yields the frame results (see `src.prediction.predict_frame`) of all the `frame_blocks`, in frame order,
+    either serially (in this process, reusing `universe`) or with `n_workers` worker processes.
+    """
+    import src.prediction as srcprediction
+    if n_workers > 1:
+        with multiprocessing.get_context("spawn").Pool(n_workers, initializer=srcprediction.init_worker, initargs=(config,)) as pool:
+            for frame_results in pool.imap(srcprediction.predict_frame_block, frame_blocks):
+                yield from frame_results
+    else:
+        srcprediction.init_worker(config, universe)
+        for frame_block in frame_blocks:
+            yield from srcprediction.predict_frame_block(frame_block)
+
+
+def gather_pairs(frame_results):
+    """
+    Concatenates the per-pair arrays of the frame results --> pair records (`src.pair_records.COUPLING_DTYPE`, couplings not filled yet).
+    """
+    import numpy as np
+    import src.pair_records as srcpairrecords
+    blocks, pair_index = [], 0
+    for frame_result in frame_results:
+        n_pairs = len(frame_result["distances"])
+        blocks.append(srcpairrecords.make_pair_records(np.arange(pair_index+1, pair_index+1+n_pairs), frame_result["distances"],
+                                                       frame_result["resids_i"], frame_result["resids_j"],
+                                                       frame_result["time"], frame_result["predictions"]))
+        pair_index += n_pairs
+    records = np.zeros(pair_index, dtype=srcpairrecords.COUPLING_DTYPE)
+    if blocks:
+        pairs = np.concatenate(blocks)
+        for field in srcpairrecords.PAIR_DTYPE.names:
+            records[field] = pairs[field]
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Morphology --> orbital overlaps --> electronic couplings --> distributions, in a single process.')
+    parser.add_argument('-f', '--gro-file', default=None , type=str  , help='name of GRO file of the morphology (not needed if a trajectory is given)')
+    parser.add_argument('-s', '--tpr-file', required=True, type=str  , help='name of TPR file of the morphology')
+    parser.add_argument('-x', '--traj-file', default=None, type=str  , help='name of XTC/TRR trajectory of the morphology; if given, the frames are read from it')
+    parser.add_argument('-t', '--temp'    , default=300  , type=int  , help='temperature at which the sample was taken; default = 300')
+    parser.add_argument('-l', '--label'   , default='D'  , type=str  , help='label identifying the run (replica); default = "D"')
+    parser.add_argument('-n', '--snap'    , default='100ns', type=str, help='time at which the snapshot was taken; default = "100ns"')
+    parser.add_argument('-c', '--cutoff'  , default=9    , type=int  , help='cutoff for pair selection (ang); default = 9')
+    parser.add_argument('-r', '--resname' , required=True, type=str  , help='name of the residue to be analyzed (i.e., the polymer: PMAP, PEPP, or PVBP)')
+    parser.add_argument('--map-file'      , required=True, type=str  , help='name of JSON file containing mappings')
+    parser.add_argument('--pdb-to-align-n', default=None , type=str  , help='PDB file of the neutral conformation; default = bin/lib/NMPHTH-<resname>-opt-neutral-wB97X.pdb')
+    parser.add_argument('--pdb-to-align-r', default=None , type=str  , help='PDB file of the radical anion conformation; default = bin/lib/NMPHTH-<resname>-opt-radical_anion-wB97X.pdb')
+    parser.add_argument('--ML-model'      , required=True, type=str  , nargs='+', help='trained model folder(s); several models --> ensemble mean')
+    parser.add_argument('--backend'       , default='keras', type=str, help='inference backend: *keras* or *numpy* (TensorFlow-free; see export_model_to_numpy.py)')
+    parser.add_argument('--trajstep'      , default=1    , type=int  , help='Step size for trajectory; default = 1 = read all frames')
+    parser.add_argument('--batch-size'    , default=4096 , type=int  , help='number of pairs pushed through the NN at once; default = 4096')
+    parser.add_argument('-j', '--n-workers', default=1   , type=int  , help='number of worker processes analyzing blocks of frames; default = 1 (serial)')
+    parser.add_argument('--frames-per-block', default=10 , type=int  , help='number of frames per block handed to a worker; default = 10')
+    parser.add_argument('--slope'         , default=SLOPE, type=float, help=f'slope     of linear relationship between log(overlaps) and log(couplings); default = {SLOPE}')
+    parser.add_argument('--intercept'     , default=INTERCEPT, type=float, help=f'intercept of linear relationship between log(overlaps) and log(couplings); default = {INTERCEPT}')
+    parser.add_argument('--soc'           , default='000', type=str  , help='*optional* state of charge of the polymer (label of the TXT output); default = "000"')
+    parser.add_argument('--percent'       , default=''   , type=str  , help='*optional* percent of solvent (label of the TXT output)')
+    parser.add_argument('-o', '--output-dir', default=None, type=str , help='output folder; default = pair-predictions-<temp>K-<label>-<snap>')
+    parser.add_argument('--fit-method'    , default='binned', type=str, help='skewed-Gaussian fits on the *binned* counts (default) or on every sample (*exact*)')
+    parser.add_argument('--bootstrap'     , default=0    , type=int  , help='number of bootstrap replicas for the 95%% CI of the peak of the log couplings; default = 0 (no CI)')
+    parser.add_argument('--write-intermediate', default=False, type=lambda s: s == 'True', help='True if you want *also* the pair records (NPY), overlaps and couplings (CSV) files')
+    parser.add_argument('--test'          , default=False, type=lambda s: s == 'True', help='True if you want to run a test (pairs of the first 2 MONOMERs only)')
+    parser.add_argument('--verbose'       , default=False, type=lambda s: s == 'True', help='True if you want verbose output')
+
+    args = parser.parse_args()
+    if not args.gro_file and not args.traj_file:
+        parser.error('either a GRO file (-f) or a trajectory (-x) is needed')
+    if args.fit_method not in ['binned', 'exact']:
+        parser.error(f"unknown fit method '{args.fit_method}'; either 'binned' or 'exact'")
+    RESNAME     = args.resname
+    CUTOFF      = args.cutoff
+    SLOPE       = args.slope
+    INTERCEPT   = args.intercept
+    OUTPUTDIR   = args.output_dir or f"pair-predictions-{args.temp}K-{args.label}-{args.snap}"
+    PDBtoALIGNn = args.pdb_to_align_n or os.path.join(LIBDIR, f'NMPHTH-{RESNAME}-opt-neutral-wB97X.pdb')
+    PDBtoALIGNr = args.pdb_to_align_r or os.path.join(LIBDIR, f'NMPHTH-{RESNAME}-opt-radical_anion-wB97X.pdb')
+    VERBOSE     = args.verbose
+    # Heavy modules are imported only now, i.e., after the arguments have been parsed (fast `--help`)
+    import numpy as np
+    import src.prediction as srcprediction
+    import src.pair_records as srcpairrecords
+    import src.distributions as srcdistributions
+    from log10overlap_to_ECeV import from_log_overlap_to_ec_in_eV, from_log_overlap_to_log_ec, write_values
+
+    os.makedirs(OUTPUTDIR, exist_ok=True)
+    with open(args.map_file) as json_mappings:
+        GROUP_selection = json.load(json_mappings)["AA"]
+
+    begin = time.time()
+
+    # 1) Morphology --> pairs within the cutoff and their predicted (log) overlaps
+    u = srcprediction.load_universe(args.tpr_file, args.gro_file, args.traj_file)
+    config = {"tpr_file"       : args.tpr_file,
+              "coord_file"     : args.gro_file,
+              "traj_file"      : args.traj_file,
+              "resname"        : RESNAME,
+              "group_selection": GROUP_selection,
+              "pdb_to_align_n" : PDBtoALIGNn,
+              "pdb_to_align_r" : PDBtoALIGNr,
+              "feature"        : "distmat",
+              "model_paths"    : args.ML_model,
+              "backend"        : args.backend,
+              "cutoff"         : CUTOFF,
+              "batch_size"     : args.batch_size,
+              "n_max"          : 2 if args.test else None,
+              "make_whole"     : True,
+              "return_features": False,
+              "feature_cache_entry": None,
+              "verbose"        : VERBOSE}
+    frame_blocks = srcprediction.make_frame_blocks(len(u.trajectory), args.trajstep, args.frames_per_block)
+    records = gather_pairs(predict_all_frames(config, frame_blocks, args.n_workers, u))
+    print(f"- INFO - {len(records)} pairs within {CUTOFF} ang in {sum(len(block) for block in frame_blocks)} frames ({time.time()-begin:.1f} s).")
+    if len(records) == 0:
+        sys.exit("ERROR! No pairs within the cutoff; nothing to convert or fit. Exiting...")
+
+    # 2) (log) overlaps --> (log) couplings
+    log_overlaps  = records['log_overlap'].astype(float)
+    couplings     = from_log_overlap_to_ec_in_eV(SLOPE, INTERCEPT, log_overlaps)
+    log_couplings = from_log_overlap_to_log_ec(SLOPE, INTERCEPT, log_overlaps)
+    records['coupling']     = couplings
+    records['log_coupling'] = log_couplings
+
+    # 3) Distributions: skewed-Gaussian fits and their peaks (same bins and initial guesses as the plotting scripts)
+    overlaps_data  = log_overlaps[log_overlaps != 0.0]
+    couplings_data = log_couplings[log_couplings != 0.0]
+    overlap_statistics  = srcdistributions.fit_distribution(overlaps_data , srcdistributions.OVERLAP_BIN_EDGES ,
+                                                            [100, np.mean(overlaps_data), np.std(overlaps_data)], method=args.fit_method)
+    coupling_statistics = srcdistributions.fit_distribution(couplings_data, srcdistributions.COUPLING_BIN_EDGES,
+                                                            [10, np.mean(couplings_data)+0.5, np.std(couplings_data)], method=args.fit_method,
+                                                            n_bootstrap=args.bootstrap, n_workers=args.n_workers)
+    average_Vij_from_peak = 10**coupling_statistics["peak_position"] # eV
+    print(f"The peak of the log10 overlaps  is at {overlap_statistics['peak_position']}")
+    print(f"The peak of the log10 couplings is at {coupling_statistics['peak_position']}, which means {average_Vij_from_peak} eV")
+    if args.bootstrap > 0:
+        low, high = coupling_statistics["peak_position_CI95"]
+        print(f"95% CI of the peak of the log10 couplings ({args.bootstrap} bootstrap replicas): [{low}, {high}], i.e., [{10**low}, {10**high}] eV")
+
+    summary = {"resname": RESNAME, "cutoff": CUTOFF, "slope": SLOPE, "intercept": INTERCEPT,
+               "models": args.ML_model, "n_frames": sum(len(block) for block in frame_blocks), "n_pairs": int(len(records)),
+               "log_overlaps": overlap_statistics, "log_couplings": coupling_statistics, "mean_Vij_eV": average_Vij_from_peak}
+    with open(os.path.join(OUTPUTDIR, f"MLVij_summary_cutoff{CUTOFF:02d}A.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+    with open(os.path.join(OUTPUTDIR, f"0_data_couplings_cutoff{CUTOFF:02d}A.txt"), 'w') as txtout:
+        txtout.write('polymer SoC percent mean_Vij (eV)\n')
+        txtout.write('---------------------------------------\n')
+        txtout.write(f'{RESNAME}    {args.soc}    {args.percent}    {average_Vij_from_peak}\n')
+
+    # Optional intermediate files (same names and formats as steps 01 and 03)
+    if args.write_intermediate:
+        with srcpairrecords.PairRecordWriter(os.path.join(OUTPUTDIR, f"pairs_predicted_cutoff{CUTOFF:02d}A.npy"), srcpairrecords.COUPLING_DTYPE) as writer:
+            writer.append(records)
+        IDs = srcpairrecords.format_IDs(records['pair_index'])
+        with open(os.path.join(OUTPUTDIR, f"overlaps_predicted_cutoff{CUTOFF:02d}A.csv"), 'w') as f:
+            csv.writer(f).writerows(zip(IDs, records['log_overlap']))
+        with open(os.path.join(OUTPUTDIR, 'couplings.csv'), 'w') as f:
+            write_values(f, IDs, couplings)
+        with open(os.path.join(OUTPUTDIR, 'log_couplings.csv'), 'w') as f:
+            write_values(f, IDs, log_couplings)
+
+    print(f"**DONE** in {time.time()-begin:.1f} s; <V_ij> = {int(round(average_Vij_from_peak*1000,0))} meV; results in {OUTPUTDIR}.")
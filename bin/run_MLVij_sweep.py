@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Runs `run_MLVij_pipeline.py` over a polymer x SoC x percent x replica grid, several systems at a time.
+
+Replaces the nested `for SoC`/`for percent` loops of the PROC scripts: the grid (JSON; see `lib/sweep_grid_paper.json`)
+is expanded into a DAG (`gmx grompp` --> pipeline, per cell), which is run on the local machine within a budget of cores.
+TPRs are cached (`predictions/tpr_cache/`, keyed by the contents of TOP + includes, GRO, and MDP) and reused across runs;
+cells with results already present are skipped, so re-running the same command continues an interrupted sweep.
+The <V_ij> of all the cells are gathered in `predictions/<model_label>/0_data_couplings_cutoff{CUTOFF}A.txt`.
+
+USAGE:
+  python run_MLVij_sweep.py --grid lib/sweep_grid_paper.json --cores 32 --cores-per-cell 4
+"""
+
+import os, sys
+import argparse
+import json
+import src.sweep as srcsweep
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sweep of the ML-Vij pipeline over a polymer x SoC x percent x replica grid.')
+    parser.add_argument('--grid'          , required=True, type=str, help='JSON file with the grid (see lib/sweep_grid_paper.json)')
+    parser.add_argument('--cores'         , default=os.cpu_count(), type=int, help=f'budget of cores used at a time; default = {os.cpu_count()} (all)')
+    parser.add_argument('--cores-per-cell', default=1    , type=int, help='worker processes (-j) of each pipeline run; default = 1')
+    parser.add_argument('--tpr-cache'     , default=None , type=str, help='folder of the cached TPRs; default = predictions/tpr_cache')
+    parser.add_argument('--force'         , default=False, type=lambda s: s == 'True', help='True if you want to re-run the cells with results already present')
+    parser.add_argument('--dry-run'       , default=False, type=lambda s: s == 'True', help='True if you want to print the commands without running them')
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        grid = json.load(f)
+    TPR_CACHE = args.tpr_cache or os.path.join(srcsweep.REPOBASE, 'predictions', 'tpr_cache')
+    os.makedirs(TPR_CACHE, exist_ok=True)
+
+    cells = srcsweep.expand_grid(grid)
+    tasks, missing = srcsweep.build_dag(grid, cells, TPR_CACHE, cores_per_cell=args.cores_per_cell, force=args.force)
+    for cell in missing:
+        print(f"- WARNING - {cell['name']}: missing {cell['gro_file']} and/or {cell['top_file']}; skipped.")
+    if not tasks:
+        sys.exit("ERROR! No cell of the grid has its input files. Exiting...")
+    print(f"- INFO - {len(cells)} cells ({len(missing)} w/o inputs) --> {len(tasks)} tasks on {args.cores} cores.")
+
+    status = srcsweep.run_dag(tasks, args.cores, dry_run=args.dry_run)
+
+    # Gather the <V_ij> of the cells (same format as the TXT file of step03)
+    data_file = os.path.join(srcsweep.REPOBASE, 'predictions', grid["model_label"], f'0_data_couplings_cutoff{grid["cutoff"]:02d}A.txt')
+    if not args.dry_run:
+        with open(data_file, 'w') as txtout:
+            txtout.write('polymer SoC percent replica mean_Vij (eV)\n')
+            txtout.write('---------------------------------------\n')
+            for cell in cells:
+                summary_file = os.path.join(cell["output_dir"], f'MLVij_summary_cutoff{grid["cutoff"]:02d}A.json')
+                if os.path.exists(summary_file):
+                    with open(summary_file) as f:
+                        mean_Vij = json.load(f)["mean_Vij_eV"]
+                    txtout.write(f'{cell["polymer"]}    {cell["SoC"]}    {cell["percent"]}    {cell["replica"]}    {mean_Vij}\n')
+
+    n_failed = sum(1 for value in status.values() if value != "done")
+    print(f"**DONE**: {len(status)-n_failed}/{len(status)} tasks done" + (f", {n_failed} failed/skipped (see their logs)" if n_failed else "") +
+          ("" if args.dry_run else f"; <V_ij> in {data_file}."))
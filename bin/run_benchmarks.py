@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Scaling benchmarks of the predictor on synthetic morphologies: throughput (pairs/s) and peak memory vs.
+number of monomers x number of frames x cutoff x number of workers.
+
+The synthetic morphologies (copies of `lib/NMPHTH-{polymer}-opt-neutral-wB97X.pdb` in a periodic box; see `src/synthetic.py`)
+are written once to the `--workdir` and reused. Without `--ML-model`, a NN with random weights and the architecture of the
+trained overlap NNs is used (NumPy engine; same cost of inference). Each case appends one record (JSON line, labelled with
+the version of the code) to `--output`; with `--compare`, the throughput and the peak memory are compared to those of the
+same cases in a baseline file (e.g., the records of the previous version) and the exit status is 1 if any case regressed.
+
+USAGE:
+  python run_benchmarks.py --n-monomers 500 1000 2000 4000 --n-frames 5 --cutoffs 9 12 -o bench.jsonl
+  python run_benchmarks.py --mode stages --n-monomers 2000 --compare bench_previous_version.jsonl
+"""
+
+import os, sys
+import argparse
+import itertools
+import src.benchmark as srcbenchmark
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scaling benchmarks of the predictor on synthetic morphologies.')
+    parser.add_argument('--mode'          , default='end-to-end', type=str, help='*end-to-end* (predict_overlaps--pairs.py, outputs included) or *stages* (per-frame pipeline only); default = end-to-end')
+    parser.add_argument('--polymer'       , default='PMAP', type=str, help='polymer whose QC-optimized unit is replicated (PMAP or PVBP); default = PMAP')
+    parser.add_argument('--n-monomers'    , default=[500, 1000, 2000], type=int, nargs='+', help='numbers of monomers of the synthetic morphologies; default = 500 1000 2000')
+    parser.add_argument('--n-frames'      , default=[1]  , type=int  , nargs='+', help='numbers of frames of the synthetic morphologies; default = 1')
+    parser.add_argument('--cutoffs'       , default=[9]  , type=int  , nargs='+', help='cutoffs for pair selection (Å); default = 9')
+    parser.add_argument('--density'       , default=3.0  , type=float, help='number density of monomers (nm^-3); default = 3.0')
+    parser.add_argument('-j', '--n-workers', default=[1] , type=int  , nargs='+', help='numbers of worker processes (end-to-end mode only); default = 1')
+    parser.add_argument('--ML-model'      , default=None , type=str  , help='trained NN (folder or exported NumPy weights); default = NN with random weights')
+    parser.add_argument('--backend'       , default='numpy', type=str, help='inference backend: *keras* or *numpy*; default = numpy')
+    parser.add_argument('--batch-size'    , default=4096 , type=int  , help='number of pairs pushed through the NN at once; default = 4096')
+    parser.add_argument('--repeats'       , default=1    , type=int  , help='runs per case (the fastest one is recorded); default = 1')
+    parser.add_argument('--seed'          , default=0    , type=int  , help='seed of the synthetic morphologies; default = 0')
+    parser.add_argument('--workdir'       , default='benchmarks', type=str, help='folder of the synthetic morphologies and of the runs; default = benchmarks')
+    parser.add_argument('-o', '--output'  , default='benchmarks/benchmark_results.jsonl', type=str, help='file the records are appended to (JSON lines); default = benchmarks/benchmark_results.jsonl')
+    parser.add_argument('--compare'       , default=None , type=str  , help='file of baseline records (e.g., of the previous version) to compare the new records to')
+    parser.add_argument('--tolerance'     , default=0.1  , type=float, help='relative loss of throughput (or gain of peak memory) counted as a regression; default = 0.1')
+    args = parser.parse_args()
+    if args.mode not in srcbenchmark.MODES:
+        parser.error(f"unknown mode '{args.mode}'; either 'end-to-end' or 'stages'")
+    if args.mode == 'stages' and args.n_workers != [1]:
+        parser.error("the stages mode is serial (-j 1)")
+    # Heavy modules are imported only now, i.e., after the arguments have been parsed (fast `--help`)
+    import src.synthetic as srcsynthetic
+
+    WORKDIR = os.path.realpath(args.workdir)
+    os.makedirs(WORKDIR, exist_ok=True)
+    if args.ML_model:
+        MODEL_PATH = os.path.realpath(args.ML_model)
+    else:
+        if args.backend != 'numpy':
+            parser.error("the NN with random weights needs the NumPy backend (or give a trained NN with --ML-model)")
+        MODEL_PATH = srcsynthetic.write_synthetic_model(os.path.join(WORKDIR, 'synthetic_model.npz'))
+
+    environment = srcbenchmark.environment_info()
+    print(f"- INFO - benchmarking version {environment['version']} on {environment['host']} ({environment['n_cpus']} CPUs); records --> {args.output}")
+    print(f"{'case':40s} {'pairs':>10s} {'wall (s)':>10s} {'pairs/s':>12s} {'peak RSS (MB)':>14s}")
+
+    records = []
+    for n_monomers, n_frames, cutoff, n_workers in itertools.product(args.n_monomers, args.n_frames, args.cutoffs, args.n_workers):
+        case = {"mode": args.mode, "polymer": args.polymer, "n_monomers": n_monomers, "n_frames": n_frames, "cutoff": cutoff,
+                "number_density": args.density, "n_workers": n_workers, "backend": args.backend, "batch_size": args.batch_size}
+        files = srcsynthetic.write_synthetic_morphology(os.path.join(WORKDIR, 'morphologies', f'{args.polymer}_n{n_monomers}_f{n_frames}_d{args.density}_s{args.seed}'),
+                                                        args.polymer, n_monomers, args.density, n_frames, args.seed)
+        results = []
+        for _ in range(args.repeats):
+            if args.mode == 'end-to-end':
+                results.append(srcbenchmark.run_end_to_end(case, files, MODEL_PATH, os.path.join(WORKDIR, 'runs', srcbenchmark.case_label(case))))
+            else:
+                results.append(srcbenchmark.run_stages(case, files, MODEL_PATH))
+        best = max(results, key=lambda result: result["pairs_per_s"])
+        record = {**case, **environment, "model": "synthetic" if not args.ML_model else args.ML_model, "box_A": files["box"],
+                  "repeats": args.repeats, **best}
+        srcbenchmark.append_result(args.output, record)
+        records.append(record)
+        print(f"{srcbenchmark.case_label(case):40s} {best['n_pairs']:10d} {best['wall_time_s']:10.3f} {best['pairs_per_s']:12.1f} {best['peak_rss_MB']:14.1f}")
+
+    if args.compare:
+        comparisons = srcbenchmark.compare_results(srcbenchmark.load_results(args.compare), records, args.tolerance)
+        if not comparisons:
+            sys.exit(f"ERROR! None of the cases is in {args.compare}. Exiting...")
+        print(f"\nComparison with {args.compare} (ratios new/baseline):")
+        print(f"{'case':52s} {'pairs/s':>12s} {'ratio':>7s} {'peak RSS':>10s} {'ratio':>7s}")
+        for label, _, speed, speed_ratio, _, memory, memory_ratio, regression in comparisons:
+            print(f"{label:52s} {speed:12.1f} {speed_ratio:7.3f} {memory:10.1f} {memory_ratio:7.3f}" + ("  REGRESSION" if regression else ""))
+        n_regressions = sum(comparison[-1] for comparison in comparisons)
+        if n_regressions:
+            sys.exit(f"ERROR! {n_regressions} case(s) regressed by more than {100*args.tolerance:.0f}%. Exiting...")
+    print(f"**DONE** {len(records)} cases benchmarked; records appended to {args.output}.")
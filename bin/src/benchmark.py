@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmarks of the predictor on synthetic morphologies (see `src/synthetic.py`).
+
+Each case (polymer, number of monomers, number of frames, cutoff, number of workers, ...) is run either
+- "end-to-end": `predict_overlaps--pairs.py` in a subprocess, outputs included (its timing report is read back), or
+- "stages": the per-frame pipeline only (`init_worker` + `predict_frame_block`, no outputs), in a fresh process;
+and gives one record (JSON line) with the throughput (pairs/s), the peak memory, and the time spent in each stage,
+labelled with the version of the code, so that the records of two versions can be compared (`compare_results`).
+"""
+
+import os, sys
+import json
+import time
+import socket
+import datetime
+import platform
+import subprocess
+import multiprocessing
+import concurrent.futures
+
+
+REPOBASE = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+BINDIR   = os.path.join(REPOBASE, 'bin')
+
+MODES     = ['end-to-end', 'stages']
+CASE_KEYS = ["mode", "polymer", "n_monomers", "n_frames", "cutoff", "number_density", "n_workers", "backend", "batch_size"]
+
+
+def code_version():
+    """
+    Version of the code being benchmarked (`git describe`; "-dirty" if there are uncommitted changes).
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPOBASE, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment_info():
+    """
+    Labels of the records: version of the code, date, machine, and versions of the main dependencies.
+    """
+    import numpy as np
+    import MDAnalysis as mda
+    return {"version"    : code_version(),
+            "date"       : datetime.datetime.now().isoformat(timespec='seconds'),
+            "host"       : socket.gethostname(),
+            "n_cpus"     : os.cpu_count(),
+            "python"     : platform.python_version(),
+            "numpy"      : np.__version__,
+            "MDAnalysis" : mda.__version__}
+
+
+def case_label(case):
+    """
+    Short label of a case (e.g., "PMAP_n1000_f5_c09_d3.0_j1_numpy_b4096"; also the name of its run folder).
+    """
+    return (f'{case["polymer"]}_n{case["n_monomers"]}_f{case["n_frames"]}_c{case["cutoff"]:02d}_d{case["number_density"]}'
+            f'_j{case["n_workers"]}_{case["backend"]}_b{case["batch_size"]}')
+
+
+def run_end_to_end(case, files, model_path, workdir):
+    """
+    Runs `predict_overlaps--pairs.py` on the synthetic morphology `files` (see `write_synthetic_morphology`) in `workdir`.
+
+    Returns
+    --------
+    result: dict
+        n_pairs, wall_time_s, pairs_per_s, peak_rss_MB, and stages (from the timing report of the predictor).
+    """
+    import src.synthetic as srcsynthetic
+    os.makedirs(workdir, exist_ok=True)
+    command = [sys.executable, os.path.join(BINDIR, 'predict_overlaps--pairs.py'),
+               '-s', files["psf"], '-x', files["xtc"], '-t', '300', '-l', 'B', '-n', 'bench', '-c', str(case["cutoff"]),
+               '-r', case["polymer"], '--map-file', os.path.join(REPOBASE, f'mappings_{case["polymer"]}.json'),
+               '--pdb-to-align-n', srcsynthetic.unit_pdb(case["polymer"], "neutral"),
+               '--pdb-to-align-r', srcsynthetic.unit_pdb(case["polymer"], "radical_anion"),
+               '--ML-model', model_path, '--backend', case["backend"], '--batch-size', str(case["batch_size"]),
+               '-j', str(case["n_workers"]), '--output-format', case.get("output_format", "npy")]
+    with open(os.path.join(workdir, 'predict_overlaps.out'), 'w') as log:
+        result = subprocess.run(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        sys.exit(f"ERROR! Benchmark {case_label(case)} failed (see {os.path.join(workdir, 'predict_overlaps.out')}). Exiting...")
+    with open(os.path.join(workdir, 'pair-predictions-300K-B-bench', f'predict_overlaps_cutoff{case["cutoff"]:02d}A_report.json')) as f:
+        report = json.load(f)
+    peak_rss = [value for value in report["peak_rss_MB"].values() if value is not None]
+    return {"n_pairs"    : report["n_pairs"],
+            "wall_time_s": report["wall_time_s"],
+            "pairs_per_s": report["pairs_per_s"],
+            "peak_rss_MB": max(peak_rss),
+            "stages"     : report["stages"]}
+
+
+def _run_stages(case, files, model_path):
+    """
+    Runs the per-frame pipeline of all the frames (in the current process; see `run_stages`).
+    """
+    import MDAnalysis as mda
+    import src.prediction as srcprediction
+    import src.synthetic as srcsynthetic
+    from src.timing import TIMER, peak_rss_MB
+    with open(os.path.join(REPOBASE, f'mappings_{case["polymer"]}.json')) as json_mappings:
+        mappings = json.load(json_mappings)
+    config = {"tpr_file": files["psf"], "coord_file": None, "traj_file": files["xtc"], "resname": case["polymer"],
+              "group_selection": mappings["AA"],
+              "pdb_to_align_n": srcsynthetic.unit_pdb(case["polymer"], "neutral"),
+              "pdb_to_align_r": srcsynthetic.unit_pdb(case["polymer"], "radical_anion"),
+              "feature": "distmat", "model_paths": [model_path], "backend": case["backend"], "cutoff": case["cutoff"],
+              "batch_size": case["batch_size"], "n_max": None, "make_whole": True, "return_features": False,
+              "feature_cache_entry": None, "verbose": False}
+    mda.stop_logging()
+    with TIMER.stage("universe_load"):
+        universe = srcprediction.load_universe(config["tpr_file"], config["coord_file"], config["traj_file"])
+    srcprediction.init_worker(config, universe)
+    begin = time.perf_counter()
+    frame_results = srcprediction.predict_frame_block(list(range(len(universe.trajectory))))
+    wall_time = time.perf_counter() - begin
+
+    stages = {}
+    for frame_result in frame_results:
+        for name, timing in frame_result["timings"].items():
+            stages.setdefault(name, {"time_s": 0., "calls": 0})
+            stages[name]["time_s"] += timing["time_s"]
+            stages[name]["calls"]  += timing["calls"]
+    n_pairs = sum(len(frame_result["distances"]) for frame_result in frame_results)
+    return {"n_pairs"    : n_pairs,
+            "wall_time_s": wall_time,
+            "pairs_per_s": n_pairs/wall_time,
+            "peak_rss_MB": peak_rss_MB(),
+            "stages"     : dict(sorted(stages.items(), key=lambda item: -item[1]["time_s"]))}
+
+
+def run_stages(case, files, model_path):
+    """
+    Runs the per-frame pipeline (frame reading, make_whole, COMs, neighbour search, alignment, featurization, inference;
+    no outputs) of all the frames of the synthetic morphology `files`, serially, in a fresh process (so that its peak memory
+    is that of the case alone). The throughput does not include the loading of the Universe and of the NN.
+    """
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(_run_stages, case, files, model_path).result()
+
+
+def load_results(filename):
+    """
+    Reads the records (one JSON object per line) of `filename`.
+    """
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_result(filename, record):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def compare_results(baseline, records, tolerance=0.1):
+    """
+    Compares the `records` to the `baseline` records of the same cases (the latest baseline record of each case counts).
+
+    Returns
+    --------
+    comparisons: list
+        (case label, baseline pairs/s, pairs/s, ratio, baseline peak RSS, peak RSS, ratio, regression) per case found in both;
+        a regression is a throughput lower, or a peak memory higher, than the baseline by more than `tolerance`.
+    """
+    reference = {tuple(record.get(key) for key in CASE_KEYS): record for record in baseline}
+    comparisons = []
+    for record in records:
+        old = reference.get(tuple(record.get(key) for key in CASE_KEYS))
+        if old is None:
+            continue
+        speed  = record["pairs_per_s"] / old["pairs_per_s"]
+        memory = record["peak_rss_MB"] / old["peak_rss_MB"]
+        comparisons.append((f'{record["mode"]}:{case_label(record)}', old["pairs_per_s"], record["pairs_per_s"], speed,
+                            old["peak_rss_MB"], record["peak_rss_MB"], memory, speed < 1.-tolerance or memory > 1.+tolerance))
+    return comparisons
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Coupling network of the MONOMERs: one weighted, undirected graph per frame, the nodes being the MONOMERs (resids) and the
+edges the pairs within the cutoff, weighted by their electronic coupling.
+
+The graphs are `scipy.sparse` CSR adjacency matrices built from the pair arrays of a frame (memory and time scale with the
+number of pairs, never with N x N); their connectivity (connected components, largest cluster) is obtained with
+`scipy.sparse.csgraph`, also as a function of a cutoff on the coupling (only the edges with coupling >= cutoff are kept),
+which gives the percolation threshold of the charge-transport network. The pairs are read, frame by frame, from the binary
+records written by `log10overlap_to_ECeV.py` (`couplings.npy`) or from `couplings.csv` + `pairs_info_*.dat`.
+
+NOTE: the nodes are identified by the resids of the pair records, which must then be unique within the morphology.
+"""
+
+import sys
+import numpy as np
+import scipy.sparse
+from scipy.sparse import csgraph
+import src.pair_records as srcpairrecords
+
+
+PERCOLATION_FRACTION = 0.5 # the network percolates when its largest cluster holds (at least) this fraction of the MONOMERs
+
+
+def load_pair_table(couplings_file, pairs_info_file=None):
+    """
+    Reads the pairs (resid_i, resid_j, time) and their couplings (eV) from the binary records (`couplings.npy`, memory-mapped)
+    or from a `couplings.csv` ("ID,coupling") + the `pairs_info_*.dat` file of the same run (matched by pair index).
+
+    Returns
+    --------
+    table: dict
+        "resid_i", "resid_j", "time" (ps), and "coupling" (eV) arrays, in the order of the pair indices (i.e., frame by frame).
+    """
+    if couplings_file.endswith('.npy'):
+        records = srcpairrecords.load_pair_records(couplings_file)
+        if 'coupling' not in records.dtype.names or 'resid_i' not in records.dtype.names:
+            sys.exit(f"ERROR! {couplings_file} does not contain pair records with couplings (see log10overlap_to_ECeV.py). Exiting...")
+        return {"resid_i": records['resid_i'], "resid_j": records['resid_j'], "time": records['time'], "coupling": records['coupling']}
+
+    if pairs_info_file is None:
+        sys.exit(f"ERROR! The pairs (resids, time) of {couplings_file} are in the pairs_info_*.dat file of the run: pass it too. Exiting...")
+    IDs, couplings = np.loadtxt(couplings_file, delimiter=',', unpack=True, ndmin=2)
+    pair_indices, resids_i, resids_j, times = np.loadtxt(pairs_info_file, usecols=(0, 2, 3, 4), unpack=True, ndmin=2, comments='#')
+    order = np.argsort(pair_indices)
+    position = np.searchsorted(pair_indices, IDs, sorter=order)
+    if np.any(position >= len(pair_indices)) or np.any(pair_indices[order[np.minimum(position, len(order)-1)]] != IDs):
+        sys.exit(f"ERROR! Some pair indices of {couplings_file} are not in {pairs_info_file}. Exiting...")
+    rows = order[position]
+    return {"resid_i": resids_i[rows].astype(np.int64), "resid_j": resids_j[rows].astype(np.int64),
+            "time": times[rows], "coupling": couplings}
+
+
+def frame_slices(times):
+    """
+    Slices of the consecutive pairs with the same time, i.e., of the frames (the pairs are stored frame by frame).
+    """
+    times = np.asarray(times)
+    bounds = np.concatenate([[0], np.flatnonzero(times[1:] != times[:-1]) + 1, [len(times)]])
+    return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def build_adjacency(nodes_i, nodes_j, weights, n_nodes):
+    """
+    Symmetric CSR adjacency matrix (n_nodes, n_nodes) of the edges (nodes_i[k], nodes_j[k]) weighted by `weights[k]` (> 0).
+    """
+    rows = np.concatenate([nodes_i, nodes_j])
+    cols = np.concatenate([nodes_j, nodes_i])
+    data = np.concatenate([weights, weights]).astype(np.float64)
+    return scipy.sparse.csr_matrix((data, (rows, cols)), shape=(n_nodes, n_nodes))
+
+
+def cluster_sizes(adjacency):
+    """
+    Sizes of the connected components of the graph (isolated nodes are clusters of size 1), largest first.
+    """
+    _, labels = csgraph.connected_components(adjacency, directed=False)
+    return np.sort(np.bincount(labels))[::-1]
+
+
+def percolation_curve(nodes_i, nodes_j, log_couplings, n_nodes, log_cutoffs):
+    """
+    Connectivity of the graph keeping only the edges with log10 coupling >= each of the `log_cutoffs`.
+
+    Returns
+    --------
+    curve: dict
+        For each cutoff: "largest_fraction" (size of the largest cluster / n_nodes), "n_components", and "mean_cluster_size"
+        (mean size of the clusters a node belongs to, the largest cluster excluded: peaks at the percolation threshold).
+    """
+    order = np.argsort(log_couplings)[::-1] # strongest first --> the edges kept by a cutoff are a prefix
+    nodes_i, nodes_j, log_couplings = nodes_i[order], nodes_j[order], log_couplings[order]
+    n_edges = np.searchsorted(-log_couplings, -np.asarray(log_cutoffs), side='right')
+    curve = {"largest_fraction": np.zeros(len(log_cutoffs)), "n_components": np.zeros(len(log_cutoffs), dtype=int),
+             "mean_cluster_size": np.zeros(len(log_cutoffs))}
+    for k, n in enumerate(n_edges):
+        sizes = cluster_sizes(build_adjacency(nodes_i[:n], nodes_j[:n], np.ones(n), n_nodes))
+        curve["largest_fraction"][k]  = sizes[0] / n_nodes
+        curve["n_components"][k]      = len(sizes)
+        curve["mean_cluster_size"][k] = np.sum(sizes[1:]**2) / max(n_nodes - sizes[0], 1)
+    return curve
+
+
+def percolation_threshold(log_cutoffs, largest_fraction, fraction=PERCOLATION_FRACTION):
+    """
+    Largest log10 coupling cutoff at which the largest cluster holds `fraction` of the nodes (linearly interpolated);
+    NaN if it never does.
+    """
+    log_cutoffs, largest_fraction = np.asarray(log_cutoffs), np.asarray(largest_fraction)
+    order = np.argsort(log_cutoffs)[::-1] # from the strongest cutoff (fewest edges) to the weakest
+    log_cutoffs, largest_fraction = log_cutoffs[order], largest_fraction[order]
+    above = np.flatnonzero(largest_fraction >= fraction)
+    if len(above) == 0:
+        return np.nan
+    k = above[0]
+    if k == 0:
+        return log_cutoffs[0]
+    x0, x1, y0, y1 = log_cutoffs[k-1], log_cutoffs[k], largest_fraction[k-1], largest_fraction[k]
+    return x0 + (fraction - y0) * (x1 - x0) / (y1 - y0)
+
+
+def analyze_network(table, log_cutoffs, n_nodes=None, fraction=PERCOLATION_FRACTION, VERBOSE=False):
+    """
+    Builds the coupling graph of each frame of the pair `table` (see `load_pair_table`; or in-memory arrays with the same keys)
+    and computes its connectivity, with all the edges and as a function of the `log_cutoffs` (log10 eV).
+
+    Parameters
+    ----------
+    table: dict
+        "resid_i", "resid_j", "time", and "coupling" (eV) arrays of the pairs, frame by frame.
+    log_cutoffs: ndarray
+        Cutoffs on the log10 coupling for the percolation analysis.
+    n_nodes: int
+        Number of MONOMERs; default: the number of resids found in the pairs (MONOMERs without any pair are then missed).
+    fraction: float
+        Fraction of the MONOMERs in the largest cluster defining the percolation threshold.
+    VERBOSE: bool
+        If True, prints more information.
+
+    Returns
+    --------
+    frames: list
+        Per frame: time, n_nodes, n_edges, n_components, largest_cluster, percolation_threshold (log10 eV), and the curve
+        (see `percolation_curve`).
+    """
+    resids = np.unique(np.concatenate([np.asarray(table["resid_i"]), np.asarray(table["resid_j"])]))
+    n_nodes = n_nodes or len(resids)
+    if n_nodes < len(resids):
+        sys.exit(f"ERROR! {len(resids)} MONOMERs found in the pairs, more than n_nodes = {n_nodes}. Exiting...")
+
+    frames = []
+    for frame in frame_slices(table["time"]):
+        nodes_i = np.searchsorted(resids, table["resid_i"][frame])
+        nodes_j = np.searchsorted(resids, table["resid_j"][frame])
+        couplings = np.asarray(table["coupling"][frame], dtype=np.float64)
+        keep = couplings > 0
+        nodes_i, nodes_j, couplings = nodes_i[keep], nodes_j[keep], couplings[keep]
+
+        sizes = cluster_sizes(build_adjacency(nodes_i, nodes_j, couplings, n_nodes))
+        curve = percolation_curve(nodes_i, nodes_j, np.log10(couplings), n_nodes, log_cutoffs)
+        frames.append({"time"           : float(table["time"][frame.start]),
+                       "n_nodes"        : n_nodes,
+                       "n_edges"        : len(couplings),
+                       "n_components"   : len(sizes),
+                       "largest_cluster": int(sizes[0]),
+                       "percolation_threshold": float(percolation_threshold(log_cutoffs, curve["largest_fraction"], fraction)),
+                       "curve"          : curve})
+        if VERBOSE:
+            print(f"- INFO - t = {frames[-1]['time']} ps: {len(couplings)} edges, {len(sizes)} components (largest: {sizes[0]} MONOMERs), "
+                  f"percolation at log10 V = {frames[-1]['percolation_threshold']:.3f}")
+    return frames
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Distributions of the (log) orbital overlaps and electronic couplings: skewed-Gaussian fit and position of its peak.
+
+Shared by the plotting scripts (`just_plot_data_and_fit.py`, `just_plot_couplings_vs_state_of_charge.py`)
+and by the in-process pipeline (`run_MLVij_pipeline.py`).
+
+Two fitting methods:
+- *binned* (default): maximum likelihood on the counts of a fine histogram (`FIT_N_BINS` bins spanning the data);
+  its cost does not depend on the number of samples once the histogram is built (millions of pairs from trajectories);
+- *exact*: `scipy.stats.skewnorm.fit` on every sample (the original method; kept for validation).
+The uncertainty of the peak position is estimated by (parallel) bootstrap; in the binned method, a bootstrap
+replica is a multinomial resampling of the histogram counts, which is equivalent to resampling the samples.
+"""
+
+import multiprocessing
+import numpy as np
+from scipy.stats import skewnorm
+from scipy.signal import find_peaks
+from scipy import optimize
+from scipy import special
+
+
+OVERLAP_BIN_EDGES  = np.linspace(-8,-1,100) # log10 overlaps
+COUPLING_BIN_EDGES = np.linspace(-6,1,280)  # log10 couplings (eV); better (sharper) and more sensitivity for the fit
+FIT_N_BINS         = 2000                   # bins of the histogram fitted by the *binned* method
+FIT_METHODS        = ['binned', 'exact']
+
+
+def remove_zeros(IDs, dataY):
+    """
+    """
+    indices_of_zero_dataY = np.argwhere(dataY == 0.0) # get indices of zeros in the dataY
+    IDs  = np.delete(IDs,  indices_of_zero_dataY)
+    dataY = np.delete(dataY, indices_of_zero_dataY)
+    print(f'Sizes of the IDs ({len(IDs)}) and dataY ({len(dataY)}) vectors (after removing zeros).')
+    return IDs, dataY
+
+
+def fit_skewnorm_to_the_data(dataY, initial_guess, method='binned'):
+    """
+    Fits a skewed Gaussian to `dataY` with either method ('binned' or 'exact'); returns (skewness, loc, scale).
+    """
+    if method == 'exact':
+        params = skewnorm.fit(dataY, initial_guess[0], loc=initial_guess[1], scale=initial_guess[2]) # a, log, scale = skewness, mean, st_dev
+        return params
+    elif method == 'binned':
+        counts, fit_bin_edges = make_fit_histogram(dataY)
+        return fit_skewnorm_to_the_histogram(counts, fit_bin_edges, initial_guess)
+    else:
+        raise ValueError(f"unknown fitting method '{method}'; either {' or '.join(FIT_METHODS)}")
+
+
+def make_fit_histogram(dataY, n_bins=FIT_N_BINS):
+    """
+    Histogram (counts, bin edges) of `dataY` on `n_bins` bins spanning its range, as fitted by the *binned* method.
+    """
+    return np.histogram(dataY, bins=np.linspace(np.min(dataY), np.max(dataY), n_bins+1))
+
+
+def fit_skewnorm_to_the_histogram(counts, bin_edges, initial_guess, outliers=None):
+    """
+    Maximum (multinomial) likelihood fit of a skewed Gaussian to the histogram `counts` over `bin_edges`:
+    maximizes sum_k counts_k*log(P_k), with P_k the probability of the k-th bin (difference of the CDF at its edges).
+    The `outliers` (samples out of the range of fixed bins) enter the likelihood one by one, with their log PDF.
+
+    Returns
+    --------
+    params: tuple
+        skewness, loc, scale (same as `scipy.stats.skewnorm.fit`).
+    """
+    outliers = np.asarray(outliers if outliers is not None else [], dtype=float)
+    nonzero = counts > 0
+    counts  = counts[nonzero]
+    lower, upper = bin_edges[:-1][nonzero], bin_edges[1:][nonzero]
+
+    log_widths = np.log(upper - lower)
+    centers    = (upper + lower)/2
+
+    def negative_log_likelihood(params):
+        a, loc, scale = params
+        if scale <= 0:
+            return np.inf
+        # CDF of the skewed Gaussian, F(z) = Phi(z) - 2*T(z, a), with special functions (much faster than skewnorm.cdf);
+        # in the far tails (outliers), where the difference of the CDFs is not resolved, P_k ~ pdf(center)*width
+        cdf_upper = special.ndtr((upper - loc)/scale) - 2*special.owens_t((upper - loc)/scale, a)
+        cdf_lower = special.ndtr((lower - loc)/scale) - 2*special.owens_t((lower - loc)/scale, a)
+        z = (centers - loc)/scale
+        log_pdf = np.log(2/scale) - z**2/2 - np.log(2*np.pi)/2 + special.log_ndtr(a*z)
+        probabilities = cdf_upper - cdf_lower
+        resolved = probabilities > 1e-10
+        log_probabilities = np.where(resolved, np.log(np.where(resolved, probabilities, 1.)), log_pdf + log_widths)
+        z_outliers = (outliers - loc)/scale
+        log_pdf_outliers = np.log(2/scale) - z_outliers**2/2 - np.log(2*np.pi)/2 + special.log_ndtr(a*z_outliers)
+        return -np.dot(counts, log_probabilities) - np.sum(log_pdf_outliers)
+
+    # Same optimizer (and starting point) as skewnorm.fit, so that both methods land on the same optimum
+    return tuple(optimize.fmin(negative_log_likelihood, initial_guess, disp=False))
+
+
+def extract_mean_as_peak_position(x, params, dataY, bin_edges):
+    """
+    """
+    pdf_values = skewnorm.pdf(x, *params)*len(dataY) * (bin_edges[1] - bin_edges[0])
+    # Find peaks in the PDF using scipy.signal.find_peaks
+    peaks, _ = find_peaks(pdf_values)
+    # Select the peak with the highest PDF value
+    peak_position = x[peaks[np.argmax(pdf_values[peaks])]]
+    return peak_position
+
+
+def peak_position_or_nan(x, params, dataY, bin_edges):
+    """
+    Same as `extract_mean_as_peak_position`, but NaN if the PDF has no peak on `x` (e.g., a poorly populated histogram,
+    or values out of the range of the bins) or if the parameters are not finite (failed fit).
+    """
+    if not np.all(np.isfinite(params)):
+        return np.nan
+    pdf_values = skewnorm.pdf(x, *params)*len(dataY) * (bin_edges[1] - bin_edges[0])
+    peaks, _ = find_peaks(pdf_values)
+    if len(peaks) == 0:
+        return np.nan
+    return x[peaks[np.argmax(pdf_values[peaks])]]
+
+
+def bin_centers(bin_edges):
+    return (bin_edges[:-1] + bin_edges[1:]) / 2
+
+
+class RunningHistogram:
+    """
+    Histogram on fixed `bin_edges` and running moments (count, mean, variance, skewness, min, max) of a stream of values,
+    updated one frame at a time (zeros are discarded, as in `remove_zeros`); the values themselves are not stored,
+    except for the (few) outliers out of the range of the bins, so that the fit matches the one on all the values.
+    """
+
+    def __init__(self, bin_edges):
+        self.bin_edges = np.asarray(bin_edges, dtype=float)
+        self.counts    = np.zeros(len(self.bin_edges)-1, dtype=np.int64)
+        self.outliers  = [np.empty(0)] # values out of the range of the bins
+        self.n         = 0
+        self.mean      = 0.
+        self.M2        = 0. # sums of the squared and cubed deviations from the mean
+        self.M3        = 0.
+        self.min       = np.inf
+        self.max       = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[values != 0.0]
+        if len(values) == 0:
+            return
+        self.counts  += np.histogram(values, bins=self.bin_edges)[0]
+        self.outliers.append(values[(values < self.bin_edges[0]) | (values > self.bin_edges[-1])])
+        # Combine the moments of the batch with the running ones (pairwise update of Chan et al.)
+        n_batch, mean_batch = len(values), np.mean(values)
+        M2_batch, M3_batch = np.sum((values - mean_batch)**2), np.sum((values - mean_batch)**3)
+        delta = mean_batch - self.mean
+        n_total = self.n + n_batch
+        self.M3   += M3_batch + delta**3*self.n*n_batch*(self.n - n_batch)/n_total**2 + 3*delta*(self.n*M2_batch - n_batch*self.M2)/n_total
+        self.M2   += M2_batch + delta**2*self.n*n_batch/n_total
+        self.mean += delta*n_batch/n_total
+        self.n     = n_total
+        self.min   = min(self.min, np.min(values))
+        self.max   = max(self.max, np.max(values))
+
+    @property
+    def std(self):
+        return np.sqrt(self.M2/self.n) if self.n else np.nan
+
+    @property
+    def skewness(self):
+        return np.sqrt(self.n)*self.M3/self.M2**1.5 if self.M2 > 0 else np.nan
+
+    def moments_initial_guess(self):
+        """
+        Skewed Gaussian with the running mean, std, and skewness (method of moments, as the default start of skewnorm.fit).
+        """
+        skewness = np.clip(self.skewness, -0.99, 0.99)
+        skewness_23 = np.abs(skewness)**(2/3)
+        delta = np.sign(skewness)*np.sqrt(np.pi/2*skewness_23/(skewness_23 + ((4 - np.pi)/2)**(2/3)))
+        scale = self.std/np.sqrt(1 - 2*delta**2/np.pi)
+        return [delta/np.sqrt(1 - delta**2), self.mean - scale*delta*np.sqrt(2/np.pi), scale]
+
+    def fit_or_nan(self, initial_guess=None):
+        """
+        Skewed-Gaussian fit of the running histogram (+ outliers); returns (params, peak position).
+        Default `initial_guess`: the running moments; a far-off guess (e.g., a skewness of the wrong sign) can end in another optimum.
+        Never raises (it runs every frame of a prediction): the peak position is NaN if the fitted PDF has no peak on the bins,
+        and the parameters too if the fit fails.
+        """
+        try:
+            params = fit_skewnorm_to_the_histogram(self.counts, self.bin_edges, initial_guess or self.moments_initial_guess(),
+                                                   np.concatenate(self.outliers))
+        except (ValueError, FloatingPointError, RuntimeError):
+            return (np.nan, np.nan, np.nan), np.nan
+        return params, peak_position_or_nan(bin_centers(self.bin_edges), params, self.counts, self.bin_edges)
+
+    def as_dict(self, prefix):
+        return {f"{prefix}_bin_edges": self.bin_edges, f"{prefix}_counts": self.counts,
+                f"{prefix}_outliers": np.concatenate(self.outliers), f"{prefix}_n": self.n,
+                f"{prefix}_mean": self.mean, f"{prefix}_std": self.std, f"{prefix}_skewness": self.skewness, f"{prefix}_min": self.min, f"{prefix}_max": self.max}
+
+
+def _bootstrap_peak_positions(args):
+    """
+    Peak positions of the bootstrap replicas with the given seeds (run in a worker process).
+    """
+    sample, bin_edges, initial_guess, method, seeds = args
+    peak_positions = []
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        if method == 'binned':
+            counts, fit_bin_edges = sample
+            params = fit_skewnorm_to_the_histogram(rng.multinomial(counts.sum(), counts/counts.sum()), fit_bin_edges, initial_guess)
+        else:
+            params = fit_skewnorm_to_the_data(rng.choice(sample, size=len(sample), replace=True), initial_guess, method=method)
+        # (the normalization of the PDF, i.e., the number of samples, does not matter to the position of its peak)
+        peak_positions.append(extract_mean_as_peak_position(bin_centers(bin_edges), params, bin_edges, bin_edges))
+    return peak_positions
+
+
+def bootstrap_peak_position(dataY, bin_edges, initial_guess, method='binned', n_bootstrap=200, confidence=0.95, n_workers=1, seed=0):
+    """
+    Bootstrap confidence interval of the peak position (located on the centers of `bin_edges`, as the point estimate).
+    The fits of the replicas start from `initial_guess`: pass the parameters fitted to `dataY` (far-off guesses can
+    end in other local optima). The replicas are spread over `n_workers` processes (forked: the plotting scripts are not import-safe).
+
+    Returns
+    --------
+    low, high: float
+        Bounds of the (percentile) confidence interval at `confidence`.
+    peak_positions: np.ndarray
+        Peak positions of the `n_bootstrap` replicas.
+    """
+    sample = make_fit_histogram(dataY) if method == 'binned' else np.asarray(dataY)
+    seeds  = np.random.SeedSequence(seed).generate_state(n_bootstrap)
+    chunks = [(sample, bin_edges, initial_guess, method, chunk) for chunk in np.array_split(seeds, max(1, min(n_workers, n_bootstrap)))]
+    if n_workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        with multiprocessing.get_context('fork').Pool(len(chunks)) as pool:
+            results = pool.map(_bootstrap_peak_positions, chunks)
+    else:
+        results = [_bootstrap_peak_positions(chunk) for chunk in chunks]
+    peak_positions = np.concatenate(results)
+    low, high = np.quantile(peak_positions, [(1-confidence)/2, (1+confidence)/2])
+    return float(low), float(high), peak_positions
+
+
+def fit_distribution(dataY, bin_edges, initial_guess, method='binned', n_bootstrap=0, n_workers=1):
+    """
+    Fits a skewed Gaussian to `dataY` and locates its peak on the centers of `bin_edges` (as the plotting scripts do);
+    with `n_bootstrap` > 0, also the 95% bootstrap confidence interval of the peak position.
+
+    Returns
+    --------
+    statistics: dict
+        n_samples, fitting method, skewnorm parameters (skewness, loc, scale), peak position [and its CI], sample mean and std.
+    """
+    params = fit_skewnorm_to_the_data(dataY, initial_guess, method=method)
+    statistics = {"n_samples"    : int(len(dataY)),
+                  "method"       : method,
+                  "params"       : [float(param) for param in params],
+                  "peak_position": float(extract_mean_as_peak_position(bin_centers(bin_edges), params, dataY, bin_edges)),
+                  "mean"         : float(np.mean(dataY)),
+                  "std"          : float(np.std(dataY))}
+    if n_bootstrap > 0:
+        low, high, _ = bootstrap_peak_position(dataY, bin_edges, params, method=method, n_bootstrap=n_bootstrap, n_workers=n_workers)
+        statistics["peak_position_CI95"] = [low, high]
+        statistics["n_bootstrap"] = int(n_bootstrap)
+    return statistics
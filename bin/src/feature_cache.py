@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+On-disk, content-addressed cache of the feature vectors of the pairs of a morphology.
+
+The features (alignment onto the QC-optimized conformations + reciprocal distance matrices) do not depend on the
+trained NN, so re-scoring a morphology with a different model can go straight to the inference. An entry is keyed
+by a hash of the *contents* of the input files (GRO/TPR/XTC, mappings JSON, reference PDBs) and of the parameters of
+the featurization (cutoff, frame stride, ...); it is a folder with:
+- `features.npy`: the (P, n_features) float32 feature vectors of all the pairs, in frame order (memory-mapped on reads);
+- `pairs.npz`   : frames, times, number of pairs per frame, COM-COM distances and resids of the pairs.
+Entries are least-recently-used first evicted when the cache grows beyond its maximum size.
+"""
+
+import os, sys
+import json
+import shutil
+import hashlib
+import numpy as np
+import src.pair_records as srcpairrecords
+
+
+FEATURE_CACHE_VERSION = 1 # bump whenever the featurization changes, so that older entries are never hit
+
+FEATURES_FILE = 'features.npy'
+PAIRS_FILE    = 'pairs.npz'
+
+
+def hash_file(filename, hasher=None, chunk_size=2**24):
+    """
+    Updates `hasher` (default: a new sha256) with the contents of `filename`, read in chunks; returns the hasher.
+    """
+    hasher = hasher or hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher
+
+
+def make_cache_key(input_files, parameters):
+    """
+    Returns the key (hex digest) of the features computed from `input_files` (dict: role --> path, or None) with `parameters` (dict).
+    """
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps({"version": FEATURE_CACHE_VERSION, "parameters": parameters}, sort_keys=True).encode())
+    for role in sorted(input_files):
+        hasher.update(role.encode())
+        if input_files[role]:
+            hash_file(input_files[role], hasher)
+    return hasher.hexdigest()
+
+
+class FeatureCacheEntry:
+    """
+    Read-only view of a cache entry: pair metadata in memory, features memory-mapped.
+    """
+
+    def __init__(self, entry_dir):
+        self.entry_dir = entry_dir
+        with np.load(os.path.join(entry_dir, PAIRS_FILE)) as data:
+            self.frames    = data["frames"]
+            self.times     = data["times"]
+            self.n_pairs   = data["n_pairs"]
+            self.distances = data["distances"]
+            self.resids_i  = data["resids_i"]
+            self.resids_j  = data["resids_j"]
+        self.features = np.load(os.path.join(entry_dir, FEATURES_FILE), mmap_mode='r')
+        self.offsets  = np.concatenate([[0], np.cumsum(self.n_pairs)])
+        self.position = {int(frame): k for k, frame in enumerate(self.frames)}
+
+    def frame(self, frame_index):
+        """
+        Returns the pairs of frame `frame_index` as a frame result (see `src.prediction.predict_frame`) *without*
+        predictions, plus their "features" (memory-mapped).
+        """
+        if frame_index not in self.position:
+            sys.exit(f"ERROR! Frame {frame_index} not found in the feature cache entry {self.entry_dir}. Exiting...")
+        k = self.position[frame_index]
+        pairs = slice(self.offsets[k], self.offsets[k+1])
+        return {"frame"    : int(self.frames[k]),
+                "time"     : float(self.times[k]),
+                "distances": self.distances[pairs],
+                "resids_i" : self.resids_i[pairs],
+                "resids_j" : self.resids_j[pairs],
+                "features" : self.features[pairs]}
+
+
+class FeatureCacheWriter:
+    """
+    Writes a new entry frame by frame (see `append`) into a temporary folder, which is moved into place by `commit`.
+    """
+
+    def __init__(self, cache, key):
+        self.cache   = cache
+        self.key     = key
+        self.tmp_dir = os.path.join(cache.cache_dir, f"{key}.tmp-{os.getpid()}")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.features_writer = None
+        self.metadata = {"frames": [], "times": [], "n_pairs": [], "distances": [], "resids_i": [], "resids_j": []}
+
+    def append(self, frame_result):
+        """
+        Appends the pairs (and their "features") of a frame result.
+        """
+        features = frame_result["features"]
+        if self.features_writer is None:
+            self.features_writer = srcpairrecords.PairRecordWriter(os.path.join(self.tmp_dir, FEATURES_FILE), np.float32, features.shape[1:])
+        self.features_writer.append(features)
+        self.metadata["frames"].append(frame_result["frame"])
+        self.metadata["times"].append(frame_result["time"])
+        self.metadata["n_pairs"].append(len(frame_result["distances"]))
+        self.metadata["distances"].append(frame_result["distances"])
+        self.metadata["resids_i"].append(frame_result["resids_i"])
+        self.metadata["resids_j"].append(frame_result["resids_j"])
+
+    def commit(self):
+        """
+        Completes the entry and moves it into the cache (atomically); then enforces the size limit of the cache.
+        """
+        if self.features_writer is None:
+            self.discard() # nothing to cache
+            return
+        self.features_writer.close()
+        np.savez(os.path.join(self.tmp_dir, PAIRS_FILE),
+                 frames   =np.array(self.metadata["frames"], dtype=int),
+                 times    =np.array(self.metadata["times"], dtype=float),
+                 n_pairs  =np.array(self.metadata["n_pairs"], dtype=int),
+                 distances=np.concatenate(self.metadata["distances"]),
+                 resids_i =np.concatenate(self.metadata["resids_i"]),
+                 resids_j =np.concatenate(self.metadata["resids_j"]))
+        entry_dir = self.cache.entry_dir(self.key)
+        if os.path.exists(entry_dir): # written meanwhile by another run
+            self.discard()
+        else:
+            os.replace(self.tmp_dir, entry_dir)
+        self.cache.evict()
+
+    def discard(self):
+        if self.features_writer is not None:
+            self.features_writer.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class FeatureCache:
+    """
+    Folder of cache entries (one sub-folder per key), bounded to `max_size_GB`; the last use of an entry is its mtime.
+    """
+
+    def __init__(self, cache_dir, max_size_GB=20.):
+        self.cache_dir = cache_dir
+        self.max_size  = int(max_size_GB * 1024**3)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key):
+        """
+        Returns True (and marks the entry as used) if the entry `key` is in the cache.
+        """
+        entry_dir = self.entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return False
+        os.utime(entry_dir)
+        return True
+
+    def load(self, key):
+        return FeatureCacheEntry(self.entry_dir(key))
+
+    def writer(self, key):
+        return FeatureCacheWriter(self, key)
+
+    def entries(self):
+        """
+        Returns the (mtime, size in bytes, folder) of the complete entries, least recently used first.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if '.tmp-' in name or not os.path.isdir(entry_dir):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+            entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in its maximum size (the most recent entry is always kept).
+        """
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in entries[:-1]:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
@@ -1,18 +1,20 @@
 #!/usr/bin/env python3
 
 import os, sys
-from MDAnalysis.analysis import align
 from MDAnalysis.analysis import distances as mda_dist
+from MDAnalysis.lib import distances as mda_libdist
+from MDAnalysis.lib.mdamath import triclinic_vectors
+import itertools
 import numpy as np
 import json
+from src.timing import TIMER
 
 # Set up some paths and folders
 REPOBASE   = os.path.realpath(os.path.join(os.path.dirname(__file__), '..')) # define path of "REPOBASE"
 WORKDIR    = os.getcwd()
 LIBDIR     = os.path.join( REPOBASE, "lib")
-print(f"@RA@ REPOBASE={REPOBASE}")
-print(f"@RA@ WORKDIR={WORKDIR}")
-print(f"@RA@ LIBDIR={LIBDIR}")
+
+_CHARGES = {} # charges of the MONOMER atoms per resolution, loaded once (see `load_charges`)
  
 
 def align_MONOMER(universe, residue, RESNAME, neutral_or_cation,  selection_for_alignment, pdb_to_align, VERBOSE=False):
@@ -28,6 +30,8 @@ def align_MONOMER(universe, residue, RESNAME, neutral_or_cation,  selection_for_
     NOTE: It takes only 36 seconds for a morphology with 100 chains with $N=30$.
     """
     
+    from MDAnalysis.analysis import align
+
     QC_opt = pdb_to_align
 
     if VERBOSE:
@@ -56,6 +60,72 @@ def align_MONOMER(universe, residue, RESNAME, neutral_or_cation,  selection_for_
     return mobile, ref_MD_frame
 
 
+def batch_align_MONOMERS(ref_positions, weights, mobile_positions, neutral_or_cation="neutral", VERBOSE=False):
+    """
+    Aligns the QC-optimized conformation onto *all* the monomers of a frame at once.
+
+    Same result as calling `align_MONOMER` on every residue (mass-weighted superposition of
+    the `selection_for_alignment` atoms), but the optimal rotations are computed for all the
+    residues together with a batched (weighted) Kabsch algorithm [Kabsch1976] in NumPy.
+    Only the coordinates of the selected atoms of the QC-optimized conformation are returned,
+    so that each residue is aligned once per frame and the pair featurizer reads them from here.
+
+    [Kabsch1976] Wolfgang Kabsch (1976), Acta Crystallographica A 32(5):922-923.
+
+    Parameters
+    ----------
+    ref_positions: ndarray
+        Positions of the selected atoms of the MD residues with dimensions (n_monomers, n_atoms, 3).
+    weights: ndarray
+        Weights (masses) of the selected atoms of the MD residues, either (n_atoms,) or (n_monomers, n_atoms).
+    mobile_positions: ndarray
+        Positions of the selected atoms of the QC-optimized conformation with dimensions (n_atoms, 3).
+    neutral_or_cation: string
+        Label of the QC-optimized conformation (only used for printing).
+    VERBOSE: bool
+        If True, prints more information.
+
+    Returns
+    --------
+    aligned_positions: ndarray
+        Positions of the QC-optimized conformation aligned onto each residue, (n_monomers, n_atoms, 3).
+    rmsd_before: ndarray
+        Weighted RMSD before the rotation (after the translation), (n_monomers,).
+    rmsd_after: ndarray
+        Weighted RMSD after the rotation, (n_monomers,).
+    """
+    ref_positions    = np.asarray(ref_positions, dtype=np.float64)
+    mobile_positions = np.asarray(mobile_positions, dtype=np.float64)
+    weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), ref_positions.shape[:2])
+    weights = weights / weights.sum(axis=1, keepdims=True)
+
+    # Center both the references and the mobile structure on their (weighted) centers
+    ref_com    = np.einsum('na,nax->nx', weights, ref_positions)
+    ref_coords = ref_positions - ref_com[:, None, :]
+    mobile_coords = mobile_positions[None, :, :] - np.einsum('na,ax->nx', weights, mobile_positions)[:, None, :]
+
+    # Weighted covariance matrices and their SVD --> optimal rotations (no reflections)
+    covariance = np.einsum('na,nax,nay->nxy', weights, mobile_coords, ref_coords)
+    U, _, Vt = np.linalg.svd(covariance)
+    sign = np.sign(np.linalg.det(np.matmul(U, Vt)))
+    Vt[:, 2, :] *= sign[:, None]
+    rotation = np.matmul(U, Vt) # (n_monomers, 3, 3); applied as `coords @ rotation`
+
+    aligned_coords = np.matmul(mobile_coords, rotation)
+
+    rmsd_before = np.sqrt(np.einsum('na,na->n', weights, np.sum((mobile_coords - ref_coords)**2, axis=2)))
+    rmsd_after  = np.sqrt(np.einsum('na,na->n', weights, np.sum((aligned_coords - ref_coords)**2, axis=2)))
+
+    if np.any((rmsd_before - rmsd_after) <= -0.1):
+        worst = np.argmin(rmsd_before - rmsd_after)
+        sys.exit(f"ERROR!? RMSD before ({round(rmsd_before[worst],4)}) < after ({round(rmsd_after[worst],4)}) alignment!? Please check what's up.")
+    if VERBOSE:
+        print(f"- INFO - *{neutral_or_cation}* conformation aligned onto {len(ref_positions)} residues; "
+              f"RMSD before ({round(np.mean(rmsd_before),4)}) and after ({round(np.mean(rmsd_after),4)}) alignment (averages).")
+
+    return aligned_coords + ref_com[:, None, :], rmsd_before, rmsd_after
+
+
 def fast_compute_and_store_reciprocal_distmat(mon_or_pair, index, MOLi_residue, MOLj_residue, MAPjsonFILE, i_ID, j_ID, 
                                               STORE, OUTDIR, ALSO_CM, ALSO_1D, universe, VERBOSE):
     """
@@ -207,6 +277,105 @@ def compute_recip_distmat(MOLi_residue, MOLj_residue, universe, VERBOSE=False):
     return reciprocal_distmatrix
 
 
+def minimum_image(vectors, box):
+    """
+    Applies the minimum image convention to an array of distance vectors (..., 3).
+
+    Works for orthorhombic and triclinic boxes; for triclinic boxes, the vectors are first wrapped in
+    fractional coordinates and then compared with the 26 neighbouring images (as `distance_array` does),
+    so that the result is the actual shortest vector also for skewed cells.
+
+    Parameters
+    ----------
+    vectors: ndarray
+        Distance vectors with dimensions (..., 3).
+    box: ndarray
+        Unit cell dimensions [lx, ly, lz, alpha, beta, gamma]; if None, the vectors are returned as they are.
+
+    Returns
+    --------
+    vectors: ndarray
+        The minimum image distance vectors with dimensions (..., 3).
+    """
+    if box is None:
+        return vectors
+    box = np.asarray(box, dtype=np.float64)
+
+    if np.allclose(box[3:], 90.):
+        lengths = box[:3].astype(vectors.dtype)
+        return vectors - lengths * np.round(vectors / lengths)
+
+    h = triclinic_vectors(box).astype(vectors.dtype) # rows are the box vectors a, b, c
+    fractional = vectors @ np.linalg.inv(h).astype(vectors.dtype)
+    vectors = (fractional - np.round(fractional)) @ h
+
+    best = vectors
+    best_d2 = np.sum(vectors**2, axis=-1)
+    for shift in itertools.product((-1, 0, 1), repeat=3):
+        if shift == (0, 0, 0):
+            continue
+        candidate = vectors + np.asarray(shift, dtype=vectors.dtype) @ h
+        candidate_d2 = np.sum(candidate**2, axis=-1)
+        closer = candidate_d2 < best_d2
+        best = np.where(closer[..., None], candidate, best)
+        best_d2 = np.where(closer, candidate_d2, best_d2)
+    return best
+
+
+def batch_compute_recip_distmats(positions_i, positions_j, i_indices, j_indices, box, atoms_to_keep=None):
+    """
+    Computes the (flattened) *reciprocal* distance matrices of many pairs in one vectorized pass.
+
+    Parameters
+    ----------
+    positions_i: ndarray
+        (Aligned) positions of the molecules playing the *i* role with dimensions (n_molecules, n_atoms, 3).
+    positions_j: ndarray
+        (Aligned) positions of the molecules playing the *j* role with dimensions (n_molecules, n_atoms, 3).
+    i_indices: ndarray
+        Indices (in `positions_i`) of the first molecule of each pair, (n_pairs,).
+    j_indices: ndarray
+        Indices (in `positions_j`) of the second molecule of each pair, (n_pairs,).
+    box: ndarray
+        Unit cell dimensions (e.g., `universe.dimensions`); used for the minimum image convention.
+    atoms_to_keep: ndarray
+        Indices of the atoms to be kept (e.g., the heavy atoms only); if None, all atoms are kept.
+
+    Returns
+    --------
+    features: ndarray
+        Contiguous float32 block with dimensions (n_pairs, n_kept*n_kept); each row is the
+        flattened (row-major) reciprocal distance matrix of a pair.
+    """
+    if atoms_to_keep is not None:
+        positions_i = positions_i[:, atoms_to_keep]
+        positions_j = positions_j[:, atoms_to_keep]
+    positions_i = np.asarray(positions_i, dtype=np.float32)
+    positions_j = np.asarray(positions_j, dtype=np.float32)
+
+    vectors = positions_j[j_indices][:, None, :, :] - positions_i[i_indices][:, :, None, :] # (n_pairs, n_i, n_j, 3)
+    vectors = minimum_image(vectors, box)
+    dist_matrices = np.sqrt(np.sum(vectors**2, axis=-1))
+
+    # Take the reciprocal of it (and replace 'inf' with '0', as in `compute_recip_distmat`)
+    features = np.zeros_like(dist_matrices)
+    np.divide(1., dist_matrices, out=features, where=dist_matrices > 0)
+
+    return np.ascontiguousarray(features.reshape(len(dist_matrices), -1), dtype=np.float32)
+
+
+def load_charges(resolution):
+    """
+    Loads the charges of the atoms of the MONOMER (`lib/charges_MOL_{resolution}.npy`) once per process.
+    """
+    if resolution not in _CHARGES:
+        charges_file = os.path.join(LIBDIR, f'charges_MOL_{resolution}.npy')
+        if not os.path.exists(charges_file):
+            sys.exit(f"ERROR! {charges_file} (charges needed by the Coulomb Matrices) not found. Exiting...")
+        _CHARGES[resolution] = np.load(charges_file)
+    return _CHARGES[resolution]
+
+
 def compute_coulmat_inter(MOLi_residue, MOLj_residue, resolution, universe, VERBOSE=False):
     """
     Computes the *intermolecular* Coulomb Matrix between residues *i* and *j.
@@ -222,16 +391,10 @@ def compute_coulmat_inter(MOLi_residue, MOLj_residue, resolution, universe, VERB
                                           box=universe.dimensions)
 
     # Source the charges for the given resolution
-    charges = np.load(os.path.join('lib',f'charges_MOL_{resolution}.npy'))
-
-    # Initialize Coulomb Matrix "inter"
-    coulomb_matrix = np.zeros((len(MOLi_residue.atoms),len(MOLj_residue.atoms)))
+    charges = load_charges(resolution)
 
-    # Coulomb Matrix "inter"
-    for idx_i, atom_i in enumerate(MOLi_residue.atoms, start=0):
-        for idx_j, atom_j in enumerate(MOLj_residue.atoms, start=0):
-            # Z_i*Z_j / ||R_i - R_j||
-            coulomb_matrix[idx_i, idx_j] = charges[idx_i]*charges[idx_j] / dist_matrix[idx_i, idx_j]
+    # Coulomb Matrix "inter": Z_i*Z_j / ||R_i - R_j||
+    coulomb_matrix = np.outer(charges[:len(MOLi_residue.atoms)], charges[:len(MOLj_residue.atoms)]) / dist_matrix
 
     if VERBOSE:
         print(f"- INFO - residues with # atoms: {len(MOLi_residue.atoms)} and {len(MOLj_residue.atoms)}")
@@ -239,3 +402,176 @@ def compute_coulmat_inter(MOLi_residue, MOLj_residue, resolution, universe, VERB
     return coulomb_matrix
 
 
+def batch_compute_coulmats(positions_i, positions_j, i_indices, j_indices, box, charges, atoms_to_keep=None):
+    """
+    Computes the (flattened) *intermolecular* Coulomb Matrices of many pairs in one vectorized pass:
+    the reciprocal distance matrices of `batch_compute_recip_distmats` scaled by Z_i*Z_j (see `compute_coulmat_inter`).
+
+    Parameters
+    ----------
+    positions_i, positions_j, i_indices, j_indices, box, atoms_to_keep:
+        Same as `batch_compute_recip_distmats`.
+    charges: ndarray
+        Charges of the atoms of the MONOMER (same order as the atoms in `positions_i`/`positions_j`), see `load_charges`.
+
+    Returns
+    --------
+    features: ndarray
+        Contiguous float32 block with dimensions (n_pairs, n_kept*n_kept); same layout as `batch_compute_recip_distmats`.
+    """
+    charges = np.asarray(charges, dtype=np.float32)
+    if atoms_to_keep is not None:
+        charges = charges[atoms_to_keep]
+    features = batch_compute_recip_distmats(positions_i, positions_j, i_indices, j_indices, box, atoms_to_keep)
+    features *= np.outer(charges, charges).ravel()
+    return features
+
+
+def build_group_index_table(residues, selection, VERBOSE=False):
+    """
+    Resolves the selection string of a group (e.g., the N-methyl-phthalimide mapping) *once* for all the residues.
+
+    Parameters
+    ----------
+    residues: MDAnalysis ResidueGroup
+        Residues (e.g., all the MONOMERs) for which the group is selected.
+    selection: string
+        Selection string of the group (e.g., `mappings["AA"]`).
+    VERBOSE: bool
+        If True, prints more information.
+
+    Returns
+    --------
+    group_indices: ndarray
+        Atom indices (in `universe.atoms`) of the group with dimensions (n_residues, n_atoms); within each
+        residue, the atoms are in the same order as `residue.atoms.select_atoms(selection)`.
+    group_masses: ndarray
+        Masses of the atoms of the group with dimensions (n_residues, n_atoms).
+    """
+    GROUP = residues.atoms.select_atoms(f'{selection}')
+    order = np.lexsort((GROUP.indices, GROUP.resindices))
+    GROUP = GROUP[order]
+
+    resindices, counts = np.unique(GROUP.resindices, return_counts=True)
+    if len(resindices) != len(residues) or np.any(counts != counts[0]):
+        sys.exit(f"ERROR! The selection '{selection}' does not select the same number of atoms in every residue. Exiting...")
+
+    group_indices = GROUP.indices.reshape(len(residues), counts[0])
+    group_masses  = GROUP.masses.reshape(len(residues), counts[0])
+
+    if VERBOSE:
+        print(f"- INFO - index table with dimensions {group_indices.shape} built for the selection '{selection}'.")
+
+    return group_indices, group_masses
+
+
+def compute_group_COMs(positions, group_indices, group_masses):
+    """
+    Computes the centers of mass of all the groups at once (gather + weighted sum).
+
+    Parameters
+    ----------
+    positions: ndarray
+        Positions of all the atoms (e.g., `universe.atoms.positions`) with dimensions (n_atoms_tot, 3).
+    group_indices: ndarray
+        Atom indices of the groups with dimensions (n_groups, n_atoms) (see `build_group_index_table`).
+    group_masses: ndarray
+        Masses of the atoms of the groups with dimensions (n_groups, n_atoms).
+
+    Returns
+    --------
+    COMs: ndarray
+        The centers of mass with dimensions (n_groups, 3).
+    """
+    group_positions = positions[group_indices] # (n_groups, n_atoms, 3)
+    return np.einsum('na,nax->nx', group_masses, group_positions) / group_masses.sum(axis=1)[:, None]
+
+
+def find_pairs_within_cutoff(positions, cutoff, box=None, VERBOSE=False):
+    """
+    Finds all the (i, j) pairs of positions (e.g., MONOMER COMs) whose distance is equal or less than the `cutoff`.
+
+    Replaces the dense N x N distance matrix + Python double loop over its upper triangle: the neighbour
+    search is done with `MDAnalysis.lib.distances.self_capped_distance` (periodic cell list/KD-tree), so
+    both memory and time scale with the number of pairs rather than with N**2.
+
+    Parameters
+    ----------
+    positions: ndarray
+        Positions with dimensions (n, 3).
+    cutoff: float
+        Cutoff distance (inclusive).
+    box: ndarray
+        Unit cell dimensions [lx, ly, lz, alpha, beta, gamma] (e.g., `universe.dimensions`); None if not periodic.
+    VERBOSE: bool
+        If True, prints more information.
+
+    Returns
+    --------
+    i_indices: ndarray
+        Indices of the first element of each pair (always i < j).
+    j_indices: ndarray
+        Indices of the second element of each pair.
+    distances: ndarray
+        Distances between the elements of each pair.
+
+    The pairs are sorted by i and then by j, i.e., in the same order as walking the upper triangle of the distance matrix.
+    """
+    positions = np.asarray(positions, dtype=np.float32)
+    pairs, distances = mda_libdist.self_capped_distance(positions, max_cutoff=cutoff, box=box)
+    pairs = np.sort(pairs.reshape(-1, 2), axis=1) # make sure that i < j
+
+    order = np.lexsort((pairs[:,1], pairs[:,0]))
+    i_indices = pairs[order,0]
+    j_indices = pairs[order,1]
+    distances = distances[order]
+
+    if VERBOSE:
+        print(f"- INFO - {len(distances)} pairs found within {cutoff} (out of {len(positions)} positions).")
+
+    return i_indices, j_indices, distances
+
+
+def predict_overlaps_in_batches(model, X_scaler, Y_scaler, features, batch_size=4096):
+    """
+    Infers the (log) orbital overlaps of many pairs at once.
+
+    Instead of calling `model.predict` once per pair (i.e., with a 1xN input), the feature
+    vectors are scaled and pushed through the NN in batches of `batch_size` rows, so that
+    Keras sets up its predict loop only once per batch. The order of the rows is preserved.
+
+    Parameters
+    ----------
+    model: keras.Model
+        Trained NN.
+    X_scaler: sklearn scaler
+        *Fitted* scaler of the features (None if already folded into the model, e.g., NumPy engine).
+    Y_scaler: sklearn scaler
+        *Fitted* scaler of the targets (None if already folded into the model, e.g., NumPy engine).
+    features: ndarray
+        Feature vectors with dimensions (n_pairs, n_features).
+    batch_size: int
+        Maximum number of pairs predicted at once.
+
+    Returns
+    --------
+    predictions: ndarray
+        The predicted (log) orbital overlaps with dimensions (n_pairs,).
+    """
+    features = np.atleast_2d(features)
+    predictions = []
+    for start in range(0, len(features), batch_size):
+        batch = features[start:start+batch_size]
+        if X_scaler is not None:
+            with TIMER.stage("scaling"):
+                batch = X_scaler.transform( batch )
+        with TIMER.stage("nn_inference"):
+            y_predicted = model.predict(batch, batch_size=len(batch), verbose=0)
+        if Y_scaler is not None:
+            with TIMER.stage("scaling"):
+                y_predicted = Y_scaler.inverse_transform( y_predicted )
+        predictions.append(y_predicted[:,0])
+
+    if not predictions:
+        return np.zeros(0)
+    return np.concatenate(predictions)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Kinetic Monte Carlo (KMC) of a charge hopping between the MONOMERs, with Marcus rates computed from the (predicted) couplings.
+
+The sites are the MONOMERs (their COMs, i.e., those of the N-methyl-phthalimide groups, as in the predictor) and the hops
+are the pairs of a frame, in both directions. For each frame (one static realization of the network), the rates are put in
+one CSR table: the out-going hops of each site are a row, and a single cumulative sum over all the rows (the per-site
+cumulative rate tables, end to end) lets the hop of each walker be chosen by a binary search (O(log n_hops)). The walkers
+do not interact, so all the walkers of a task hop at once (vectorized over the walkers); independent tasks (blocks of
+walkers, frames) can be run by worker processes. Diffusion coefficients come from the mean square displacements of the
+walkers (unwrapped across the periodic box), and mobilities from the Einstein relation or, in an applied field, the drift.
+"""
+
+import sys
+import numpy as np
+import src.functions as srcfunctions
+import src.unwrap as srcunwrap
+
+
+HBAR    = 6.582119569e-16 # eV s
+K_B     = 8.617333262e-5  # eV/K
+A2_TO_CM2 = 1e-16
+
+_WORKER = {} # per-process state (hopping networks of the frames), set by `init_worker`
+
+
+def marcus_rates(couplings, reorganization_energy, temperature, delta_G=0.):
+    """
+    Marcus hopping rates (s^-1): k = 2pi/hbar |V|^2 (4pi lambda kB T)^-1/2 exp(-(dG + lambda)^2 / (4 lambda kB T)).
+
+    Parameters
+    ----------
+    couplings: ndarray
+        Electronic couplings V (eV).
+    reorganization_energy: float
+        Reorganization energy lambda (eV).
+    temperature: float
+        Temperature (K).
+    delta_G: ndarray
+        Free energy change of the hops (eV); default = 0 (no disorder, no field).
+    """
+    kT = K_B * temperature
+    return (2. * np.pi / HBAR * couplings**2 / np.sqrt(4. * np.pi * reorganization_energy * kT)
+            * np.exp(-(delta_G + reorganization_energy)**2 / (4. * reorganization_energy * kT)))
+
+
+def site_positions(universe, resname, group_selection, times, VERBOSE=False):
+    """
+    COMs of the MONOMERs (N-methyl-phthalimide groups made whole) in the frames at the given `times` (ps).
+
+    Returns
+    --------
+    resids: ndarray
+        Resids of the MONOMERs (the sites).
+    frames: list
+        (COMs (n_sites, 3), box) of each of the `times`.
+    """
+    MONOMERs = universe.select_atoms(f"resname {resname}")
+    GROUP_indices, GROUP_masses = srcfunctions.build_group_index_table(MONOMERs.residues, group_selection, VERBOSE)
+    universe.trajectory.add_transformations(srcunwrap.UnwrapGroups(srcunwrap.build_unwrap_levels(universe, GROUP_indices)))
+    trajectory_times = np.array([universe.trajectory[0].time + universe.trajectory.dt * k for k in range(len(universe.trajectory))])
+    frames = []
+    for time in times:
+        matches = np.flatnonzero(np.isclose(trajectory_times, time, rtol=0., atol=1e-3))
+        if len(matches) == 0:
+            sys.exit(f"ERROR! No frame at t = {time} ps in the trajectory (the pairs must come from the same trajectory). Exiting...")
+        universe.trajectory[matches[0]]
+        frames.append((srcfunctions.compute_group_COMs(universe.atoms.positions, GROUP_indices, GROUP_masses), universe.dimensions.copy()))
+    return MONOMERs.residues.resids, frames
+
+
+def build_hopping_network(sites_i, sites_j, couplings, COMs, box, reorganization_energy, temperature,
+                          field=0., charge=-1, site_energies=None):
+    """
+    Rate table of the hops of one frame: every pair (i, j) gives the hops i --> j and j --> i.
+
+    Parameters
+    ----------
+    sites_i, sites_j: ndarray
+        Sites (indices of the rows of `COMs`) of the pairs.
+    couplings: ndarray
+        Couplings of the pairs (eV).
+    COMs: ndarray
+        Positions of the sites (Å), (n_sites, 3).
+    box: ndarray
+        Box of the frame (MDAnalysis dimensions); the hop vectors are minimum images.
+    reorganization_energy, temperature: float
+        See `marcus_rates`.
+    field: float
+        Electric field along x (V/Å).
+    charge: int
+        Charge of the carrier (in units of e): -1 for an electron (radical anions), +1 for a hole.
+    site_energies: ndarray
+        Energies of the sites (eV), e.g., Gaussian disorder; default = 0.
+
+    Returns
+    --------
+    network: dict
+        "indptr" (row of each site), "targets", "vectors" (Å), and "cumulative" (cumulative rates, all the rows end to end)
+        of the hops; "offsets" (cumulative rate before the row of each site) and "total" (total out-going rate of each site).
+    """
+    n_sites = len(COMs)
+    sources = np.concatenate([sites_i, sites_j])
+    targets = np.concatenate([sites_j, sites_i])
+    vectors = srcfunctions.minimum_image(COMs[targets] - COMs[sources], box)
+    delta_G = -charge * field * vectors[:, 0]
+    if site_energies is not None:
+        delta_G = delta_G + site_energies[targets] - site_energies[sources]
+    rates = marcus_rates(np.concatenate([couplings, couplings]), reorganization_energy, temperature, delta_G)
+
+    order = np.lexsort((targets, sources)) # CSR order: by source site
+    indptr = np.searchsorted(sources[order], np.arange(n_sites + 1))
+    cumulative = np.cumsum(rates[order])
+    offsets = np.concatenate([[0.], cumulative])[indptr[:-1]]
+    return {"indptr"    : indptr,
+            "targets"   : targets[order],
+            "vectors"   : vectors[order],
+            "cumulative": cumulative,
+            "offsets"   : offsets,
+            "total"     : np.bincount(sources, weights=rates, minlength=n_sites)}
+
+
+def run_walkers(network, n_walkers, sample_times, rng):
+    """
+    Moves `n_walkers` independent walkers on the `network` (see `build_hopping_network`) up to the last of the `sample_times` (s).
+
+    Each step, every walker still running draws its waiting time (exponential, with the total out-going rate of its site)
+    and its hop (binary search of the cumulative rates); positions are sampled at the `sample_times` (those before the hop
+    crossing each time). The walkers start on random sites with at least one hop.
+
+    Returns
+    --------
+    displacements: ndarray
+        Displacements (Å) of the walkers at the `sample_times`, (n_walkers, n_samples, 3).
+    n_hops: int
+        Total number of hops.
+    """
+    starts = np.flatnonzero(network["total"] > 0)
+    sites = rng.choice(starts, size=n_walkers)
+    clocks = np.zeros(n_walkers)
+    positions = np.zeros((n_walkers, 3))
+    displacements = np.zeros((n_walkers, len(sample_times), 3))
+    next_sample = np.zeros(n_walkers, dtype=np.int64)
+    running = np.arange(n_walkers)
+    last_row = network["indptr"][1:] - 1
+    n_hops = 0
+    while len(running):
+        site = sites[running]
+        total = network["total"][site]
+        new_clocks = clocks[running] - np.log(1. - rng.random(len(running))) / total
+        # Record the positions at the sample times crossed by this hop (before the hop)
+        while True:
+            crossed = new_clocks > sample_times[next_sample[running]]
+            if not crossed.any():
+                break
+            walkers = running[crossed]
+            displacements[walkers, next_sample[walkers]] = positions[walkers]
+            next_sample[walkers] += 1
+            done = next_sample[running] == len(sample_times)
+            if done.any():
+                running, site, total, new_clocks = running[~done], site[~done], total[~done], new_clocks[~done]
+        if not len(running):
+            break
+        # Hop: binary search of offset + u * total in the cumulative rates (clamped to the row, against round-off)
+        hops = np.searchsorted(network["cumulative"], network["offsets"][site] + rng.random(len(running)) * total, side='right')
+        hops = np.minimum(hops, last_row[site])
+        positions[running] += network["vectors"][hops]
+        sites[running] = network["targets"][hops]
+        clocks[running] = new_clocks
+        n_hops += len(running)
+    return displacements, n_hops
+
+
+def diffusion_coefficient(sample_times, msd, n_dims=3):
+    """
+    Diffusion coefficient (Å^2/s) from the mean square displacements (Å^2; the drift, if any, removed) at the `sample_times` (s):
+    MSD = 2 d D t fitted through the origin.
+    """
+    return np.sum(msd * sample_times) / (2. * n_dims * np.sum(sample_times**2))
+
+
+def einstein_mobility(D, temperature):
+    """
+    Mobility (cm^2 V^-1 s^-1) from the diffusion coefficient (Å^2/s): mu = e D / (kB T).
+    """
+    return D * A2_TO_CM2 / (K_B * temperature)
+
+
+def init_worker(config):
+    """
+    Initializes a worker process with the hopping networks (and sample times) of all the frames.
+    """
+    _WORKER["networks"]     = config["networks"]
+    _WORKER["sample_times"] = config["sample_times"]
+
+
+def kmc_task(task):
+    """
+    Runs one block of walkers on the network of one frame (in the worker process).
+
+    Parameters
+    ----------
+    task: tuple
+        (frame, n_walkers, seed), `seed` being a `numpy.random.SeedSequence` (independent streams for all the tasks).
+
+    Returns
+    --------
+    result: dict
+        frame, n_walkers, n_hops, "sum" and "sum_sq" of the displacements (Å) over the walkers at the sample times.
+    """
+    frame, n_walkers, seed = task
+    displacements, n_hops = run_walkers(_WORKER["networks"][frame], n_walkers, _WORKER["sample_times"][frame], np.random.default_rng(seed))
+    return {"frame"    : frame,
+            "n_walkers": n_walkers,
+            "n_hops"   : n_hops,
+            "sum"      : displacements.sum(axis=0),
+            "sum_sq"   : (displacements**2).sum(axis=0)}
+
+
+def run_kmc(config, tasks, n_workers=1):
+    """
+    Runs the KMC `tasks` (see `kmc_task`), by `n_workers` worker processes (serially, in this process, if `n_workers` = 1),
+    and gathers the displacement statistics of each frame.
+
+    Returns
+    --------
+    frames: dict
+        Per frame: n_walkers, n_hops, mean displacement and mean square deviation (Å, Å^2) at the sample times, (n_samples, 3).
+    """
+    if n_workers > 1:
+        import multiprocessing
+        with multiprocessing.get_context("spawn").Pool(n_workers, initializer=init_worker, initargs=(config,)) as pool:
+            results = pool.map(kmc_task, tasks)
+    else:
+        init_worker(config)
+        results = [kmc_task(task) for task in tasks]
+
+    frames = {}
+    for result in results:
+        frame = frames.setdefault(result["frame"], {"n_walkers": 0, "n_hops": 0, "sum": 0., "sum_sq": 0.})
+        for key in ["n_walkers", "n_hops", "sum", "sum_sq"]:
+            frame[key] = frame[key] + result[key]
+    for frame in frames.values():
+        frame["mean"] = frame.pop("sum") / frame["n_walkers"]
+        frame["variance"] = frame.pop("sum_sq") / frame["n_walkers"] - frame["mean"]**2
+    return frames
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+TensorFlow-free inference engine for the trained overlap NNs (plain stacks of dense layers).
+
+The Keras model (Dense --> BatchNormalization --> Activation blocks) and the *fitted* `X_scaler`/`Y_scaler`
+are exported once (see `export_model` and `export_model_to_numpy.py`) to a compact `.npz` file in which:
+- each BatchNormalization (inference mode) is folded into the Dense layer preceding it;
+- the `X_scaler` is folded into the first Dense layer, the inverse of the `Y_scaler` into the last one.
+The exported network thus maps *raw* feature vectors to (log) overlaps with NumPy only.
+"""
+
+import os, sys
+import numpy as np
+
+
+NUMPY_WEIGHTS_FILE = 'numpy_weights.npz' # default name of the exported weights (inside the model folder)
+
+ACTIVATIONS = {
+    'linear'    : lambda x: x,
+    'relu'      : lambda x: np.maximum(x, 0.),
+    'tanh'      : np.tanh,
+    'sigmoid'   : lambda x: 1. / (1. + np.exp(-x)),
+    'softplus'  : lambda x: np.logaddexp(0., x),
+    'elu'       : lambda x: np.where(x > 0., x, np.expm1(np.minimum(x, 0.))),
+    'selu'      : lambda x: 1.0507009873554805 * np.where(x > 0., x, 1.6732632423543772 * np.expm1(np.minimum(x, 0.))),
+    'swish'     : lambda x: x / (1. + np.exp(-x)),
+    'leaky_relu': lambda x: np.where(x > 0., x, 0.2 * x),
+}
+
+
+class NumpyMLP:
+    """
+    Dense network evaluated in NumPy, loaded from a file written by `export_model`.
+
+    Mimics the bits of the Keras API used by the predictor (`predict` and `summary`); since the scalers
+    are folded into the weights, the inputs are the *raw* features and the outputs the *unscaled* targets.
+    """
+
+    def __init__(self, weights_file, dtype=np.float32):
+        data = np.load(weights_file)
+        n_layers = int(data['n_layers'])
+        self.weights     = [data[f'W_{k}'].astype(dtype) for k in range(n_layers)]
+        self.biases      = [data[f'b_{k}'].astype(dtype) for k in range(n_layers)]
+        self.activations = [str(activation) for activation in data['activations']]
+        self.weights_file = weights_file
+        self.dtype = dtype
+        for activation in self.activations:
+            if activation not in ACTIVATIONS:
+                sys.exit(f"ERROR! Activation '{activation}' not available in the NumPy engine. Exiting...")
+
+    def predict(self, x, batch_size=None, verbose=0):
+        """
+        Forward pass; `batch_size` and `verbose` are accepted (and ignored) for compatibility with `keras.Model.predict`.
+        """
+        x = np.asarray(x, dtype=self.dtype)
+        for W, b, activation in zip(self.weights, self.biases, self.activations):
+            x = ACTIVATIONS[activation](x @ W + b)
+        return x
+
+    def summary(self):
+        print(f'NumpyMLP (from {self.weights_file}; scalers folded into the first/last layers)')
+        for k, (W, activation) in enumerate(zip(self.weights, self.activations)):
+            print(f'  dense_{k}: {W.shape[0]:5d} --> {W.shape[1]:5d} ({activation})')
+        print(f'  Total params: {sum(W.size + b.size for W, b in zip(self.weights, self.biases))}')
+
+
+def affine_of_scaler(scaler, n_features, inverse=False):
+    """
+    Returns (slope, offset) such that `scaler.transform(x) = x*slope + offset` (or `inverse_transform` if `inverse`).
+    Works for any feature-wise affine scaler (e.g., `StandardScaler`, `MinMaxScaler`).
+    """
+    transform = scaler.inverse_transform if inverse else scaler.transform
+    offset = transform(np.zeros((1, n_features)))[0]
+    slope  = transform(np.ones((1, n_features)))[0] - offset
+    return slope, offset
+
+
+def export_model(model, X_scaler, Y_scaler, output_file, VERBOSE=False):
+    """
+    Exports a Keras stack of Dense/BatchNormalization/Activation(/Dropout) layers plus the fitted scalers to `output_file` (.npz).
+
+    Parameters
+    ----------
+    model: keras.Model
+        Trained NN.
+    X_scaler: sklearn scaler
+        *Fitted* scaler of the features (folded into the first Dense layer).
+    Y_scaler: sklearn scaler
+        *Fitted* scaler of the targets (its inverse is folded into the last Dense layer).
+    output_file: string
+        Name of the `.npz` file to be written.
+    VERBOSE: bool
+        If True, prints more information.
+    """
+    weights, biases, activations = [], [], []
+
+    for layer in model.layers:
+        kind = layer.__class__.__name__
+        if kind == 'Dense':
+            W, b = layer.get_weights() if layer.use_bias else (layer.get_weights()[0], None)
+            weights.append(np.asarray(W, dtype=np.float64))
+            biases.append(np.zeros(W.shape[1]) if b is None else np.asarray(b, dtype=np.float64))
+            activations.append(layer.get_config()['activation'])
+        elif kind == 'BatchNormalization':
+            if not weights or activations[-1] != 'linear':
+                sys.exit(f"ERROR! Layer '{layer.name}' does not follow a linear Dense layer; cannot fold it. Exiting...")
+            # Inference mode: gamma*(x - moving_mean)/sqrt(moving_variance + epsilon) + beta
+            gamma = np.ones(weights[-1].shape[1]) if layer.gamma is None else np.asarray(layer.gamma.numpy(), dtype=np.float64)
+            beta  = np.zeros(weights[-1].shape[1]) if layer.beta is None else np.asarray(layer.beta.numpy(), dtype=np.float64)
+            scale = gamma / np.sqrt(np.asarray(layer.moving_variance.numpy(), dtype=np.float64) + layer.epsilon)
+            weights[-1] = weights[-1] * scale[None, :]
+            biases[-1]  = (biases[-1] - np.asarray(layer.moving_mean.numpy(), dtype=np.float64)) * scale + beta
+        elif kind == 'Activation':
+            if not weights or activations[-1] != 'linear':
+                sys.exit(f"ERROR! Layer '{layer.name}' does not follow a linear Dense/BatchNormalization block. Exiting...")
+            activations[-1] = layer.get_config()['activation']
+        elif kind in ['Dropout', 'InputLayer']:
+            continue # no-ops at inference
+        else:
+            sys.exit(f"ERROR! Layer '{layer.name}' of type {kind} is not supported by the NumPy engine. Exiting...")
+
+    # Fold the scalers: x_scaled = x*x_slope + x_offset; y = y_scaled*y_slope + y_offset
+    x_slope, x_offset = affine_of_scaler(X_scaler, weights[0].shape[0])
+    y_slope, y_offset = affine_of_scaler(Y_scaler, weights[-1].shape[1], inverse=True)
+    biases[0]   = biases[0] + x_offset @ weights[0]
+    weights[0]  = weights[0] * x_slope[:, None]
+    if activations[-1] != 'linear':
+        sys.exit("ERROR! The last layer must be linear to fold the `Y_scaler` into it. Exiting...")
+    weights[-1] = weights[-1] * y_slope[None, :]
+    biases[-1]  = biases[-1] * y_slope + y_offset
+
+    arrays = {f'W_{k}': W for k, W in enumerate(weights)}
+    arrays.update({f'b_{k}': b for k, b in enumerate(biases)})
+    np.savez(output_file, n_layers=len(weights), activations=np.array(activations), **arrays)
+
+    if VERBOSE:
+        print(f"- INFO - {len(weights)} dense layers ({', '.join(activations)}) exported to {output_file}.")
+
+
+def load_numpy_model(model_path):
+    """
+    Loads the exported weights from `model_path` (either the `.npz` file or the model folder containing `NUMPY_WEIGHTS_FILE`).
+    """
+    if os.path.isdir(model_path):
+        model_path = os.path.join(model_path, NUMPY_WEIGHTS_FILE)
+    if not os.path.exists(model_path):
+        sys.exit(f"ERROR! {model_path} not found; export the model with `export_model_to_numpy.py` first. Exiting...")
+    return NumpyMLP(model_path)
+
+
+def compare_with_keras(numpy_model, model, X_scaler, Y_scaler, features):
+    """
+    Returns the predictions of the Keras model (+ scalers) and of the NumPy engine for the same `features`, (n,) each.
+    """
+    y_keras = Y_scaler.inverse_transform( model.predict(X_scaler.transform(features), batch_size=len(features), verbose=0) )[:,0]
+    y_numpy = numpy_model.predict(features)[:,0]
+    return y_keras, y_numpy
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Binary, columnar storage of the pair records (pair_index, COM-COM distance, resids, time, predicted log overlap).
+
+The records are stored as a 1D structured array in a plain `.npy` file, so that the converters and plotting
+scripts can memory-map it (`load_pair_records`) instead of re-parsing the text outputs. The file is written
+in bulk, one block of records (e.g., one frame) at a time, by `PairRecordWriter`; records kept in memory (e.g., for the
+text outputs) are accumulated in a `PairBuffer`.
+"""
+
+import os
+import csv
+import numpy as np
+
+
+# One record per pair
+PAIR_DTYPE = np.dtype([('pair_index' , '<i4'),  # pair_index (starts from 1)
+                       ('distance'   , '<f4'),  # COM-COM distance (ang)
+                       ('resid_i'    , '<i4'),  # resid of MONOMER i
+                       ('resid_j'    , '<i4'),  # resid of MONOMER j
+                       ('time'       , '<f4'),  # timestamp (ps)
+                       ('log_overlap', '<f4')]) # predicted log10 orbital overlap
+
+# Same records, after conversion to electronic couplings (see `log10overlap_to_ECeV.py`)
+COUPLING_DTYPE = np.dtype(PAIR_DTYPE.descr + [('log_coupling', '<f4'),  # log10 of the electronic coupling (log10 eV)
+                                              ('coupling'    , '<f4')]) # electronic coupling (eV)
+
+# Extra fields of the records predicted by an ensemble of NNs (the 'log_overlap' is then the mean over the models)
+ENSEMBLE_FIELDS = [('log_overlap_std', '<f4')] # standard deviation over the models
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00' # .npy format, version 1.0
+
+
+def _npy_header(dtype, shape, header_length=None):
+    """
+    Returns the .npy header (magic + length + dict) of an array of `shape`, padded with spaces to
+    `header_length` bytes (default: the smallest multiple of 64 bytes that fits any number of records).
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(dtype), tuple(shape))
+    if header_length is None:
+        header_length = 64 * ((len(NPY_MAGIC) + 2 + len(header) + 20 + 1 + 63) // 64) # 20 digits for the shape
+    dict_length = header_length - len(NPY_MAGIC) - 2
+    return NPY_MAGIC + np.uint16(dict_length).tobytes() + (header.ljust(dict_length - 1) + '\n').encode('latin1')
+
+
+class PairRecordWriter:
+    """
+    Writes blocks of records to a `.npy` file as they come; the shape in the header is updated after every block,
+    so the file is always a valid (memory-mappable) `.npy` file. Records can also be rows of fixed shape `row_shape`
+    (e.g., feature vectors: `PairRecordWriter('features.npy', np.float32, (144,))`).
+
+    Usage:
+        with PairRecordWriter('pairs_predicted_cutoff09A.npy') as writer:
+            for frame ...:
+                writer.append(records)
+    """
+
+    def __init__(self, filename, dtype=PAIR_DTYPE, row_shape=()):
+        self.filename  = filename
+        self.dtype     = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.n_records = 0
+        self.header_length = len(_npy_header(self.dtype, (0,) + self.row_shape)) # fixed, so that the shape can be updated in place
+        self.file = open(filename, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        self.file.seek(0)
+        self.file.write(_npy_header(self.dtype, (self.n_records,) + self.row_shape, self.header_length))
+        self.file.seek(0, os.SEEK_END)
+
+    def append(self, records):
+        """
+        Appends a block of records (structured array with the writer's dtype, or array of shape (n,) + `row_shape`).
+        """
+        records = np.ascontiguousarray(records, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        self.file.write(records.tobytes())
+        self.n_records += len(records)
+        self._write_header()
+
+    def close(self):
+        if not self.file.closed:
+            self._write_header()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PairBuffer:
+    """
+    Preallocated, growable buffer of records (structured array with `dtype`), e.g., all the pairs of a trajectory kept in
+    memory for the text outputs: blocks of records are copied in, and the capacity is doubled whenever it is exceeded
+    (amortized O(1) per record, 24 bytes per `PAIR_DTYPE` record instead of Python lists of strings and floats).
+
+    Usage:
+        buffer = PairBuffer(records_dtype)
+        for frame ...:
+            buffer.append(records)
+        writer.append(buffer.records) # no conversion: `records` is a view of the filled part
+    """
+
+    def __init__(self, dtype=PAIR_DTYPE, capacity=1024):
+        self._data = np.empty(max(int(capacity), 1), dtype=dtype)
+        self.n_records = 0
+
+    def append(self, records):
+        """
+        Copies a block of records (structured array with the buffer's dtype) at the end of the buffer.
+        """
+        n_new = self.n_records + len(records)
+        if n_new > len(self._data):
+            data = np.empty(max(n_new, 2 * len(self._data)), dtype=self._data.dtype)
+            data[:self.n_records] = self._data[:self.n_records]
+            self._data = data
+        self._data[self.n_records:n_new] = records
+        self.n_records = n_new
+
+    @property
+    def records(self):
+        return self._data[:self.n_records]
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def __len__(self):
+        return self.n_records
+
+
+def make_pair_dtype(n_models=1, per_model_columns=False):
+    """
+    Dtype of the records predicted by `n_models` NNs: `PAIR_DTYPE` for a single model; otherwise, plus the std over
+    the models and (if `per_model_columns`) the predictions of each model ('log_overlap_models', (n_models,) per pair).
+    """
+    if n_models == 1:
+        return PAIR_DTYPE
+    fields = PAIR_DTYPE.descr + ENSEMBLE_FIELDS
+    if per_model_columns:
+        fields.append(('log_overlap_models', '<f4', (n_models,)))
+    return np.dtype(fields)
+
+
+def make_pair_records(pair_indices, distances, resids_i, resids_j, time, log_overlaps, log_overlap_stds=None, log_overlap_models=None, dtype=PAIR_DTYPE):
+    """
+    Packs the per-pair arrays of a frame (or any block of pairs) into a structured array with `dtype` (see `make_pair_dtype`).
+    """
+    records = np.empty(len(pair_indices), dtype=dtype)
+    records['pair_index']  = pair_indices
+    records['distance']    = distances
+    records['resid_i']     = resids_i
+    records['resid_j']     = resids_j
+    records['time']        = time
+    records['log_overlap'] = log_overlaps
+    if 'log_overlap_std' in records.dtype.names:
+        records['log_overlap_std'] = log_overlap_stds
+    if 'log_overlap_models' in records.dtype.names:
+        records['log_overlap_models'] = log_overlap_models
+    return records
+
+
+def load_pair_records(filename, mmap=True):
+    """
+    Loads (memory-maps, by default) a `.npy` file of records written by `PairRecordWriter`.
+    """
+    return np.load(filename, mmap_mode='r' if mmap else None)
+
+
+def format_IDs(pair_indices):
+    """
+    Zero-padded IDs as used in the text (CSV) outputs, e.g., 42 --> '000042'.
+    """
+    return np.char.zfill(np.asarray(pair_indices).astype(str), 6)
+
+
+def write_predictions_csv(filename, records, chunk_size=1000000):
+    """
+    Writes the predicted log overlaps of the `records` as the text (CSV) output of the predictor: "ID,log_overlap" per pair
+    (plus the std and, if present, the prediction of each model for an ensemble of NNs). The zero-padded IDs are only
+    generated here, one chunk of `chunk_size` records at a time.
+    """
+    columns = ['log_overlap'] + [name for name in ['log_overlap_std'] if name in records.dtype.names]
+    with open(filename, 'w') as f:
+        writer = csv.writer(f)
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start+chunk_size]
+            values = [chunk[column] for column in columns]
+            if 'log_overlap_models' in records.dtype.names:
+                writer.writerows([ID, *row, *models] for ID, *row, models in zip(format_IDs(chunk['pair_index']), *values, chunk['log_overlap_models']))
+            else:
+                writer.writerows(zip(format_IDs(chunk['pair_index']), *values))
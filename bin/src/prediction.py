@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Per-frame pipeline for the prediction of orbital overlaps of *pairs* of monomers
+(COMs --> neighbour search --> alignment --> featurization --> NN inference).
+
+It is shared by `predict_overlaps--pairs.py` and by the worker processes it spawns when
+a trajectory is split in blocks of frames (see `init_worker` and `predict_frame_block`).
+"""
+
+import os, sys
+import time
+import numpy as np
+import MDAnalysis as mda
+import src.functions as srcfunctions
+import src.unwrap as srcunwrap
+from src.timing import TIMER, peak_rss_MB
+
+
+# State of a worker process (Universe, system tables and trained NN are loaded *once* per worker)
+_WORKER = {}
+
+# Per-pair arrays of a frame result (stored in the checkpoints)
+PER_PAIR_KEYS = ["distances", "resids_i", "resids_j", "predictions", "predictions_std", "predictions_models", "features"]
+
+
+def load_trained_model(model_path, backend="keras"):
+    """
+    Loads the trained NN and the *fitted* `X_scaler` and `Y_scaler` stored in `model_path`.
+
+    With `backend="numpy"`, the weights exported by `export_model_to_numpy.py` are loaded instead (no TensorFlow);
+    the scalers are then folded into the weights and None is returned for both of them.
+    """
+    if backend == "numpy":
+        import src.numpy_mlp as srcnumpymlp
+        return srcnumpymlp.load_numpy_model(model_path), None, None
+    elif backend != "keras":
+        sys.exit(f"ERROR! Unknown backend '{backend}'; either 'keras' or 'numpy'. Exiting...")
+
+    from tensorflow import keras
+    import joblib
+
+    model    = keras.models.load_model( model_path )
+    X_scaler = joblib.load( os.path.join(model_path, 'X_scaler.joblib') )
+    Y_scaler = joblib.load( os.path.join(model_path, 'Y_scaler.joblib') )
+    return model, X_scaler, Y_scaler
+
+
+def load_trained_models(model_paths, backend="keras"):
+    """
+    Loads an ensemble of trained NNs (e.g., the k-fold cross-validated models) --> list of (model, X_scaler, Y_scaler).
+    """
+    return [load_trained_model(model_path, backend) for model_path in model_paths]
+
+
+def predict_with_models(trained_models, features, batch_size=4096):
+    """
+    Pushes the same feature vectors through each of the `trained_models` --> (n_pairs, n_models) predicted (log) overlaps.
+    """
+    return np.stack([srcfunctions.predict_overlaps_in_batches(model, X_scaler, Y_scaler, features, batch_size)
+                     for model, X_scaler, Y_scaler in trained_models], axis=1)
+
+
+def ensemble_statistics(predictions):
+    """
+    Per-pair mean ("predictions") and standard deviation ("predictions_std") over the models of the (n_pairs, n_models)
+    `predictions`, which are also returned ("predictions_models"); with a single model, the std is zero.
+    """
+    return {"predictions"       : predictions.mean(axis=1) if predictions.shape[1] > 1 else predictions[:,0],
+            "predictions_std"   : predictions.std(axis=1),
+            "predictions_models": predictions}
+
+
+def load_universe(tpr_file, coord_file, traj_file=None):
+    """
+    Loads the morphology; if `traj_file` (XTC/TRR) is given, the frames are read from it instead of from `coord_file` (GRO).
+    """
+    if traj_file:
+        return mda.Universe(tpr_file, traj_file)
+    return mda.Universe(tpr_file, coord_file)
+
+
+def setup_system(universe, resname, group_selection, pdb_to_align_n, pdb_to_align_r, feature="distmat", VERBOSE=False):
+    """
+    Resolves, once, everything the per-frame pipeline needs from the topology.
+
+    Parameters
+    ----------
+    universe: MDAnalysis.Universe
+        The morphology.
+    resname: string
+        Name of the residue to be analyzed (e.g., "PMAP").
+    group_selection: string
+        Selection string of the group used for COMs and alignment (e.g., `mappings["AA"]`).
+    pdb_to_align_n: string
+        Path of the PDB file of the QC-optimized *neutral* conformation.
+    pdb_to_align_r: string
+        Path of the PDB file of the QC-optimized *radical_anion* conformation.
+    feature: string
+        Featurization of the pairs: reciprocal distance matrices ("distmat") or Coulomb Matrices ("coulmat").
+    VERBOSE: bool
+        If True, prints more information.
+
+    Returns
+    --------
+    system: dict
+        MONOMER resids, GROUP index/mass tables, positions of the QC-optimized conformations,
+        indices of the atoms kept in the features (heavy atoms only for PMAP/PEPP/PVBP),
+        and charges of the GROUP atoms (Coulomb Matrices only; loaded once).
+    """
+    MONOMERs = universe.select_atoms(f"resname {resname}")
+    GROUP_indices, GROUP_masses = srcfunctions.build_group_index_table(MONOMERs.residues, group_selection, VERBOSE)
+
+    PDBtoALIGNn = mda.Universe( pdb_to_align_n ).select_atoms(f'{group_selection}')
+    PDBtoALIGNr = mda.Universe( pdb_to_align_r ).select_atoms(f'{group_selection}')
+
+    # AD-HOC FIX for PMAP/PEPP/PVBP: reduce the distance matrices from 16x16 to 12x12 (i.e., disregard the hydrogens)
+    if resname in ["PMAP","PEPP","PVBP"]:
+        FEATURE_atoms = np.flatnonzero(PDBtoALIGNn.elements != 'H')
+    else:
+        FEATURE_atoms = None
+
+    return {"MONOMER_resids"       : MONOMERs.residues.resids,
+            "GROUP_indices"        : GROUP_indices,
+            "GROUP_masses"         : GROUP_masses,
+            "PDBtoALIGNn_positions": PDBtoALIGNn.positions,
+            "PDBtoALIGNr_positions": PDBtoALIGNr.positions,
+            "FEATURE_atoms"        : FEATURE_atoms,
+            "FEATURE_charges"      : srcfunctions.load_charges("AA") if feature == "coulmat" else None}
+
+
+def predict_frame(universe, system, trained_models, cutoff, batch_size=4096, n_max=None, return_features=False, VERBOSE=False):
+    """
+    Finds the pairs of MONOMERs within the `cutoff` in the current frame and predicts their (log) orbital overlaps.
+
+    Parameters
+    ----------
+    universe: MDAnalysis.Universe
+        The morphology (positioned at the frame to be analyzed; chains already whole).
+    system: dict
+        Output of `setup_system`.
+    trained_models: list
+        (model, X_scaler, Y_scaler) of each trained NN, see `load_trained_models`.
+    cutoff: float
+        COM-COM cutoff for the pair selection.
+    batch_size: int
+        Number of pairs featurized and pushed through the NN at once.
+    n_max: int
+        If given, only the pairs of the first `n_max` MONOMERs are considered (test runs).
+    return_features: bool
+        If True, the feature vectors of the pairs are returned as well (e.g., to be stored in the feature cache).
+    VERBOSE: bool
+        If True, prints more information.
+
+    Returns
+    --------
+    frame_result: dict
+        frame, time, and per-pair arrays (sorted as the upper triangle of the COM-COM distance matrix):
+        COM-COM distance, resid_i, resid_j, and predicted (log) overlap (mean, std, and values of the models,
+        see `ensemble_statistics`) (+ "features", if `return_features`).
+    """
+
+    # Get the coordinates for the reference atoms and store them into an array with dimensions (COM_MONOMERs, 3)
+    with TIMER.stage("com"):
+        positions = universe.atoms.positions
+        GROUP_positions = positions[system["GROUP_indices"]] # atoms of N-methyl-phthalimide, (n_monomers, n_atoms, 3) --> used for the alignment
+        COM_MONOMER = srcfunctions.compute_group_COMs(positions, system["GROUP_indices"], system["GROUP_masses"]).astype('float32')
+
+    # Neighbour search between the COMs of the MONOMERs --> (i, j, COM-COM distance) of the pairs within the cutoff
+    with TIMER.stage("neighbour_search"):
+        PAIRS_i, PAIRS_j, PAIRS_dist = srcfunctions.find_pairs_within_cutoff(COM_MONOMER, cutoff, universe.dimensions)
+        if n_max is not None:
+            keep = PAIRS_i < n_max
+            PAIRS_i, PAIRS_j, PAIRS_dist = PAIRS_i[keep], PAIRS_j[keep], PAIRS_dist[keep]
+
+    # Align the QC-optimized neutral/radical_anion conformations onto every MONOMER *once* per frame (alignment cache)
+    with TIMER.stage("alignment"):
+        ALIGNED_n, _, _ = srcfunctions.batch_align_MONOMERS(GROUP_positions, system["GROUP_masses"], system["PDBtoALIGNn_positions"], "neutral"      , VERBOSE)
+        ALIGNED_r, _, _ = srcfunctions.batch_align_MONOMERS(GROUP_positions, system["GROUP_masses"], system["PDBtoALIGNr_positions"], "radical_anion", VERBOSE)
+
+    # Featurize and predict the pairs in chunks of `batch_size` (same order as the pairs)
+    predictions, all_features = [], []
+    for start in range(0, len(PAIRS_dist), batch_size):
+        chunk = slice(start, start+batch_size)
+        # Retrieve the (flattened) reciprocal distance matrices or Coulomb Matrices (from the aligned coordinates: i --> neutral, j --> radical_anion)
+        with TIMER.stage("featurization"):
+            if system["FEATURE_charges"] is not None:
+                features = srcfunctions.batch_compute_coulmats(ALIGNED_n, ALIGNED_r, PAIRS_i[chunk], PAIRS_j[chunk],
+                                                               universe.dimensions, system["FEATURE_charges"], system["FEATURE_atoms"])
+            else:
+                features = srcfunctions.batch_compute_recip_distmats(ALIGNED_n, ALIGNED_r, PAIRS_i[chunk], PAIRS_j[chunk],
+                                                                     universe.dimensions, system["FEATURE_atoms"]) # --> (n_pairs, 144) for 12x12 matrices
+        # Use loaded model(s) to make predictions for all the pairs of the chunk at once (features computed once for all the models)
+        predictions.append(predict_with_models(trained_models, features, batch_size))
+        if return_features:
+            all_features.append(features)
+
+    frame_result = {"frame"      : universe.trajectory.ts.frame,
+                    "time"       : universe.trajectory.time,
+                    "distances"  : PAIRS_dist,
+                    "resids_i"   : system["MONOMER_resids"][PAIRS_i],
+                    "resids_j"   : system["MONOMER_resids"][PAIRS_j]}
+    frame_result.update(ensemble_statistics(np.concatenate(predictions) if predictions else np.zeros((0, len(trained_models)), dtype=np.float32)))
+    if return_features:
+        n_features = len(system["FEATURE_atoms"])**2 if system["FEATURE_atoms"] is not None else system["GROUP_indices"].shape[1]**2
+        frame_result["features"] = np.concatenate(all_features) if all_features else np.zeros((0, n_features), dtype=np.float32)
+    return frame_result
+
+
+def predict_cached_frame(entry, frame_index, trained_models, batch_size=4096):
+    """
+    Same as `predict_frame`, but for a frame whose pairs and feature vectors are read from the feature cache
+    (`entry`, see `src/feature_cache.py`): straight to the inference.
+    """
+    with TIMER.stage("feature_cache_read"):
+        frame_result = entry.frame(frame_index)
+    frame_result.update(ensemble_statistics(predict_with_models(trained_models, frame_result.pop("features"), batch_size)))
+    return frame_result
+
+
+def make_frame_blocks(n_frames, every_nth_frame=1, frames_per_block=10):
+    """
+    Splits the frames to be analyzed (0, every_nth_frame, 2*every_nth_frame, ...) in blocks of `frames_per_block` frames.
+    """
+    frames = np.arange(0, n_frames, every_nth_frame)
+    return [frames[start:start+frames_per_block].tolist() for start in range(0, len(frames), frames_per_block)]
+
+
+def init_worker(config, universe=None):
+    """
+    Initializes a worker process: opens its own Universe, resolves the system tables and loads the trained NN *once*.
+
+    Parameters
+    ----------
+    config: dict
+        tpr_file, coord_file, traj_file, resname, group_selection, pdb_to_align_n, pdb_to_align_r, feature,
+        model_paths, backend, cutoff, batch_size, n_max, make_whole, return_features, feature_cache_entry, and verbose.
+        If `feature_cache_entry` is given, the pairs and their features are read from that entry of the feature cache
+        (no Universe is needed).
+    universe: MDAnalysis.Universe
+        Already loaded morphology (serial runs); if None, the Universe is loaded from the files in `config`.
+    """
+    with TIMER.stage("model_load"):
+        _WORKER["models"] = load_trained_models(config["model_paths"], config["backend"])
+    _WORKER["config"] = config
+    if config["feature_cache_entry"]:
+        import src.feature_cache as srcfeaturecache
+        _WORKER["cache_entry"] = srcfeaturecache.FeatureCacheEntry(config["feature_cache_entry"])
+        return
+
+    if universe is None:
+        mda.stop_logging() # stop MDAnalysis from filling the logging file
+        with TIMER.stage("universe_load"):
+            universe = load_universe(config["tpr_file"], config["coord_file"], config["traj_file"])
+    _WORKER["universe"] = universe
+    _WORKER["system"]   = setup_system(universe, config["resname"], config["group_selection"],
+                                       config["pdb_to_align_n"], config["pdb_to_align_r"], config["feature"], config["verbose"])
+    if config["make_whole"]:
+        # Only the groups need to be whole: unwrapped on the fly, every time a frame is read (bond traversal precomputed once)
+        with TIMER.stage("unwrap_setup"):
+            universe.trajectory.add_transformations(srcunwrap.UnwrapGroups(srcunwrap.build_unwrap_levels(universe, _WORKER["system"]["GROUP_indices"])))
+
+
+def predict_frame_block(frame_indices):
+    """
+    Predicts the (log) overlaps of the pairs of all the frames in `frame_indices` (in the worker process).
+
+    Returns
+    --------
+    frame_results: list
+        One `predict_frame` result per frame, in the order of `frame_indices`, with the "timings" of its stages
+        (see `src/timing.py`; including the set-up of the worker, for its first frame) and the "peak_rss_MB" of the worker.
+    """
+    config = _WORKER["config"]
+    frame_results = []
+    for frame_index in frame_indices:
+        frame_start = time.perf_counter()
+        if "cache_entry" in _WORKER:
+            frame_result = predict_cached_frame(_WORKER["cache_entry"], frame_index, _WORKER["models"], config["batch_size"])
+        else:
+            universe = _WORKER["universe"]
+            with TIMER.stage("frame_read"): # the groups are unwrapped while reading ("make_whole"; see `init_worker`)
+                universe.trajectory[frame_index]
+            if config["verbose"]:
+                print(f'frame = {frame_index}; time = {universe.trajectory.time}')
+            frame_result = predict_frame(universe, _WORKER["system"], _WORKER["models"], config["cutoff"],
+                                         config["batch_size"], config["n_max"], config["return_features"], config["verbose"])
+        frame_result["wall_time_s"] = time.perf_counter() - frame_start
+        frame_result["timings"]     = TIMER.pop()
+        frame_result["peak_rss_MB"] = peak_rss_MB()
+        frame_results.append(frame_result)
+    return frame_results
+
+
+def save_block_checkpoint(filename, frame_results):
+    """
+    Saves the results of a block of frames (see `predict_frame_block`) to `filename` (.npz) *atomically*:
+    the data are written to a temporary file which then replaces `filename`, so a checkpoint is either complete or absent.
+    """
+    arrays = {"frames" : np.array([frame_result["frame"] for frame_result in frame_results], dtype=int),
+              "times"  : np.array([frame_result["time"]  for frame_result in frame_results], dtype=float),
+              "n_pairs": np.array([len(frame_result["distances"]) for frame_result in frame_results], dtype=int)}
+    for key in PER_PAIR_KEYS: # "features" only if present (feature cache)
+        if key in frame_results[0]:
+            arrays[key] = np.concatenate([frame_result[key] for frame_result in frame_results])
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def load_block_checkpoint(filename):
+    """
+    Loads a checkpoint written by `save_block_checkpoint` --> list of frame results (same as `predict_frame_block`).
+    """
+    with np.load(filename) as data:
+        bounds = np.concatenate([[0], np.cumsum(data["n_pairs"])])
+        frame_results = [{"frame": int(frame), "time": float(time)} for frame, time in zip(data["frames"], data["times"])]
+        for key in PER_PAIR_KEYS:
+            if key in data:
+                values = data[key]
+                for frame_result, start, stop in zip(frame_results, bounds[:-1], bounds[1:]):
+                    frame_result[key] = values[start:stop]
+    return frame_results
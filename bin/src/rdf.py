@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Radial distribution functions between the centers of geometry (COGs) of residues, e.g., of the N-methyl-phthalimides.
+
+Same quantities as the `gmx make_ndx` + `gmx rdf -selrpos part_res_cog -seltype part_res_cog` steps of `analyze/RDFs/`:
+for each group (a selection), one position per residue, the COG of the atoms of the residue in the selection (made whole
+across the box boundaries); for each pair of groups, the histogram of the distances between their positions (periodic
+neighbour search up to `r_max`, i.e., pairs only), normalized by the number of reference positions, the density of the
+other group, and the volume of the shells (g(r) --> 1 at large r; self-pairs are excluded if both groups are the same).
+All the pairs of groups are done in one pass over the frames, which can be split among worker processes.
+"""
+
+import numpy as np
+import MDAnalysis as mda
+from MDAnalysis.lib import distances as mda_libdist
+from MDAnalysis.lib.mdamath import box_volume
+import src.functions as srcfunctions
+
+
+RDF_DT  = 250.  # ps, as `analyze/RDFs/PROC_RDFs_step02_compute_RDFs.sbatch`
+RDF_BIN = 0.02  # nm, as `analyze/RDFs/PROC_RDFs_step02_compute_RDFs.sbatch`
+
+_WORKER = {} # per-process state (universe, residue tables, pairs of groups, bins), set by `init_worker`
+
+
+def build_residue_table(atomgroup):
+    """
+    Resolves, once, the atoms of each residue of `atomgroup` (e.g., the N-methyl-phthalimide atoms of every MONOMER).
+
+    Returns
+    --------
+    table: dict
+        "indices" (atom indices sorted by residue), "starts" (first position of each residue in "indices"),
+        "counts" (number of atoms of each residue), "first" (first atom of each residue, repeated for each of its atoms),
+        and "resids".
+    """
+    atomgroup = atomgroup[np.lexsort((atomgroup.indices, atomgroup.resindices))]
+    _, starts, counts = np.unique(atomgroup.resindices, return_index=True, return_counts=True)
+    return {"indices": atomgroup.indices,
+            "starts" : starts,
+            "counts" : counts,
+            "first"  : np.repeat(atomgroup.indices[starts], counts),
+            "resids" : atomgroup.residues.resids}
+
+
+def compute_residue_COGs(positions, table, box=None):
+    """
+    COGs of the residues of a `table` (see `build_residue_table`), each residue being made whole with respect to its first atom.
+    """
+    vectors = srcfunctions.minimum_image(positions[table["indices"]] - positions[table["first"]], box)
+    return positions[table["indices"][table["starts"]]] + np.add.reduceat(vectors, table["starts"], axis=0) / table["counts"][:, None]
+
+
+def frame_histograms(positions, box, tables, pairs, bin_edges):
+    """
+    Histograms of the COG-COG distances (Å) of the `pairs` of groups in one frame.
+
+    Returns
+    --------
+    counts: ndarray
+        Counts (n_pairs_of_groups, n_bins); for a group with itself, each pair is counted twice (once per reference position).
+    densities: ndarray
+        Number of reference positions times the number density (Å^-3) of the other group, (n_pairs_of_groups,).
+    """
+    COGs = {name: compute_residue_COGs(positions, table, box).astype(np.float32) for name, table in tables.items()}
+    volume = box_volume(box)
+    counts    = np.zeros((len(pairs), len(bin_edges)-1))
+    densities = np.zeros(len(pairs))
+    for k, (ref, sel) in enumerate(pairs):
+        if ref == sel:
+            _, distances = mda_libdist.self_capped_distance(COGs[ref], max_cutoff=bin_edges[-1], box=box)
+            counts[k]    = 2 * np.histogram(distances, bins=bin_edges)[0]
+            densities[k] = len(COGs[ref]) * (len(COGs[ref]) - 1) / volume
+        else:
+            _, distances = mda_libdist.capped_distance(COGs[ref], COGs[sel], max_cutoff=bin_edges[-1], box=box)
+            counts[k]    = np.histogram(distances, bins=bin_edges)[0]
+            densities[k] = len(COGs[ref]) * len(COGs[sel]) / volume
+    return counts, densities
+
+
+def select_frames(universe, dt=RDF_DT):
+    """
+    Indices of the frames every `dt` ps (as `gmx rdf -dt`: time - first time is a multiple of `dt`); all the frames if `dt` <= 0.
+    """
+    n_frames = len(universe.trajectory)
+    if dt <= 0 or n_frames == 1:
+        return list(range(n_frames))
+    times = universe.trajectory[0].time + universe.trajectory.dt * np.arange(n_frames)
+    steps = (times - times[0]) / dt
+    return [int(frame) for frame in np.flatnonzero(np.isclose(steps, np.round(steps), rtol=0., atol=1e-3))]
+
+
+def init_worker(config, universe=None):
+    """
+    Initializes a worker process: opens its own Universe and resolves the groups *once*.
+
+    Parameters
+    ----------
+    config: dict
+        topology, coord_file, traj_file, groups (name --> selection string), pairs (list of (ref, sel) group names),
+        and bin_edges (Å).
+    universe: MDAnalysis.Universe
+        Already loaded morphology (serial runs); if None, the Universe is loaded from the files in `config`.
+    """
+    if universe is None:
+        mda.stop_logging()
+        universe = mda.Universe(config["topology"], config["traj_file"] or config["coord_file"])
+    _WORKER["universe"] = universe
+    _WORKER["tables"]   = {name: build_residue_table(universe.select_atoms(selection)) for name, selection in config["groups"].items()}
+    _WORKER["pairs"]    = config["pairs"]
+    _WORKER["bin_edges"] = config["bin_edges"]
+
+
+def rdf_frame_block(frame_indices):
+    """
+    Sums the histograms (see `frame_histograms`) of the frames in `frame_indices` (in the worker process).
+    """
+    universe = _WORKER["universe"]
+    counts    = np.zeros((len(_WORKER["pairs"]), len(_WORKER["bin_edges"])-1))
+    densities = np.zeros(len(_WORKER["pairs"]))
+    for frame_index in frame_indices:
+        universe.trajectory[frame_index]
+        frame_counts, frame_densities = frame_histograms(universe.atoms.positions, universe.dimensions, _WORKER["tables"],
+                                                         _WORKER["pairs"], _WORKER["bin_edges"])
+        counts    += frame_counts
+        densities += frame_densities
+    return counts, densities, len(frame_indices)
+
+
+def compute_rdfs(config, frame_blocks, n_workers=1, universe=None):
+    """
+    Computes the RDFs of all the `config["pairs"]` of groups over the frames of `frame_blocks`, in one pass over the frames
+    (`n_workers` worker processes, each analyzing whole blocks of frames; serially, in this process, if `n_workers` = 1).
+
+    Returns
+    --------
+    r: ndarray
+        Centers of the bins (Å).
+    rdfs: ndarray
+        g(r) of each pair of groups, (n_pairs_of_groups, n_bins).
+    n_frames: int
+        Number of frames analyzed.
+    """
+    if n_workers > 1:
+        import multiprocessing
+        with multiprocessing.get_context("spawn").Pool(n_workers, initializer=init_worker, initargs=(config,)) as pool:
+            block_results = pool.map(rdf_frame_block, frame_blocks)
+    else:
+        init_worker(config, universe)
+        block_results = [rdf_frame_block(frame_block) for frame_block in frame_blocks]
+
+    counts    = sum(block_result[0] for block_result in block_results)
+    densities = sum(block_result[1] for block_result in block_results)
+    bin_edges = config["bin_edges"]
+    shells = 4./3. * np.pi * (bin_edges[1:]**3 - bin_edges[:-1]**3)
+    rdfs = np.zeros_like(counts)
+    np.divide(counts, densities[:, None] * shells[None, :], out=rdfs, where=densities[:, None] > 0)
+    return 0.5 * (bin_edges[1:] + bin_edges[:-1]), rdfs, sum(block_result[2] for block_result in block_results)
+
+
+def write_xvg(filename, r, rdf, legend, title="Radial distribution", comments=()):
+    """
+    Writes an RDF to `filename` in the XVG format of `gmx rdf` (r in nm, g(r)); `r` is in Å.
+    """
+    with open(filename, 'w') as f:
+        for comment in comments:
+            f.write(f"# {comment}\n")
+        f.write(f'@    title "{title}"\n')
+        f.write('@    xaxis  label "r (nm)"\n')
+        f.write('@    yaxis  label "g(r)"\n')
+        f.write('@TYPE xy\n')
+        f.write('@ view 0.15, 0.15, 0.75, 0.85\n')
+        f.write('@ legend on\n')
+        f.write(f'@ s0 legend "{legend}"\n')
+        f.write("".join(f"{x/10.:10.3f} {y:10.3f}\n" for x, y in zip(r, rdf)))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Sweeps of the ML-Vij pipeline over polymer x SoC x percent x replica grids.
+
+The grid (see `lib/sweep_grid_paper.json`) is expanded into a DAG of tasks (external commands):
+- one `gmx grompp` task per TPR, skipped if a TPR generated from the very same inputs (TOP + the files it #includes,
+  GRO, MDP) is found in the TPR cache (cells with the very same inputs share the task; cells already done need none);
+- one `run_MLVij_pipeline.py` task per cell, depending on its TPR.
+The tasks are run concurrently on the local machine (`run_dag`), within a budget of cores; cells whose outputs
+are already there are skipped, so that an interrupted sweep is continued by simply re-running it.
+"""
+
+import os, sys
+import re
+import time
+import hashlib
+import itertools
+import subprocess
+
+
+REPOBASE = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+class Task:
+    """
+    An external command (`command`, run in `cwd` with stdout/stderr to `log_file`) using `cores` cores,
+    which can start once the tasks in `deps` are done; it is already done if all its `outputs` exist.
+    """
+
+    def __init__(self, name, command, cwd, log_file, outputs, cores=1, deps=()):
+        self.name     = name
+        self.command  = command
+        self.cwd      = cwd
+        self.log_file = log_file
+        self.outputs  = outputs
+        self.cores    = cores
+        self.deps     = list(deps)
+        self.status   = "pending" # --> "running" --> "done"/"failed" (or "skipped", if a dependency failed)
+        self.process  = None
+
+    def is_done(self):
+        return all(os.path.exists(output) for output in self.outputs)
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+        log = open(self.log_file, 'w')
+        self.process = subprocess.Popen(self.command, cwd=self.cwd, stdout=log, stderr=subprocess.STDOUT)
+        log.close()
+        self.status = "running"
+
+
+def hash_topology(top_file, hasher=None):
+    """
+    Updates `hasher` (default: a new sha256) with the contents of `top_file` and, recursively, of the files it #includes
+    (relative paths that can be resolved; force-field files from the GROMACS library are identified by name only).
+    """
+    hasher = hasher or hashlib.sha256()
+    with open(top_file, 'rb') as f:
+        contents = f.read()
+    hasher.update(contents)
+    for include in re.findall(rb'^\s*#include\s+"([^"]+)"', contents, flags=re.MULTILINE):
+        include_file = os.path.join(os.path.dirname(top_file), include.decode())
+        if os.path.exists(include_file):
+            hash_topology(include_file, hasher)
+        else:
+            hasher.update(include)
+    return hasher
+
+
+def tpr_cache_key(top_file, gro_file, mdp_file):
+    """
+    Key of the TPR generated by `gmx grompp` from `top_file` (+ includes), `gro_file`, and `mdp_file`.
+    """
+    hasher = hash_topology(top_file)
+    for filename in [gro_file, mdp_file]:
+        with open(filename, 'rb') as f:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+def expand_grid(grid):
+    """
+    Expands the grid (dict) into its cells: one dict of paths and labels (same conventions as `PROC_MLVij_step01_predictions.bash`)
+    per polymer x SoC x percent x replica.
+    """
+    cells = []
+    for polymer, SoC, percent, replica in itertools.product(grid["polymers"], grid["SoCs"], grid["percents"], grid["replicas"]):
+        FOLDER_LABEL  = f'{grid["solvent"]}_{grid["cation"]}{grid["anion"]}_{percent}percent'
+        FOLDERin      = os.path.join(REPOBASE, 'configurations', f'{polymer}{SoC}charge_{FOLDER_LABEL}', f'relax-{grid["N"]}mer-{grid["temp"]}K-{replica}')
+        LABEL         = f'{grid["temp"]}K{replica}{grid["snap"]}'
+        POLYMERfolder = f'{polymer}{SoC}charge_{FOLDER_LABEL}_{grid["N"]}mer_{LABEL}'
+        cells.append({"name"     : POLYMERfolder,
+                      "polymer"  : polymer,
+                      "SoC"      : SoC,
+                      "percent"  : percent,
+                      "replica"  : replica,
+                      "gro_file" : os.path.join(FOLDERin, f'1-relax-{grid["snap"]}-whole.gro'),
+                      "top_file" : os.path.join(FOLDERin, 'system_melt.top'),
+                      "traj_file": os.path.join(FOLDERin, grid["traj"]) if grid.get("traj") else None,
+                      "output_dir": os.path.join(REPOBASE, 'predictions', grid["model_label"], POLYMERfolder,
+                                                 f'pair-predictions-{grid["temp"]}K-{replica}-{grid["snap"]}')})
+    return cells
+
+
+def build_dag(grid, cells, tpr_cache_dir, cores_per_cell=1, force=False):
+    """
+    Returns the tasks of the sweep (TPR generation + pipeline per cell) and the cells skipped because of missing inputs.
+    """
+    mdp_file = os.path.join(REPOBASE, 'MD_settings', grid.get("mdp", "eq_step1_min.mdp"))
+    cutoff   = grid["cutoff"]
+    tasks, missing = [], []
+    tpr_tasks = {} # one task per TPR: cells with the very same inputs share it
+    for cell in cells:
+        if not (os.path.exists(cell["gro_file"]) and os.path.exists(cell["top_file"])):
+            missing.append(cell)
+            continue
+
+        tpr_file = os.path.join(tpr_cache_dir, f'{tpr_cache_key(cell["top_file"], cell["gro_file"], mdp_file)}.tpr')
+        summary_file = os.path.join(cell["output_dir"], f'MLVij_summary_cutoff{cutoff:02d}A.json')
+        # A cell already done (and not forced) does not need its TPR (e.g., after the TPR cache has been cleared)
+        if force or not os.path.exists(summary_file):
+            if tpr_file not in tpr_tasks:
+                tpr_tasks[tpr_file] = Task(f'{cell["name"]}:tpr',
+                                           ['gmx', 'grompp', '-p', cell["top_file"], '-c', cell["gro_file"], '-f', mdp_file, '-o', tpr_file,
+                                            '-po', os.path.join(tpr_cache_dir, f'{cell["name"]}.mdout.mdp')],
+                                           cwd=os.path.dirname(cell["top_file"]), log_file=os.path.join(cell["output_dir"], 'grompp.log'),
+                                           outputs=[tpr_file])
+                tasks.append(tpr_tasks[tpr_file])
+            deps = [tpr_tasks[tpr_file]]
+        else:
+            deps = []
+
+        command = [sys.executable, os.path.join(REPOBASE, 'bin', 'run_MLVij_pipeline.py'),
+                   '-s', tpr_file, '-f', cell["gro_file"], '-t', str(grid["temp"]), '-l', cell["replica"], '-n', grid["snap"],
+                   '-c', str(cutoff), '-r', cell["polymer"], '--map-file', os.path.join(REPOBASE, f'mappings_{cell["polymer"]}.json'),
+                   '--ML-model', *[os.path.join(REPOBASE, model) for model in grid["ML_model"]],
+                   '--backend', grid.get("backend", "keras"), '--trajstep', str(grid.get("trajstep", 1)),
+                   '-j', str(cores_per_cell), '--soc', cell["SoC"], '--percent', cell["percent"], '-o', cell["output_dir"]]
+        if cell["traj_file"]:
+            command += ['-x', cell["traj_file"]]
+        if grid.get("write_intermediate"):
+            command += ['--write-intermediate', 'True']
+        pipeline_task = Task(f'{cell["name"]}:pipeline', command, cwd=REPOBASE,
+                             log_file=os.path.join(cell["output_dir"], 'run_MLVij_pipeline.log'),
+                             outputs=[summary_file], cores=cores_per_cell, deps=deps)
+        if force:
+            pipeline_task.outputs = [] # never considered done
+        tasks.append(pipeline_task)
+    return tasks, missing
+
+
+def run_dag(tasks, core_budget, dry_run=False, poll_interval=0.5, VERBOSE=True):
+    """
+    Runs the `tasks` (respecting their dependencies) on the local machine, using at most `core_budget` cores at a time.
+    Tasks already done are skipped; if a task fails, the tasks depending on it are skipped.
+
+    Returns
+    --------
+    status: dict
+        Task name --> "done", "failed", or "skipped".
+    """
+    for task in tasks:
+        if task.is_done():
+            task.status = "done"
+            if VERBOSE:
+                print(f"- INFO - {task.name}: already done.")
+
+    begin = time.time()
+    while True:
+        # Propagate failures, then start the ready tasks that fit within the budget (in the order of the DAG)
+        for task in tasks:
+            if task.status == "pending" and any(dep.status in ["failed", "skipped"] for dep in task.deps):
+                task.status = "skipped"
+        running = [task for task in tasks if task.status == "running"]
+        free_cores = core_budget - sum(min(task.cores, core_budget) for task in running)
+        for task in tasks:
+            if task.status == "pending" and all(dep.status == "done" for dep in task.deps) and min(task.cores, core_budget) <= free_cores:
+                if dry_run:
+                    print(f"- DRY RUN - {task.name}: {' '.join(task.command)}")
+                    task.status = "done"
+                    continue
+                task.start()
+                free_cores -= min(task.cores, core_budget)
+                running.append(task)
+                if VERBOSE:
+                    print(f"- INFO - {time.time()-begin:8.1f} s: started  {task.name} ({task.cores} cores)")
+
+        if not running and not any(task.status == "pending" and all(dep.status == "done" for dep in task.deps) for task in tasks):
+            break
+        time.sleep(0 if dry_run else poll_interval)
+
+        for task in running:
+            if task.process.poll() is not None:
+                task.status = "done" if task.process.returncode == 0 and task.is_done() else "failed"
+                if VERBOSE:
+                    print(f"- INFO - {time.time()-begin:8.1f} s: {task.status:7s}  {task.name}" + (f" (see {task.log_file})" if task.status == "failed" else ""))
+
+    for task in tasks:
+        if task.status == "pending": # unreachable (e.g., after a failure)
+            task.status = "skipped"
+    return {task.name: task.status for task in tasks}
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Synthetic morphologies (and a synthetic NN) for benchmarking the predictor without the production inputs.
+
+A periodic cubic box is filled with copies of the QC-optimized unit of a polymer (`lib/NMPHTH-{polymer}-opt-neutral-wB97X.pdb`,
+the atom names of which are those used in `mappings_{polymer}.json`), each copy being a residue (and a fragment) of its own,
+randomly oriented on a jittered cubic lattice at the requested number density of monomers. Over the frames, every copy
+moves as a rigid body (small random translations and rotations) and the atoms are wrapped into the box, so that the
+units cut by the box boundaries have to be made whole, as in the production morphologies.
+
+The topology is written as a PSF (bonds and masses, any number of atoms), the frames as an XTC: both are read by
+`load_universe` (`-s` and `-x` of `predict_overlaps--pairs.py`).
+"""
+
+import os, sys
+import numpy as np
+
+
+LIBDIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+
+def unit_pdb(polymer, state="neutral"):
+    """
+    Path of the PDB file of the QC-optimized unit of `polymer` (e.g., "PMAP") in the given `state` (neutral/radical_anion).
+    """
+    pdb_file = os.path.join(LIBDIR, f'NMPHTH-{polymer}-opt-{state}-wB97X.pdb')
+    if not os.path.exists(pdb_file):
+        sys.exit(f"ERROR! {pdb_file} not found; no QC-optimized unit for polymer '{polymer}'. Exiting...")
+    return pdb_file
+
+
+def load_unit(pdb_file):
+    """
+    Reads the unit to be replicated --> dict of atom names, types (elements), masses, positions (centred on the COM), and bonds.
+    """
+    import MDAnalysis as mda
+    unit = mda.Universe(pdb_file).atoms
+    unit.guess_bonds()
+    positions = unit.positions.astype(np.float64)
+    return {"names"    : list(unit.names),
+            "types"    : list(unit.elements),
+            "masses"   : unit.masses.astype(np.float64),
+            "positions": positions - unit.center_of_mass(),
+            "bonds"    : unit.bonds.to_indices()}
+
+
+def box_length(n_monomers, number_density):
+    """
+    Edge (Å) of the cubic box holding `n_monomers` at `number_density` (monomers/nm^3).
+    """
+    return 10. * (n_monomers / number_density)**(1./3.)
+
+
+def random_rotations(n, rng, max_angle=np.pi):
+    """
+    `n` random rotation matrices (n, 3, 3): uniformly distributed if `max_angle` = pi, else by angles up to `max_angle` (rad).
+    """
+    from scipy.spatial.transform import Rotation
+    if max_angle >= np.pi:
+        return Rotation.random(n, random_state=rng).as_matrix()
+    axes = rng.normal(size=(n, 3))
+    axes /= np.linalg.norm(axes, axis=1)[:, None]
+    return Rotation.from_rotvec(axes * rng.uniform(0., max_angle, size=(n, 1))).as_matrix()
+
+
+def synthetic_frames(unit, n_monomers, box, n_frames, seed=0, step=0.5, max_angle=0.2):
+    """
+    Yields the positions (n_monomers*n_atoms_per_unit, 3) of the `n_frames` frames, wrapped into the cubic `box` (Å).
+
+    Parameters
+    ----------
+    unit: dict
+        The unit to be replicated (see `load_unit`).
+    n_monomers: int
+        Number of copies of the unit.
+    box: float
+        Edge of the cubic box (Å).
+    n_frames: int
+        Number of frames.
+    seed: int
+        Seed of the random number generator (same seed --> same morphology).
+    step: float
+        Standard deviation (Å) of the per-frame random displacement of the COM of each unit, along each axis.
+    max_angle: float
+        Largest per-frame rotation (rad) of each unit about its COM.
+    """
+    rng = np.random.default_rng(seed)
+    n_side  = int(np.ceil(n_monomers**(1./3.)))
+    spacing = box / n_side
+    sites   = np.stack(np.meshgrid(*[np.arange(n_side)]*3, indexing='ij'), axis=-1).reshape(-1, 3)
+    sites   = sites[rng.permutation(len(sites))[:n_monomers]]
+    COMs      = (sites + 0.5 + rng.uniform(-0.25, 0.25, size=(n_monomers, 3))) * spacing
+    rotations = random_rotations(n_monomers, rng)
+    for frame in range(n_frames):
+        if frame > 0:
+            COMs      = COMs + rng.normal(scale=step, size=COMs.shape)
+            rotations = random_rotations(n_monomers, rng, max_angle) @ rotations
+        positions = np.einsum('mij,aj->mai', rotations, unit["positions"]) + COMs[:, None, :]
+        yield np.mod(positions.reshape(-1, 3), box).astype(np.float32)
+
+
+def write_psf(filename, unit, n_monomers, resname):
+    """
+    Writes the topology of `n_monomers` copies of the `unit` (one residue `resname` each) to `filename` (NAMD-style PSF).
+    """
+    n_atoms = len(unit["names"])
+    with open(filename, 'w') as f:
+        f.write("PSF NAMD\n\n       1 !NTITLE\n REMARKS synthetic morphology (see src/synthetic.py)\n\n")
+        f.write(f"{n_monomers*n_atoms:8d} !NATOM\n")
+        for m in range(n_monomers):
+            f.write("".join(f"{m*n_atoms+a+1:8d} SYN {m+1:d} {resname} {name} {atom_type} 0.000000 {mass:.4f} 0\n"
+                            for a, (name, atom_type, mass) in enumerate(zip(unit["names"], unit["types"], unit["masses"]))))
+        bonds = (unit["bonds"][None, :, :] + n_atoms*np.arange(n_monomers)[:, None, None]).reshape(-1, 2) + 1
+        f.write(f"\n{len(bonds):8d} !NBOND: bonds\n")
+        for start in range(0, len(bonds), 4):
+            f.write("".join(f"{i:8d}{j:8d}" for i, j in bonds[start:start+4]) + "\n")
+        f.write("\n")
+
+
+def write_synthetic_morphology(output_prefix, polymer="PMAP", n_monomers=1000, number_density=3.0, n_frames=1, seed=0, VERBOSE=False):
+    """
+    Writes a synthetic morphology (`{output_prefix}.psf` + `{output_prefix}.xtc`) made of `n_monomers` copies of the unit of
+    `polymer` at `number_density` (monomers/nm^3), with `n_frames` frames. Files already there are reused.
+
+    Returns
+    --------
+    files: dict
+        Paths of the topology ("psf") and of the trajectory ("xtc"), and edge of the box ("box", Å).
+    """
+    from MDAnalysis.lib.formats.libmdaxdr import XTCFile
+    box   = box_length(n_monomers, number_density)
+    files = {"psf": f"{output_prefix}.psf", "xtc": f"{output_prefix}.xtc", "box": box}
+    if os.path.exists(files["psf"]) and os.path.exists(files["xtc"]):
+        return files
+
+    unit = load_unit(unit_pdb(polymer))
+    os.makedirs(os.path.dirname(os.path.abspath(output_prefix)), exist_ok=True)
+    write_psf(f'{files["psf"]}.tmp', unit, n_monomers, polymer)
+    with XTCFile(f'{files["xtc"]}.tmp.xtc', 'w') as xtc: # GROMACS units (nm)
+        for frame, positions in enumerate(synthetic_frames(unit, n_monomers, box, n_frames, seed)):
+            xtc.write(positions/10., np.eye(3)*box/10., frame+1, 10.*frame) # one frame every 10 ps
+    os.replace(f'{files["xtc"]}.tmp.xtc', files["xtc"]) # the topology last: both are there only if both are complete
+    os.replace(f'{files["psf"]}.tmp', files["psf"])
+    if VERBOSE:
+        print(f"- INFO - synthetic {polymer} morphology: {n_monomers} monomers, {n_frames} frames, box of {box:.2f} Å --> {files['psf']}, {files['xtc']}")
+    return files
+
+
+def write_synthetic_model(output_file, n_features=144, n_neurons=(400, 400, 400, 400), activation="relu", seed=0):
+    """
+    Writes a NN with random weights, the architecture of the trained overlap NNs (by default, 4x400 dense layers)
+    and the format of the NumPy engine (see `src/numpy_mlp.py`): same cost of inference, meaningless predictions.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = [n_features, *n_neurons, 1]
+    arrays = {}
+    for k, (n_in, n_out) in enumerate(zip(sizes[:-1], sizes[1:])):
+        arrays[f'W_{k}'] = rng.normal(scale=np.sqrt(2./n_in), size=(n_in, n_out))
+        arrays[f'b_{k}'] = np.zeros(n_out)
+    activations = [activation]*len(n_neurons) + ['linear']
+    np.savez(output_file, n_layers=len(sizes)-1, activations=np.array(activations), **arrays)
+    return output_file
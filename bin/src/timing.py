@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Hot-path instrumentation: wall time and number of calls accumulated per stage, and peak resident memory.
+
+The stages of the per-frame pipeline (`src/prediction.py`, `src/functions.py`) are timed by the timer of the process
+(`TIMER`); in the worker processes, the accumulated timings are handed back with each frame result (`TIMER.pop()`)
+and summed by `predict_overlaps--pairs.py`, which writes them to a JSON report.
+"""
+
+import sys
+import time
+import resource
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    Wall time and number of calls accumulated per stage (`with timer.stage("neighbour_search"): ...`).
+    The time of a stage excludes that of the stages nested in it (e.g., the unwrapping done while reading a frame),
+    so that the times of all the stages add up.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.calls = {}
+        self._nested = [] # time spent in nested stages, per open stage
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self._nested.append(0.)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[name] = self.times.get(name, 0.) + elapsed - self._nested.pop()
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def merge(self, timings):
+        """
+        Adds the `timings` (see `as_dict`) of another timer (e.g., of a worker process).
+        """
+        for name, timing in timings.items():
+            self.times[name] = self.times.get(name, 0.) + timing["time_s"]
+            self.calls[name] = self.calls.get(name, 0) + timing["calls"]
+
+    def as_dict(self):
+        return {name: {"time_s": self.times[name], "calls": self.calls[name]} for name in self.times}
+
+    def pop(self):
+        """
+        Returns the timings accumulated so far and resets the timer.
+        """
+        timings = self.as_dict()
+        self.times, self.calls = {}, {}
+        return timings
+
+
+# Timer of the current process (used by the per-frame pipeline)
+TIMER = StageTimer()
+
+
+def peak_rss_MB(children=False):
+    """
+    Peak resident set size (MB) of the current process (or of its terminated child processes, e.g., the workers).
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return maxrss/1024**2 if sys.platform == "darwin" else maxrss/1024 # bytes on macOS, KB on Linux
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Per-frame unwrapping of the groups used by the predictor (e.g., the N-methyl-phthalimide atoms of every MONOMER).
+
+Instead of making whole every chain (`make_whole` on each fragment, ~5 s per 100-chain frame), only the atoms of the groups
+are unwrapped: the bonds within each group are traversed (breadth first) *once*, which gives (parent, child) pairs of atoms
+sorted by depth; every frame, the children of each depth, across all the groups, are put next to their (already unwrapped)
+parents by a vectorized minimum image. `UnwrapGroups` plugs this in as an on-the-fly transformation of the trajectory,
+so every frame that is read (not only the first one) comes with whole groups.
+"""
+
+import numpy as np
+from collections import deque
+from MDAnalysis.exceptions import NoDataError
+from MDAnalysis.transformations.base import TransformationBase
+import src.functions as srcfunctions
+from src.timing import TIMER
+
+
+def build_unwrap_levels(universe, group_indices):
+    """
+    Precomputes the traversal of the bonds within each group (all groups at once).
+
+    Parameters
+    ----------
+    universe: MDAnalysis.Universe
+        The morphology (its bonds are used; without bonds, every atom is unwrapped with respect to the first one of its group).
+    group_indices: ndarray
+        Atom indices of the groups with dimensions (n_groups, n_atoms) (see `build_group_index_table`).
+
+    Returns
+    --------
+    levels: list
+        One (parents, children) pair of atom index arrays per depth of the traversal; the first atom of each group is the root.
+    """
+    group_of_atom = np.full(len(universe.atoms), -1)
+    group_of_atom[group_indices] = np.arange(len(group_indices))[:, None]
+    try:
+        bonds = universe.bonds.to_indices()
+    except NoDataError:
+        bonds = np.zeros((0, 2), dtype=int)
+    bonds = bonds[(group_of_atom[bonds[:, 0]] >= 0) & (group_of_atom[bonds[:, 0]] == group_of_atom[bonds[:, 1]])]
+
+    neighbours = {}
+    for i, j in bonds:
+        neighbours.setdefault(i, []).append(j)
+        neighbours.setdefault(j, []).append(i)
+
+    levels = {}
+    for group in group_indices:
+        root = group[0]
+        depth = {root: 0}
+        queue = deque([root])
+        while queue:
+            parent = queue.popleft()
+            for child in neighbours.get(parent, []):
+                if child not in depth:
+                    depth[child] = depth[parent] + 1
+                    levels.setdefault(depth[child], []).append((parent, child))
+                    queue.append(child)
+        for atom in group[1:]: # atoms not bonded to the rest of the group (e.g., no bonds in the topology)
+            if atom not in depth:
+                levels.setdefault(1, []).append((root, atom))
+
+    return [tuple(np.array(pairs, dtype=np.int64).T) for _, pairs in sorted(levels.items())]
+
+
+def unwrap_positions(positions, levels, box):
+    """
+    Unwraps (in place) the `positions` (n_atoms_tot, 3) of the groups, following the `levels` of `build_unwrap_levels`.
+    """
+    for parents, children in levels:
+        positions[children] = positions[parents] + srcfunctions.minimum_image(positions[children] - positions[parents], box)
+    return positions
+
+
+class UnwrapGroups(TransformationBase):
+    """
+    On-the-fly transformation making the groups whole in every frame that is read:
+    `universe.trajectory.add_transformations(UnwrapGroups(build_unwrap_levels(universe, group_indices)))`.
+    """
+
+    def __init__(self, levels, max_threads=None, parallelizable=True):
+        super().__init__(max_threads=max_threads, parallelizable=parallelizable)
+        self.levels = levels
+
+    def _transform(self, ts):
+        with TIMER.stage("make_whole"):
+            ts.positions = unwrap_positions(ts.positions, self.levels, ts.dimensions)
+        return ts